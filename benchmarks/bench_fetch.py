@@ -0,0 +1,82 @@
+"""
+Source: bench_fetch.py
+
+Purpose: Benchmark of the column-wise fetch (db_fetch.fetch_frame) against the
+row-tuple DataFrame construction (pd.DataFrame(res.fetchall(), columns=res.keys()))
+on a synthetic SQLite table.
+
+Usage: python benchmarks/bench_fetch.py [--rows 1000000] [--repeat 3]
+"""
+
+import sys
+import time
+import argparse
+import pathlib
+import sqlite3
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import sqlalchemy as sa
+import pandas as pd
+import db_fetch
+
+
+def create_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute('create table t(id integer primary key, qty integer, price real, code text, maybe integer)')
+    conn.executemany('insert into t values (?, ?, ?, ?, ?)',
+                     ((i, i % 1000, i * 0.25, f'C{i % 50:03d}', i if i % 3 else None) for i in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def rows_path(engine):
+    res = engine.execute(sa.text('select * from t'))
+    return pd.DataFrame(res.fetchall(), columns=res.keys())
+
+
+def columns_path(engine):
+    res = engine.execute(sa.text('select * from t'))
+    return db_fetch.fetch_frame(res)
+
+
+def measure(fn, engine, repeat):
+    timings = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = fn(engine)
+        timings.append(time.perf_counter() - start)
+        del df
+    tracemalloc.start()
+    df = fn(engine)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peak, df
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / 'bench.db'
+        create_db(path, args.rows)
+        engine = sa.create_engine(f'sqlite:///{path}')
+
+        results = dict()
+        for name, fn in (('row tuples', rows_path), ('column-wise', columns_path)):
+            results[name] = measure(fn, engine, args.repeat)
+
+        pd.testing.assert_frame_equal(results['row tuples'][2], results['column-wise'][2])
+
+        print(f'{args.rows} rows')
+        for name, (elapsed, peak, df) in results.items():
+            print(f'{name:12} {elapsed:8.3f} s  peak {peak / 2 ** 20:8.1f} MB  {args.rows / elapsed:12,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
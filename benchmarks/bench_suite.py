@@ -0,0 +1,279 @@
+"""
+Source: bench_suite.py
+
+Purpose: Reproducible benchmarks of the db_utils hot paths (exec_sql, sql2df, load_table,
+get_table_counts, print_tabular_data) and of the %sql magic dispatch on synthetic SQLite
+databases of several sizes and shapes.
+
+Shapes:
+    narrow   5 mixed columns (int, float, short text, date text, nullable int)
+    wide     60 numeric columns
+    strings  10 text columns of varying length and cardinality
+    nulls    12 mixed columns, 80% NULL
+
+The databases are generated with a fixed seed and kept in --data-dir, so repeated runs (and
+runs on different commits) measure the same data. Every benchmark reports the min and median
+of --repeat timed runs and the peak python memory (tracemalloc) of one extra run.
+Results are written as JSON (--output) and can be compared with a previous run (--compare);
+the exit code is 1 if any benchmark is slower than --threshold times its baseline.
+
+Runs offline: the db alias config, query history and result cache are redirected to
+temporary files, nothing under ~/config or ~/.cache is read or written.
+
+Usage:
+    python benchmarks/bench_suite.py [--sizes 10000,200000] [--shapes narrow,wide] [--repeat 5]
+                                     [--filter exec_sql] [--output before.json]
+    python benchmarks/bench_suite.py --output after.json --compare before.json [--threshold 1.15]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import pathlib
+import argparse
+import platform
+import datetime
+import tempfile
+import contextlib
+import statistics
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault('SQLALCHEMY_SILENCE_UBER_WARNING', '1')
+
+import sqlalchemy as sa
+import pandas as pd
+import db_utils as dbu
+import db_history
+from db_cache import result_cache
+from db_config import ConfigLoader, parse_ini_config
+
+default_data_dir = pathlib.Path(tempfile.gettempdir()) / 'ipython-sql-ext-bench'
+seed = 20240101
+
+
+def _narrow(rnd, i):
+    return (i, rnd.randrange(1000), rnd.random() * 1000, f'C{rnd.randrange(50):03d}',
+            f'2020-{rnd.randrange(1, 13):02d}-{rnd.randrange(1, 29):02d}', i if i % 3 else None)
+
+
+def _wide(rnd, i):
+    return (i,) + tuple(rnd.randrange(100000) if c % 2 else rnd.random() for c in range(59))
+
+
+_words = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliett']
+
+
+def _strings(rnd, i):
+    return (i, f'K{i:08d}', rnd.choice(_words), ' '.join(rnd.choices(_words, k=rnd.randrange(1, 12))),
+            f'user{rnd.randrange(5000)}@example.com', rnd.choice(['Y', 'N']), f'{rnd.randrange(10 ** 6):06d}',
+            rnd.choice(_words).upper() * rnd.randrange(1, 4), f'/path/{rnd.choice(_words)}/{i}', rnd.choice(_words[:3]))
+
+
+def _nulls(rnd, i):
+    def maybe(v):
+        return v if rnd.random() < 0.2 else None
+    return (i, maybe(rnd.randrange(100)), maybe(rnd.random()), maybe(rnd.choice(_words)),
+            maybe(rnd.randrange(10 ** 6)), maybe(f'2021-01-{rnd.randrange(1, 29):02d}'), maybe(rnd.random() * 100),
+            maybe(rnd.choice(_words[:4])), maybe(rnd.randrange(2)), maybe(rnd.random()), maybe(i), maybe(str(i)))
+
+
+# shape: (column ddl, row generator, group by column of get_table_counts)
+shapes = {
+    'narrow': ('id integer primary key, qty integer, price real, code text, day text, maybe integer',
+               _narrow, 'code'),
+    'wide': ('id integer primary key, ' + ', '.join(f'c{c:02d} {"integer" if c % 2 else "real"}' for c in range(1, 60)),
+             _wide, 'c01'),
+    'strings': ('id integer primary key, k text, word text, sentence text, email text, flag text, num text, '
+                'shout text, path text, tier text', _strings, 'word'),
+    'nulls': ('id integer primary key, a integer, b real, c text, d integer, e text, f real, g text, h integer, '
+              'i real, j integer, k text', _nulls, 'g'),
+}
+
+
+def create_db(path, shape, rows):
+    ddl, generator, _ = shapes[shape]
+    tmp = path.with_suffix('.tmp')
+    if tmp.exists():
+        tmp.unlink()
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(tmp)
+    conn.execute(f'create table t({ddl})')
+    width = ddl.count(',') + 1
+    conn.executemany(f'insert into t values ({", ".join("?" * width)})', (generator(rnd, i) for i in range(rows)))
+    conn.commit()
+    conn.close()
+    os.replace(tmp, path)
+
+
+def setup_aliases(data_dir, datasets):
+    """Creates missing databases and points db_utils at a config with one alias per dataset"""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    config = ['# generated by bench_suite.py']
+    for shape, rows in datasets:
+        path = data_dir / f'{shape}-{rows}-{seed}.db'
+        if not path.exists():
+            start = time.perf_counter()
+            create_db(path, shape, rows)
+            print(f'Created {path} in {time.perf_counter() - start:.1f} s')
+        config += [f'[{dataset_alias(shape, rows)}]', 'db = sqlite', f'host = {path}', '']
+    config_path = data_dir / 'dbaccess.cfg'
+    config_path.write_text('\n'.join(config))
+    dbu.config_loader = ConfigLoader(config_path, parse_ini_config)
+
+
+def dataset_alias(shape, rows):
+    return f'BENCH_{shape.upper()}_{rows}'
+
+
+def measure(fn, repeat):
+    fn()  # warm up (engine, lazy imports, sqlite page cache)
+    timings = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'min': min(timings), 'median': statistics.median(timings), 'peak_bytes': peak}
+
+
+def start_shell():
+    from IPython.core.interactiveshell import InteractiveShell
+    shell = InteractiveShell.instance()
+    shell.run_line_magic('load_ext', 'sql_ext')
+    return shell
+
+
+def benchmarks(shape, rows, shell):
+    """Returns [(name, fn)] for one dataset"""
+    alias = dataset_alias(shape, rows)
+    engine = dbu.get_engine(alias)
+    group_by = shapes[shape][2]
+    df = dbu.sql2df('select * from t', engine)
+
+    def quiet(fn, *args, **kwargs):
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                return fn(*args, **kwargs)
+        return run
+
+    return [
+        ('exec_sql', lambda: dbu.exec_sql('select * from t', engine, compact=False, max_bytes=0)),
+        ('sql2df', lambda: dbu.sql2df('select * from t', engine)),
+        ('load_table', quiet(dbu.load_table, 't', engine, compact=False)),
+        ('get_table_counts', lambda: dbu.get_table_counts('t', [group_by], engine, print_result=False)),
+        ('get_table_counts_total', lambda: dbu.get_table_counts('t', [], engine, print_result=False)),
+        ('print_tabular_data', quiet(dbu.print_tabular_data, df)),
+        ('print_tabular_data_all', quiet(dbu.print_tabular_data, df.head(50000), 0)),
+        ('sql_magic', quiet(shell.run_line_magic, 'sql', f'-d {alias} --no-cache --max-bytes 0 select * from t')),
+        ('sql_magic_dispatch', quiet(shell.run_line_magic, 'sql', f'-d {alias} --no-cache select * from t limit 1')),
+        ('exec_sql_limit_1', lambda: dbu.exec_sql('select * from t limit 1', engine, compact=False)),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=pathlib.Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    datasets = [(shape, rows) for shape in args.shapes for rows in args.sizes]
+    setup_aliases(args.data_dir, datasets)
+
+    history = tempfile.TemporaryDirectory()
+    db_history.writer.path = pathlib.Path(history.name) / 'history.db'
+    result_cache.enabled = False
+    shell = start_shell()
+
+    results = list()
+    for shape, rows in datasets:
+        for name, fn in benchmarks(shape, rows, shell):
+            if args.filter and not any(f in name for f in args.filter):
+                continue
+            result = {'name': name, 'shape': shape, 'rows': rows, **measure(fn, args.repeat)}
+            results.append(result)
+            print(f'{name:24} {shape:8} {rows:>9}  min {result["min"]:9.4f} s  median {result["median"]:9.4f} s  '
+                  f'peak {result["peak_bytes"] / 2 ** 20:8.1f} MB')
+
+    db_history.writer.flush()
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sqlite': sqlite3.sqlite_version,
+            'pandas': pd.__version__,
+            'sqlalchemy': sa.__version__,
+            'repeat': args.repeat,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Prints current vs baseline timings, returns the number of regressions"""
+    base = {(r['name'], r['shape'], r['rows']): r for r in baseline['results']}
+    print(f'\nCompared with {baseline["meta"].get("commit")} ({baseline["meta"].get("created")})')
+    regressions = 0
+    for r in current['results']:
+        b = base.get((r['name'], r['shape'], r['rows']))
+        if b is None:
+            continue
+        ratio = r['min'] / b['min'] if b['min'] else float('inf')
+        mem_ratio = r['peak_bytes'] / b['peak_bytes'] if b['peak_bytes'] else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = 'SLOWER'
+            regressions += 1
+        elif ratio < 1 / threshold:
+            flag = 'faster'
+        print(f'{r["name"]:24} {r["shape"]:8} {r["rows"]:>9}  {b["min"]:9.4f} -> {r["min"]:9.4f} s  x{ratio:5.2f}  '
+              f'mem x{mem_ratio:5.2f}  {flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='db_utils benchmark suite')
+    parser.add_argument('--sizes', type=lambda s: [int(n) for n in s.split(',')], default=[10000, 200000],
+                        help='Rows of the synthetic tables, comma separated. Default: 10000,200000')
+    parser.add_argument('--shapes', type=lambda s: s.split(','), default=list(shapes),
+                        help=f'Comma separated subset of {",".join(shapes)}. Default: all')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', type=lambda s: s.split(','), help='Only run benchmarks whose name contains one of these')
+    parser.add_argument('--data-dir', type=pathlib.Path, default=default_data_dir,
+                        help=f'Directory of the generated databases. Default: {default_data_dir}')
+    parser.add_argument('--output', type=pathlib.Path, help='Write the results as JSON to this file')
+    parser.add_argument('--compare', type=pathlib.Path, help='JSON results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.15,
+                        help='Ratio to the baseline reported as a regression. Default: 1.15')
+    args = parser.parse_args()
+
+    unknown = set(args.shapes) - set(shapes)
+    if unknown:
+        parser.error(f'unknown shapes: {", ".join(sorted(unknown))}')
+
+    current = run(args)
+    if args.output:
+        args.output.write_text(json.dumps(current, indent=2))
+        print(f'Results written to {args.output}')
+    if args.compare:
+        if compare(current, json.loads(args.compare.read_text()), args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
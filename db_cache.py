@@ -0,0 +1,99 @@
+"""
+Source: db_cache.py
+
+Purpose: In-memory LRU cache of query results (pd.DataFrame) used by the %sql magic.
+
+Entries are keyed by normalized sql text, bound params, db alias and schema and
+are evicted by least recent use once the total deep memory usage of the cached
+DataFrames exceeds max_bytes, or when they are older than ttl seconds.
+"""
+
+import re
+import time
+import threading
+from collections import OrderedDict
+
+_whitespace_re = re.compile(r"""('(?:[^']|'')*'|"[^"]*")|\s+""")
+_comment_re = re.compile(r"""('(?:[^']|'')*'|"[^"]*")|--[^\n]*|/\*.*?\*/""", re.S)
+
+read_only_keywords = ('select', 'with', 'show', 'desc', 'describe', 'explain', 'values')
+_write_re = re.compile(r'\b(insert|update|delete|merge|into|for\s+update|nextval)\b')
+
+
+def normalize_sql(sql):
+    """Strips comments and collapses whitespace outside quoted literals/identifiers"""
+    sql = _comment_re.sub(lambda m: m.group(1) or ' ', sql)
+    return _whitespace_re.sub(lambda m: m.group(1) or ' ', sql).strip().rstrip(';').rstrip()
+
+
+def is_read_only(sql):
+    """Checks if sql is a statement that only reads data (select/with/show/desc/explain)"""
+    sql = normalize_sql(sql).lstrip('(').lower()
+    if not sql.startswith(read_only_keywords):
+        return False
+    # string literals may legitimately contain the keywords
+    return _write_re.search(re.sub(r"'(?:[^']|'')*'", "''", sql)) is None
+
+
+class ResultCache:
+    """LRU cache of DataFrames bounded by their deep memory usage"""
+
+    def __init__(self, max_bytes=512 * 2 ** 20, ttl=600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = False
+        self._entries = OrderedDict()  # key -> (df, nbytes, created)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    @staticmethod
+    def make_key(sql, params, db_alias, schema):
+        params = tuple(sorted((k, repr(v)) for k, v in (params or dict()).items()))
+        return normalize_sql(str(sql)), params, db_alias, schema
+
+    def get(self, key):
+        """Returns a copy of the cached DataFrame or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0].copy()
+
+    def put(self, key, df):
+        """Caches a copy of df, evicting least recently used entries to stay within max_bytes"""
+        nbytes = int(df.memory_usage(deep=True, index=True).sum())
+        if nbytes > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (df.copy(), nbytes, time.time())
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'entries': len(self._entries), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+result_cache = ResultCache()
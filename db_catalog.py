@@ -0,0 +1,447 @@
+"""
+Source: db_catalog.py
+
+Purpose: Local catalog index of the tables, views, columns and indexes of a database.
+
+The dictionary views (all_objects/all_tab_columns/all_ind_columns on oracle,
+information_schema on mysql, sqlite_master/pragmas on sqlite) are crawled once
+in bulk into a local SQLite database per connection, with trigram (FTS5) indexes
+on the table and column names so that LIKE '%x%' lookups do not scan. The catalog
+is refreshed incrementally: the object list is re-read and only the objects whose
+last ddl time changed (or that were created/dropped) get their columns and indexes
+crawled again. Every lookup first compares a cheap token of the dictionary (object count
+and last ddl time, the schema version on sqlite) with the one of the last crawl and
+refreshes the catalog when it differs, so tables created or altered since are found.
+"""
+
+import time
+import bisect
+import sqlite3
+import hashlib
+import pathlib
+import threading
+from db_lazy import LazyModule
+from db_fetch import frame_from_rows
+
+sa = LazyModule('sqlalchemy')
+
+catalog_dir = pathlib.Path().home() / '.cache' / 'ipython-sql-ext' / 'catalog'
+catalog_enabled = True
+# catalogs older than max_age seconds are refreshed incrementally on lookup (None: never)
+max_age = 60 * 60
+# compare the dictionary ddl token on every lookup (see Catalog.is_stale)
+check_on_lookup = True
+crawl_batch_size = 10000
+# seconds before the completion index is loaded again after a failure, doubled on every further failure
+index_retry = 60
+
+_schema = '''
+create table if not exists objects (
+    owner text collate nocase,
+    name text collate nocase,
+    type text,
+    last_ddl text,
+    last_analyzed text,
+    primary key (owner, name, type)
+);
+create table if not exists columns (
+    owner text collate nocase,
+    table_name text collate nocase,
+    column_name text collate nocase,
+    column_id integer,
+    nullable text,
+    data_type text,
+    data_length integer,
+    primary key (owner, table_name, column_name)
+);
+create table if not exists indexes (
+    owner text collate nocase,
+    table_name text collate nocase,
+    index_name text,
+    column_name text,
+    column_position integer,
+    index_type text,
+    status text,
+    last_analyzed text
+);
+create index if not exists columns_table on columns (table_name);
+create index if not exists indexes_table on indexes (table_name);
+create table if not exists meta (key text primary key, value text);
+'''
+
+_fts_schema = '''
+create virtual table if not exists objects_fts using fts5(name, content='objects', tokenize='trigram');
+create virtual table if not exists columns_fts using fts5(column_name, content='columns', tokenize='trigram');
+'''
+
+_oracle = {
+    'objects': '''select o.owner, o.object_name, o.object_type, to_char(o.last_ddl_time, 'yyyy-mm-dd hh24:mi:ss'),
+        to_char(t.last_analyzed, 'yyyy-mm-dd hh24:mi:ss')
+        from all_objects o left join all_tables t on t.owner = o.owner and t.table_name = o.object_name
+        where o.object_type in ('TABLE', 'VIEW')''',
+    'columns': '''select c.owner, c.table_name, c.column_name, c.column_id, c.nullable, c.data_type, c.data_length
+        from all_tab_columns c''',
+    'indexes': '''select a.table_owner, a.table_name, a.index_name, a.column_name, a.column_position, b.index_type,
+        b.status, to_char(b.last_analyzed, 'yyyy-mm-dd hh24:mi:ss')
+        from all_ind_columns a join all_indexes b on b.owner = a.index_owner and b.index_name = a.index_name''',
+    'ddl_check': '''select count(*), to_char(max(last_ddl_time), 'yyyy-mm-dd hh24:mi:ss') from all_objects
+        where object_type in ('TABLE', 'VIEW')''',
+}
+# incremental crawl: only the columns/indexes of the objects with a ddl time >= :since
+_oracle['columns_since'] = _oracle['columns'] + '''
+        join all_objects o on o.owner = c.owner and o.object_name = c.table_name and o.object_type in ('TABLE', 'VIEW')
+        where o.last_ddl_time >= to_date(:since, 'yyyy-mm-dd hh24:mi:ss')'''
+_oracle['indexes_since'] = _oracle['indexes'] + '''
+        join all_objects o on o.owner = a.table_owner and o.object_name = a.table_name and o.object_type = 'TABLE'
+        where o.last_ddl_time >= to_date(:since, 'yyyy-mm-dd hh24:mi:ss')'''
+
+_mysql_schemas = "('information_schema', 'mysql', 'performance_schema', 'sys')"
+_mysql = {
+    'objects': f'''select table_schema, table_name, case when table_type like '%VIEW%' then 'VIEW' else 'TABLE' end,
+        cast(create_time as char), cast(update_time as char)
+        from information_schema.tables where table_schema not in {_mysql_schemas}''',
+    'columns': f'''select c.table_schema, c.table_name, c.column_name, c.ordinal_position, c.is_nullable,
+        c.column_type, null from information_schema.columns c where c.table_schema not in {_mysql_schemas}''',
+    'indexes': f'''select c.table_schema, c.table_name, c.index_name, c.column_name, c.seq_in_index, c.index_type,
+        null, null from information_schema.statistics c where c.table_schema not in {_mysql_schemas}''',
+    'ddl_check': f'''select count(*), cast(max(create_time) as char) from information_schema.tables
+        where table_schema not in {_mysql_schemas}''',
+}
+# create_time is the ddl time on mysql (alter table rebuilds the table)
+_mysql_since = '''
+        and exists (select 1 from information_schema.tables o where o.table_schema = c.table_schema
+        and o.table_name = c.table_name and o.create_time >= :since)'''
+_mysql['columns_since'] = _mysql['columns'] + _mysql_since
+_mysql['indexes_since'] = _mysql['indexes'] + _mysql_since
+
+_sqlite = {
+    'objects': '''select null, name, upper(type), null, null from sqlite_master
+        where type in ('table', 'view') and name not like 'sqlite_%' ''',
+    'columns': '''select null, m.name, p.name, p.cid + 1, case when p."notnull" then 'N' else 'Y' end, p.type, null
+        from sqlite_master m join pragma_table_info(m.name) p where m.type in ('table', 'view')''',
+    'indexes': '''select null, m.name, l.name, i.name, i.seqno + 1, l.origin, null, null
+        from sqlite_master m join pragma_index_list(m.name) l join pragma_index_info(l.name) i
+        where m.type = 'table' ''',
+    'ddl_check': 'select schema_version, null from pragma_schema_version',
+}
+
+
+def _dialect_queries(engine):
+    drivername = engine.url.drivername
+    if drivername.startswith('oracle'):
+        return _oracle
+    elif drivername.startswith('mysql'):
+        return _mysql
+    elif drivername.startswith('sqlite'):
+        return _sqlite
+    raise Exception(f'{drivername} not supported!')
+
+
+def catalog_key(engine):
+    """Identifies the catalog of a db by its url without the password"""
+    url = engine.url
+    url = url.set(password=None) if hasattr(url, 'set') else url
+    return f'{engine.url.drivername.split("+")[0]}-{hashlib.sha1(str(url).encode()).hexdigest()[:16]}'
+
+
+class Catalog:
+    """Local catalog index of one db stored at catalog_dir/<key>.db"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.queries = _dialect_queries(engine)
+        self.path = catalog_dir / f'{catalog_key(engine)}.db'
+        self.fts = None
+        self._created = False
+        self._index = None
+        self._loader = None
+        self._index_failures = 0
+        self._index_retry_at = 0
+        self.index_error = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        if not self._created:
+            conn.executescript(_schema)
+            try:
+                conn.executescript(_fts_schema)
+                self.fts = True
+            except sqlite3.OperationalError:  # sqlite without fts5/trigram: plain LIKE scans
+                self.fts = False
+            self._created = True
+        return conn
+
+    def _meta(self, conn, key):
+        row = conn.execute('select value from meta where key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, conn, **values):
+        conn.executemany('insert or replace into meta (key, value) values (?, ?)',
+                         [(k, None if v is None else str(v)) for k, v in values.items()])
+
+    def crawled_at(self):
+        if not self.path.exists():
+            return None
+        with sqlite3.connect(self.path) as conn:
+            try:
+                value = self._meta(conn, 'crawled_at')
+            except sqlite3.OperationalError:
+                return None
+        return float(value) if value else None
+
+    def _ddl_check(self, remote):
+        """Cheap token of the db dictionary state (object count, last ddl time), None if not available"""
+        try:
+            return repr(tuple(remote.execute(sa.text(self.queries['ddl_check'])).fetchone()))
+        except sa.exc.DatabaseError:
+            return None
+
+    def is_stale(self):
+        """True if the ddl token of the db differs from the one of the last crawl"""
+        with self.engine.connect() as remote:
+            current = self._ddl_check(remote)
+        if current is None:
+            return False
+        with sqlite3.connect(self.path) as conn:
+            try:
+                return current != self._meta(conn, 'ddl_check')
+            except sqlite3.OperationalError:
+                return True
+
+    def _remote_rows(self, conn, sql, params=None):
+        res = conn.execution_options(stream_results=True).execute(sa.text(sql), params or {})
+        while True:
+            rows = res.fetchmany(crawl_batch_size)
+            if not rows:
+                break
+            yield [tuple(row) for row in rows]
+
+    def refresh(self, full=False, verbose=True):
+        """
+        Crawls the db dictionary into the local catalog.
+        Only the objects with a changed ddl time are crawled again unless full is True or
+        the catalog is empty; sqlite dbs are always fully crawled (no ddl times, cheap).
+        """
+        with self._lock:
+            start = time.perf_counter()
+            local = self._connect()
+            with self.engine.connect() as remote:
+                # read before the crawl: a ddl during the crawl leaves the catalog stale
+                ddl_check = self._ddl_check(remote)
+                objects = [row for rows in self._remote_rows(remote, self.queries['objects']) for row in rows]
+                since = self._meta(local, 'since')
+                full = full or since is None or 'columns_since' not in self.queries
+
+                known = {r[:3]: r[3] for r in local.execute('select owner, name, type, last_ddl from objects')}
+                current = {r[:3]: r[3] for r in objects}
+                changed = {k[:2] for k, ddl in current.items() if known.get(k, '') != ddl}
+                removed = {k[:2] for k in known.keys() - current.keys()}
+
+                with local:
+                    if full:
+                        for table in ('objects', 'columns', 'indexes'):
+                            local.execute(f'delete from {table}')
+                    else:
+                        for table, name in (('objects', 'name'), ('columns', 'table_name'), ('indexes', 'table_name')):
+                            local.executemany(f'delete from {table} where owner is ? and {name} = ?',
+                                              changed | removed)
+                    local.executemany('insert or replace into objects values (?, ?, ?, ?, ?)',
+                                      objects if full else [r for r in objects if r[:2] in changed])
+
+                    for table in ('columns', 'indexes'):
+                        if full:
+                            batches = self._remote_rows(remote, self.queries[table])
+                        elif changed:
+                            batches = self._remote_rows(remote, self.queries[f'{table}_since'], {'since': since})
+                        else:
+                            batches = []
+                        placeholders = ', '.join('?' * (7 if table == 'columns' else 8))
+                        for rows in batches:
+                            if not full:
+                                rows = [r for r in rows if r[:2] in changed]
+                            local.executemany(f'insert or replace into {table} values ({placeholders})', rows)
+
+                    if self.fts:
+                        local.execute("insert into objects_fts(objects_fts) values ('rebuild')")
+                        local.execute("insert into columns_fts(columns_fts) values ('rebuild')")
+                    ddl_times = [r[3] for r in objects if r[3] is not None]
+                    self._set_meta(local, crawled_at=time.time(), since=max(ddl_times) if ddl_times else None,
+                                   url=repr(self.engine.url), ddl_check=ddl_check)
+            local.close()
+            self._index = None
+            elapsed = time.perf_counter() - start
+            if verbose:
+                print(f'Catalog {"built" if full else "refreshed"}: {len(objects)} objects, '
+                      f'{len(changed) if not full else len(objects)} crawled, {len(removed)} removed in {elapsed:.1f}s')
+
+    def ensure_fresh(self, verbose=True):
+        """Builds the catalog on first use and refreshes it when it is older than max_age or stale (see is_stale)"""
+        crawled_at = self.crawled_at()
+        if crawled_at is None:
+            if verbose:
+                print(f'Building the local catalog of {self.engine.url.database or self.engine.url.host} '
+                      f'(use --live to bypass)')
+            self.refresh(full=True, verbose=verbose)
+        elif (max_age is not None and time.time() - crawled_at > max_age) or (check_on_lookup and self.is_stale()):
+            self.refresh(verbose=verbose)
+
+    def name_index(self):
+        """
+        Returns the NameIndex of the catalog for completion or None while it is being loaded.
+        Building/refreshing the catalog and loading the index happen in a background thread,
+        so this never waits for the db. After a failure (see index_error) loading is retried
+        after index_retry seconds, doubled on every further failure.
+        """
+        if self._index is None and (self._loader is None or not self._loader.is_alive()) and \
+                time.time() >= self._index_retry_at:
+            self._loader = threading.Thread(target=self._load_index, name='sql-catalog-index', daemon=True)
+            self._loader.start()
+        return self._index
+
+    def _load_index(self):
+        try:
+            self.ensure_fresh(verbose=False)
+            conn = self._connect()
+            try:
+                owners = [r[0] for r in conn.execute('select distinct owner from objects where owner is not null')]
+                objects = conn.execute('select owner, name from objects').fetchall()
+                columns = [r[0] for r in conn.execute('select distinct column_name from columns')]
+            finally:
+                conn.close()
+            self._index = NameIndex(owners, objects, columns, self._table_column_names)
+            self._index_failures, self.index_error = 0, None
+        except Exception as e:
+            # no print: this runs in the background of the completer
+            self._index_failures += 1
+            self._index_retry_at = time.time() + index_retry * 2 ** min(self._index_failures - 1, 6)
+            self.index_error = (str(e).splitlines() or [repr(e)])[0]
+
+    def _table_column_names(self, table_name):
+        conn = self._connect()
+        try:
+            return [r[0] for r in conn.execute('select column_name from columns where table_name = ? '
+                                               'order by column_id', (table_name,))]
+        finally:
+            conn.close()
+
+    def query(self, sql, params=()):
+        self.ensure_fresh()
+        conn = self._connect()
+        try:
+            cur = conn.execute(sql, params)
+            columns = [d[0] for d in cur.description]
+            return frame_from_rows(cur.fetchall(), columns)
+        finally:
+            conn.close()
+
+    def _name_filter(self, fts_table, column, pattern):
+        """LIKE filter on column using the trigram index (patterns with at least 3 chars between wildcards)"""
+        if self.fts:
+            return f'rowid in (select rowid from {fts_table} where {column} like ?)', (pattern,)
+        return f'{column} like ?', (pattern,)
+
+    def tables(self, pattern, object_type='TABLE'):
+        where, params = self._name_filter('objects_fts', 'name', pattern)
+        if object_type == 'VIEW':
+            columns = 'name table_name, owner, last_ddl'
+        else:
+            columns = 'name table_name, owner, last_analyzed'
+        return self.query(f'select {columns} from objects where type = ? and {where} order by 1, 2',
+                          (object_type,) + params)
+
+    def columns(self, pattern):
+        where, params = self._name_filter('columns_fts', 'column_name', pattern)
+        return self.query(f'''select owner, table_name, column_name, nullable, data_type, data_length from columns
+        where {where} order by owner, table_name, column_id''', params)
+
+    def table_columns(self, pattern):
+        return self.query('''select c.owner, c.table_name, c.column_name, c.nullable, c.data_type, c.data_length,
+        o.last_analyzed from columns c left join objects o on o.owner is c.owner and o.name = c.table_name
+        where c.table_name like ? order by c.owner, c.table_name, c.column_id''', (pattern,))
+
+    def indexes(self, pattern):
+        return self.query('''select table_name, index_name, column_name, column_position, index_type, status,
+        last_analyzed from indexes where table_name like ? order by owner, index_name, column_position''',
+                          (pattern,))
+
+    def status(self):
+        if not self.path.exists():
+            return {'path': str(self.path), 'built': False, 'index_error': self.index_error}
+        with sqlite3.connect(self.path) as conn:
+            counts = {t: conn.execute(f'select count(*) from {t}').fetchone()[0]
+                      for t in ('objects', 'columns', 'indexes')}
+            crawled_at = self._meta(conn, 'crawled_at')
+        return dict(path=str(self.path), built=True, **counts, fts=self.fts,
+                    age=round(time.time() - float(crawled_at)) if crawled_at else None,
+                    size=self.path.stat().st_size, index_error=self.index_error)
+
+    def drop(self):
+        with self._lock:
+            if self.path.exists():
+                self.path.unlink()
+            self._created = False
+
+
+class NameIndex:
+    """
+    Prefix lookups of schema, table and column names for completion.
+    Names are kept in case insensitively sorted arrays searched with bisect;
+    the columns of a table (for table.<prefix>) are loaded from the catalog on first use.
+    """
+
+    def __init__(self, owners, objects, columns, table_columns):
+        self.names = self._sorted(set(owners) | {name for _, name in objects} | set(columns))
+        self.qualified = self._sorted({f'{owner}.{name}' for owner, name in objects if owner})
+        self.schemas = {o.upper() for o in owners}
+        self.tables = {name.upper() for _, name in objects}
+        self._table_columns = table_columns
+        self._columns = dict()
+
+    @staticmethod
+    def _sorted(names):
+        names = sorted(names, key=str.upper)
+        return [n.upper() for n in names], names
+
+    @staticmethod
+    def _search(sorted_names, prefix, limit):
+        keys, names = sorted_names
+        prefix = prefix.upper()
+        lo = bisect.bisect_left(keys, prefix)
+        hi = bisect.bisect_left(keys, prefix + '\uffff', lo)
+        return names[lo:min(hi, lo + limit)]
+
+    def columns_of(self, table_name):
+        key = table_name.upper()
+        if key not in self._columns:
+            self._columns[key] = self._sorted(self._table_columns(table_name))
+        return self._columns[key]
+
+    def complete(self, token, limit=200):
+        """Names starting with token; schema.<prefix> completes tables, table.<prefix> columns"""
+        if '.' not in token:
+            return self._search(self.names, token, limit)
+        qualifier, prefix = token.rsplit('.', 1)
+        if qualifier.upper() in self.schemas:
+            return self._search(self.qualified, token, limit)
+        table = qualifier.rsplit('.', 1)[-1]
+        if table.upper() in self.tables:
+            return [f'{qualifier}.{c}' for c in self._search(self.columns_of(table), prefix, limit)]
+        return []
+
+
+_catalogs = dict()
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(engine):
+    """Returns the (shared) Catalog of the db engine is connected to"""
+    key = catalog_key(engine)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = _catalogs[key] = Catalog(engine)
+        else:
+            catalog.engine = engine
+        return catalog
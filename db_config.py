@@ -0,0 +1,73 @@
+"""
+Source: db_config.py
+
+Purpose: Cached loading of the db access config files shared by db_utils and db_utilities.
+
+Each config file is parsed once into an {alias: settings} table and re-parsed
+only when its mtime/size changes, so alias lookups are dict lookups.
+"""
+
+import os
+import threading
+import configparser
+
+
+class ConfigLoader:
+    """Parses a config file with parser(path) and caches the result until the file changes"""
+
+    def __init__(self, path, parser):
+        self.path = path
+        self.parser = parser
+        self._stamp = None
+        self._aliases = dict()
+        self._lock = threading.Lock()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def aliases(self):
+        """Returns the {alias: settings} table, re-parsing the file if it changed since the last call"""
+        stamp = self._file_stamp()
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    self._aliases = self.parser(self.path) if stamp is not None else dict()
+                    self._stamp = stamp
+        return self._aliases
+
+    def get(self, alias):
+        """Returns a copy of the settings for alias or None if the alias is not configured"""
+        settings = self.aliases().get(alias)
+        return dict(settings) if settings is not None else None
+
+    def __contains__(self, alias):
+        return alias in self.aliases()
+
+
+def parse_ini_config(path):
+    """Parser for the ini style ~/config/.dbaccess.cfg"""
+    config = configparser.ConfigParser()
+    config.read(path)
+    return {k: dict(config[k]) for k in config.sections()}
+
+
+def parse_pipe_config(path, header_lines=5):
+    """
+    Parser for the pipe delimited ~/config/.dbaccess (alias|host|port|user|password).
+    Lines starting with # are skipped, the last definition of an alias wins.
+    Aliases defined within the first header_lines lines are flagged with listed=False
+    """
+    aliases = dict()
+    with open(path) as f:
+        for lineno, line in enumerate(f):
+            if line.startswith('#') or '|' not in line:
+                continue
+            data = line.strip().split('|')
+            data += [''] * (5 - len(data))
+            aliases[data[0]] = {'alias': data[0], 'host': data[1], 'port': data[2], 'user': data[3],
+                                'password': data[4], 'listed': lineno >= header_lines}
+    return aliases
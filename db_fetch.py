@@ -0,0 +1,346 @@
+"""
+Source: db_fetch.py
+
+Purpose: Column-wise materialization of query results into pd.DataFrame.
+
+Rows are fetched in batches, transposed and converted per column straight into
+typed numpy arrays (int64, float64, bool, datetime64[ns], datetime64[ns, tz]) instead of building a
+list of row tuples for the whole result and letting pandas re-infer the dtypes.
+Only one batch of row objects is alive at a time.
+"""
+
+import os
+import sys
+import time
+import decimal
+import datetime
+from contextlib import contextmanager
+from db_lazy import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+db_spill = LazyModule('db_spill')  # imports db_fetch
+
+fetch_batch_size = 10000
+
+# memory budget (bytes) of exec_sql results, larger results are spilled to disk (see db_spill)
+# default: half of the physical memory, None: no limit
+try:
+    max_result_bytes = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+except (AttributeError, ValueError, OSError):
+    max_result_bytes = None
+
+# default for the compact option of exec_sql/load_table (see compact_frame)
+compact_results = False
+# object columns with at most category_threshold unique values per non null value become category
+category_threshold = 0.5
+
+_datetime_bounds = ('1677-09-22', '2262-04-11')  # datetime64[ns] range
+
+
+def description_kinds(description, dbapi=None):
+    """
+    Maps the cursor description type codes to column kinds.
+    String/binary columns are mapped to 'object' (no value inspection needed),
+    everything else to None which means the kind is inferred from the values.
+    """
+    kinds = list()
+    string_types = [getattr(dbapi, t) for t in ('STRING', 'BINARY') if dbapi is not None and hasattr(dbapi, t)]
+    for col in description or ():
+        code = col[1]
+        kinds.append('object' if code is not None and any(code == t for t in string_types) else None)
+    return kinds
+
+
+def _object_array(values):
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def to_array(values, kind=None, coerce_float=False):
+    """
+    Converts a tuple of column values into (kind, np.ndarray)
+    :param coerce_float: Decimal (mixed with int/float) values as float64, like pd.read_sql(coerce_float=True)
+    """
+    if kind == 'object':
+        return 'object', _object_array(values)
+
+    types = set(map(type, values))
+    has_nulls = type(None) in types
+    types.discard(type(None))
+
+    if not types:
+        return 'null', _object_array(values)
+    if types == {int}:
+        if not has_nulls:
+            try:
+                return 'int', np.fromiter(values, dtype=np.int64, count=len(values))
+            except OverflowError:
+                return 'object', _object_array(values)
+        return 'float', np.array(values, dtype=np.float64)
+    if types <= {int, float}:
+        return 'float', np.array(values, dtype=np.float64)
+    if coerce_float and types <= {int, float, decimal.Decimal}:
+        return 'float', np.fromiter((np.nan if v is None else float(v) for v in values), dtype=np.float64,
+                                    count=len(values))
+    if types == {bool} and not has_nulls:
+        return 'bool', np.fromiter(values, dtype=bool, count=len(values))
+    if types == {datetime.datetime}:
+        first = next(v for v in values if v is not None)
+        if first.tzinfo is None:
+            arr = np.array(values, dtype='datetime64[us]')
+            valid = arr[~np.isnat(arr)]
+            if not len(valid) or (valid.min() >= np.datetime64(_datetime_bounds[0])
+                                  and valid.max() < np.datetime64(_datetime_bounds[1])):
+                return 'datetime', arr.astype('datetime64[ns]')
+        else:
+            # tz aware: DatetimeArray in the tz of the values (utc if they have different tzinfos)
+            tzinfos = {v.tzinfo for v in values if v is not None}
+            try:
+                index = pd.to_datetime(values, utc=True)
+            except (pd.errors.OutOfBoundsDatetime, ValueError):
+                return 'object', _object_array(values)
+            return 'datetimetz', (index.tz_convert(first.tzinfo) if len(tzinfos) == 1 else index).array
+    return 'object', _object_array(values)
+
+
+def _as_object(kind, arr):
+    if kind == 'datetime':
+        # datetime64[us] -> datetime.datetime (NaT -> None)
+        return arr.astype('datetime64[us]').astype(object)
+    return arr.astype(object)
+
+
+def _null_array(n, kind):
+    if kind == 'float':
+        return np.full(n, np.nan)
+    return np.full(n, np.datetime64('NaT'), dtype='datetime64[ns]')
+
+
+def estimated_bytes(arr):
+    """Memory of a column part, the values of object arrays are estimated from a sample"""
+    if arr.dtype != object or not len(arr):
+        return arr.nbytes
+    sample = arr[::max(len(arr) // 100, 1)]
+    return arr.nbytes + len(arr) * sum(map(sys.getsizeof, sample)) // len(sample)
+
+
+class ColumnBuffer:
+    """Accumulates the values of one result column as a list of typed numpy arrays"""
+
+    def __init__(self, kind=None, coerce_float=False):
+        self.kind = kind
+        self.coerce_float = coerce_float
+        self.parts = list()
+        self.nbytes = 0
+
+    def append(self, values):
+        part = to_array(values, self.kind, self.coerce_float)
+        self.parts.append(part)
+        self.nbytes += estimated_bytes(part[1])
+
+    def to_array(self):
+        if not self.parts:
+            return np.empty(0, dtype=object)
+        kinds = {k for k, _ in self.parts}
+        if 'datetimetz' in kinds and kinds <= {'datetimetz', 'null'}:
+            if len(self.parts) == 1:
+                return self.parts[0][1]
+            # pd.concat keeps the tz dtype if all parts have the same tz (object otherwise)
+            dtype = next(a.dtype for k, a in self.parts if k == 'datetimetz')
+            return pd.concat([pd.Series(pd.NaT, index=range(len(a)), dtype=dtype) if k == 'null' else pd.Series(a)
+                              for k, a in self.parts], ignore_index=True).array
+        if len(kinds) == 1:
+            arrays = [a for _, a in self.parts]
+        elif kinds <= {'int', 'float', 'null'}:
+            arrays = [_null_array(len(a), 'float') if k == 'null' else a.astype(np.float64) for k, a in self.parts]
+        elif kinds == {'datetime', 'null'}:
+            arrays = [_null_array(len(a), 'datetime') if k == 'null' else a for k, a in self.parts]
+
+        else:
+            arrays = [_as_object(k, a) for k, a in self.parts]
+        return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+
+def _result_dbapi(res):
+    context = getattr(res, 'context', None)
+    return getattr(getattr(context, 'dialect', None), 'dbapi', None)
+
+
+class QueryProfile:
+    """
+    Per phase timings (seconds) of one query execution:
+    bind (bind variable resolution), checkout (connection from the pool), execute (server execute),
+    first_row (first fetch), fetch (remaining fetches), convert (typed column conversion/compaction)
+    and build (DataFrame assembly)
+    """
+
+    phases = ('bind', 'checkout', 'execute', 'first_row', 'fetch', 'convert', 'build')
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.timings = dict.fromkeys(self.phases, 0.0)
+        self.rows = 0
+        self.bytes = 0
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+
+    @property
+    def total(self):
+        return sum(self.timings.values())
+
+    def as_dict(self):
+        total = self.total
+        return dict(self.timings, total=total, rows=self.rows, bytes=self.bytes,
+                    rows_per_sec=self.rows / total if total else None,
+                    bytes_per_sec=self.bytes / total if total else None)
+
+    def report(self):
+        total = self.total
+        for name, elapsed in self.timings.items():
+            share = elapsed / total * 100 if total else 0
+            print(f'{name:>10}: {elapsed * 1000:10.2f} ms {share:5.1f}%')
+        print(f'{"total":>10}: {total * 1000:10.2f} ms')
+        if total:
+            print(f'{self.rows} rows, {format_size(self.bytes, 1)}, '
+                  f'{self.rows / total:,.0f} rows/s, {format_size(self.bytes / total, 1)}/s')
+
+
+def _row_fetcher(res):
+    """
+    Returns the fetchmany callable to read res with. The DBAPI cursor is read directly
+    when sqlalchemy has no per row work to do (unbuffered result without type processors),
+    which skips building a Row object per row.
+    """
+    strategy = type(getattr(res, 'cursor_strategy', None)).__name__
+    processors = getattr(getattr(res, '_metadata', None), '_processors', None)
+    if strategy == 'CursorFetchStrategy' and processors is not None and not any(processors):
+        return res.cursor.fetchmany
+    return res.fetchmany
+
+
+def frame_from_buffers(columns, buffers):
+    df = pd.DataFrame({i: buf.to_array() for i, buf in enumerate(buffers)}, copy=False)
+    df.columns = pd.Index(columns)
+    return df
+
+
+def frame_from_rows(rows, columns, kinds=None, coerce_float=False):
+    """Builds a DataFrame from a batch of rows converting column by column"""
+    buffers = [ColumnBuffer(k, coerce_float) for k in (kinds or [None] * len(columns))]
+    if rows:
+        for buf, values in zip(buffers, zip(*rows)):
+            buf.append(values)
+    return frame_from_buffers(columns, buffers)
+
+
+def fetch_frame(res, batch_size=None, profile=None, max_bytes=None, coerce_float=False):
+    """
+    Fetches all rows of a result proxy into a DataFrame, fetchmany(batch_size) rows at a time,
+    accumulating them directly into per column typed buffers
+    :param profile: QueryProfile collecting the first_row/fetch/convert/build timings
+    :param max_bytes: memory budget, once the buffered rows exceed it they and the remaining rows
+        are written to a spill file and a db_spill.SpilledResult is returned instead of a DataFrame
+    :param coerce_float: Decimal columns as float64 (see to_array)
+    """
+    profile = profile or QueryProfile(enabled=False)
+    batch_size = batch_size or fetch_batch_size
+    columns = list(res.keys())
+    kinds = description_kinds(res.cursor.description, _result_dbapi(res)) or [None] * len(columns)
+    buffers = [ColumnBuffer(k, coerce_float) for k in kinds]
+    fetchmany = _row_fetcher(res)
+    spill = None
+    phase = 'first_row'
+    while True:
+        with profile.phase(phase):
+            rows = fetchmany(batch_size)
+        phase = 'fetch'
+        if not rows:
+            break
+        with profile.phase('convert'):
+            if spill is not None:
+                spill.write(frame_from_rows(rows, columns, kinds, coerce_float))
+            else:
+                for buf, values in zip(buffers, zip(*rows)):
+                    buf.append(values)
+                if max_bytes and sum(buf.nbytes for buf in buffers) > max_bytes:
+                    spill = db_spill.SpillWriter()
+                    print(f'Result exceeds {format_size(max_bytes, 1)}, spilling to {spill.directory}')
+                    spill.write(frame_from_buffers(columns, buffers))
+                    buffers = None
+        profile.rows += len(rows)
+    res.close()
+    with profile.phase('build'):
+        if spill is not None:
+            return spill.close(columns)
+        return frame_from_buffers(columns, buffers)
+
+
+def fetch_chunks(res, chunksize):
+    """Generator yielding DataFrames of at most chunksize rows from a result proxy"""
+    columns = list(res.keys())
+    kinds = description_kinds(res.cursor.description, _result_dbapi(res)) or None
+    while True:
+        rows = res.fetchmany(chunksize)
+        if not rows:
+            break
+        yield frame_from_rows(rows, columns, kinds)
+
+
+def format_size(size, decimal_places):
+    for unit in ['bytes', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024.0:
+            break
+        size /= 1024.0
+    return "{size:.{decimal_places}f} {unit}".format(size=size, decimal_places=decimal_places, unit=unit)
+
+
+def df_size(df, as_bytes=False):
+    """Returns the size of a DataFrame (Index and the contents of object columns included) in human readable format"""
+    total = int(df.memory_usage(deep=True, index=True).sum())
+    return total if as_bytes else format_size(total, 1)
+
+
+def _compact_series(s, threshold):
+    if pd.api.types.is_bool_dtype(s.dtype):
+        return s
+    if pd.api.types.is_integer_dtype(s.dtype):
+        # signed only, unsigned dtypes wrap around on subtraction
+        return pd.to_numeric(s, downcast='integer')
+    if pd.api.types.is_float_dtype(s.dtype):
+        # float32 only when no precision is lost
+        s32 = s.astype(np.float32)
+        if ((s32.astype(np.float64) == s) | s.isna()).all():
+            return s32
+        return s
+    if s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) == 'string':
+        non_null = s.count()
+        if non_null and s.nunique(dropna=True) <= threshold * non_null:
+            return s.astype('category')
+    return s
+
+
+def compact_frame(df, threshold=None, report=False):
+    """
+    Returns df with integer/float columns downcast to the smallest lossless dtype and
+    low cardinality string columns converted to category
+    :param threshold: max ratio of unique to non null values for category conversion (default: category_threshold)
+    :param report: print memory usage before/after
+    """
+    threshold = category_threshold if threshold is None else threshold
+    before = df_size(df, as_bytes=True) if report else None
+    columns = df.columns
+    df = pd.DataFrame({i: _compact_series(df.iloc[:, i], threshold) for i in range(len(columns))}, copy=False)
+    df.columns = columns
+    if report:
+        print(f'Memory usage: {format_size(before, 1)} -> {df_size(df)}')
+    return df
+
@@ -0,0 +1,197 @@
+"""
+Source: db_history.py
+
+Purpose: Persistent history of the queries run through the %sql / %read_sql magics.
+
+Every execution is recorded in a local SQLite database (history_db) with its sql
+fingerprint, db alias, params shape, duration, rows, result bytes and error.
+The source column tells the magic (sql, read_sql, script) or cache for %sql result cache hits.
+Records are queued and written by a background thread in batches, so recording
+costs the query a queue put.
+"""
+
+import re
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import hashlib
+import pathlib
+import threading
+from db_cache import normalize_sql
+from db_fetch import estimated_bytes
+from db_lazy import LazyModule
+
+pd = LazyModule('pandas')
+db_spill = LazyModule('db_spill')
+
+history_db = pathlib.Path().home() / '.cache' / 'ipython-sql-ext' / 'history.db'
+history_enabled = True
+
+_literal_re = re.compile(r"""'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b""")
+_in_list_re = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+_schema = '''create table if not exists history (
+    id integer primary key,
+    ts real not null,
+    source text,
+    fingerprint text not null,
+    sql text,
+    alias text,
+    params text,
+    duration real,
+    rows integer,
+    bytes integer,
+    error text
+)'''
+
+
+def fingerprint_sql(sql):
+    """Returns (fingerprint, normalized sql) where literals are replaced with ? and in lists collapsed"""
+    sql = _literal_re.sub('?', normalize_sql(str(sql)).lower())
+    sql = _in_list_re.sub('(?)', sql)
+    return hashlib.md5(sql.encode()).hexdigest()[:16], sql
+
+
+def params_shape(params):
+    """Returns the bind parameter names and value types as json (values are not stored)"""
+    return json.dumps({k: type(v).__name__ for k, v in (params or dict()).items()}, sort_keys=True)
+
+
+class HistoryWriter:
+    """Writes queued history records to the history db in batches from a daemon thread"""
+
+    def __init__(self, path, batch_size=100, interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # set when the history db can not be opened, the records are then dropped
+        self.error = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='sql-history-writer', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def put(self, record):
+        if self.error is not None:
+            return
+        self._ensure_started()
+        self._queue.put_nowait(record)
+
+    def _connect(self):
+        pathlib.Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute(_schema)
+        conn.execute('create index if not exists history_fingerprint on history (fingerprint)')
+        return conn
+
+    def _run(self):
+        try:
+            conn = self._connect()
+        except (OSError, sqlite3.Error) as e:
+            self.error = e
+            print(f'Query history disabled: {e}')
+            while True:  # drop the queued records, so that flush does not wait for them
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                self._queue.task_done()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    conn.executemany('''insert into history (ts, source, fingerprint, sql, alias, params, duration,
+                    rows, bytes, error) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', batch)
+            except sqlite3.Error as e:
+                print(f'Query history: {e}')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self, timeout=10):
+        """Waits until all queued records are written, at most timeout seconds and not after the writer stopped"""
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks and self._thread.is_alive():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._queue.all_tasks_done.wait(min(remaining, 0.1))
+
+
+writer = HistoryWriter(history_db)
+
+
+def record(sql, alias=None, params=None, duration=None, rows=None, nbytes=None, error=None, source='sql'):
+    """Queues a history record of one query execution"""
+    if not history_enabled:
+        return
+    fingerprint, _ = fingerprint_sql(sql)
+    writer.put((time.time(), source, fingerprint, str(sql), alias, params_shape(params), duration, rows, nbytes,
+                (str(error).splitlines() or [repr(error)])[0] if error is not None else None))
+
+
+def result_stats(df):
+    """Returns (rows, bytes) of a query result, the object column values are estimated from a sample"""
+    if isinstance(df, pd.DataFrame):
+        # df.memory_usage(deep=True) measures every object value, too slow for every query
+        return len(df), sum(estimated_bytes(df.iloc[:, i].to_numpy()) if dtype == object
+                            else len(df) * getattr(dtype, 'itemsize', 8) for i, dtype in enumerate(df.dtypes))
+    if isinstance(df, db_spill.SpilledResult):
+        return len(df), df.nbytes
+    return None, None
+
+
+def read_history(top=20, fingerprint=None):
+    """Returns the last top executions (optionally for one fingerprint) as a DataFrame"""
+    writer.flush()
+    if not pathlib.Path(writer.path).exists():
+        return pd.DataFrame()
+    with sqlite3.connect(writer.path) as conn:
+        sql = 'select * from history' + (' where fingerprint = ?' if fingerprint else '') + ' order by id desc limit ?'
+        df = pd.read_sql(sql, conn, params=([fingerprint] if fingerprint else []) + [top])
+    df['ts'] = pd.to_datetime(df.ts, unit='s').dt.round('s')
+    return df
+
+
+def slow_queries(top=20):
+    """Returns per fingerprint latency stats (count, p50, p95, max, errors) ordered by p95 desc, without cache hits"""
+    writer.flush()
+    if not pathlib.Path(writer.path).exists():
+        return pd.DataFrame()
+    with sqlite3.connect(writer.path) as conn:
+        df = pd.read_sql("select fingerprint, sql, alias, duration, rows, error from history where source <> 'cache'",
+                         conn)
+    if df.empty:
+        return df
+    grouped = df.groupby('fingerprint')
+    stats = grouped.duration.agg(runs='count', p50=lambda x: x.quantile(0.5), p95=lambda x: x.quantile(0.95),
+                                 max='max')
+    stats['errors'] = grouped.error.count()
+    stats['avg_rows'] = grouped.rows.mean().round(0)
+    stats['sql'] = grouped.sql.last().map(lambda s: fingerprint_sql(s)[1][:80])
+    return stats.sort_values('p95', ascending=False).head(top).reset_index()
+
+
+def clear_history():
+    writer.flush()
+    if pathlib.Path(writer.path).exists():
+        with sqlite3.connect(writer.path) as conn:
+            conn.execute('delete from history')
@@ -0,0 +1,33 @@
+"""
+Source: db_lazy.py
+
+Purpose: Deferred imports for the heavy/optional dependencies (pandas, sqlalchemy, db drivers)
+so that loading the IPython extensions does not pay for them.
+"""
+
+import importlib
+
+
+class LazyModule:
+    """
+    Module proxy importing the real module on first attribute access.
+    A missing module raises ImportError at first use instead of at import time.
+
+    Usage: pd = LazyModule('pandas')
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<lazy module {self._name!r} ({state})>'
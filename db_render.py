@@ -0,0 +1,118 @@
+"""
+Source: db_render.py
+
+Purpose: Text table rendering (psql style borders) of query results.
+
+Only the head/tail window of long results is formatted (default_max_rows), column values are
+converted to strings column-wise and the widths computed on numpy string arrays, and
+the lines are written to the output in chunks instead of building one big string.
+"""
+
+import sys
+from db_lazy import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+# results longer than default_max_rows show the first and last default_max_rows / 2 rows (None: all rows)
+default_max_rows = 60
+# longer values are cut with ... (None: no limit)
+max_colwidth = 80
+# lines written to the output per write call
+chunk_lines = 1000
+
+
+def _is_number(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def format_column(s):
+    """Returns (np str array of the formatted values, right aligned) for a pd.Series"""
+    values = s.to_numpy()
+    dtype = s.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        strings, numeric = values.astype(str), False
+    elif pd.api.types.is_integer_dtype(dtype):
+        strings, numeric = values.astype(str), True
+    elif pd.api.types.is_float_dtype(dtype):
+        # 15 significant digits (7 for float32): exact for db decimals, %g would show 6
+        strings, numeric = np.char.mod('%.7g' if dtype.itemsize == 4 else '%.15g', values), True
+    elif pd.api.types.is_datetime64_any_dtype(dtype):
+        strings, numeric = s.astype(str).to_numpy(dtype=str), False
+    else:
+        # object columns: numbers (with - or None for nulls) are right aligned and floats formatted with %.15g
+        numeric = any(_is_number(v) for v in values) and \
+            all(_is_number(v) or v is None or (isinstance(v, str) and v == '-') for v in values)
+        strings = np.array([format(v, '.15g') if isinstance(v, float) else str(v) for v in values], dtype=str)
+        if len(strings):
+            strings = np.char.replace(np.char.replace(strings, '\r', ' '), '\n', ' ')
+    if max_colwidth is not None and len(strings) and strings.dtype.itemsize // 4 > max_colwidth:
+        long = np.char.str_len(strings) > max_colwidth
+        cut = np.char.add(strings.astype(f'U{max_colwidth - 3}'), '...')
+        strings = np.where(long, cut, strings)
+    return strings, numeric
+
+
+def _lines(headers, columns, numeric, elide_at=None):
+    widths = [max([len(h)] + ([int(np.char.str_len(c).max())] if len(c) else [])) for h, c in zip(headers, columns)]
+    if elide_at is not None:
+        widths = [max(w, 3) for w in widths]
+
+    def row_line(cells):
+        return '| ' + ' | '.join(cell.rjust(w) if num else cell.ljust(w)
+                                 for cell, w, num in zip(cells, widths, numeric)) + ' |'
+
+    border = '+' + '+'.join('-' * (w + 2) for w in widths) + '+'
+    yield border
+    yield row_line(headers)
+    yield '|' + '+'.join('-' * (w + 2) for w in widths) + '|'
+    rows = zip(*[c.tolist() for c in columns])
+    for i, cells in enumerate(rows):
+        if i == elide_at:
+            yield row_line(['...'] * len(widths))
+        yield row_line(cells)
+    if elide_at is not None and elide_at >= (len(columns[0]) if columns else 0):
+        yield row_line(['...'] * len(widths))
+    yield border
+
+
+def render_frame(df, max_rows=None, file=None, title_headers=False):
+    """
+    Writes df as a text table to file (default: sys.stdout)
+    :param max_rows: rows shown, the head and tail halves of longer results (default: default_max_rows, 0: all)
+    :param title_headers: headers as Title Case with _ replaced by spaces (df is not modified)
+    """
+    file = file or sys.stdout
+    limit = default_max_rows if max_rows is None else (max_rows or None)
+    n = len(df)
+    elide_at = None
+    if limit is not None and n > limit:
+        head = limit - limit // 2
+        window = pd.concat([df.iloc[:head], df.iloc[n - limit // 2:]]) if limit // 2 else df.iloc[:head]
+        elide_at = head
+    else:
+        window = df
+
+    headers = [str(c) for c in df.columns]
+    if title_headers:
+        headers = [h.replace('_', ' ').title() for h in headers]
+    formatted = [format_column(window.iloc[:, i]) for i in range(len(headers))]
+    columns = [c for c, _ in formatted]
+    numeric = [num for _, num in formatted]
+
+    chunk = list()
+    for line in _lines(headers, columns, numeric, elide_at):
+        chunk.append(line)
+        if len(chunk) >= chunk_lines:
+            file.write('\n'.join(chunk) + '\n')
+            chunk = list()
+    if elide_at is not None:
+        chunk.append(f'[{n} rows x {len(headers)} columns]')
+    if chunk:
+        file.write('\n'.join(chunk) + '\n')
+
+
+def render_rows(rows, headers, max_rows=None, file=None):
+    """Writes a sequence of row tuples (ex: cursor.fetchall()) as a text table, None values as -"""
+    df = pd.DataFrame.from_records(list(rows), columns=list(headers), coerce_float=False)
+    render_frame(df.astype(object).where(df.notna(), '-'), max_rows=max_rows, file=file)
@@ -0,0 +1,274 @@
+"""
+Source: db_script.py
+
+Purpose: Execution of multi statement sql scripts (see %sql_script).
+
+The script is split into statements on ; (or the mysql client DELIMITER), skipping string literals,
+quoted identifiers and comments. Oracle PL/SQL blocks (declare/begin and create procedure,
+function, package, trigger, type) end at a line holding only /, trigger bodies on the other dbs
+at the end matching their begin. The statements run in order over one connection.
+
+Directives in the comments before a statement:
+    -- @name NAME          result key of the statement (default: stmt_<n>)
+    -- @parallel [NAME]    consecutive @parallel SELECTs run concurrently, each on its own pooled
+                           connection (they only see committed data, not the script session state)
+"""
+
+import re
+import time
+import collections
+import concurrent.futures
+from db_lazy import LazyModule
+from db_cache import is_read_only
+from db_fetch import fetch_frame
+from db_utils import compile_statement
+
+sa = LazyModule('sqlalchemy')
+pd = LazyModule('pandas')
+
+Statement = collections.namedtuple('Statement', 'sql line plsql parallel name')
+
+_plsql_re = re.compile(r'''(create\s+(or\s+replace\s+)?((editionable|noneditionable)\s+)?
+                       (procedure|function|package|trigger|type|library)\b|declare\b|begin\b(?!\s*(;|transaction\b|work\b|
+                       deferred\b|immediate\b|exclusive\b)))''', re.I | re.X)
+_block_re = re.compile(r'create\s+(temp\w*\s+)?(trigger|procedure|function)\b', re.I)
+_slash_re = re.compile(r'[ \t]*/[ \t]*(\r?\n|$)')
+_delimiter_re = re.compile(r'[ \t]*delimiter[ \t]+(\S+)[ \t]*(\r?\n|$)', re.I)
+_directive_re = re.compile(r'--\s*@(parallel|name)\b[ \t]*(\w+)?', re.I)
+_word_re = re.compile(r'[a-z_]\w*', re.I)
+_end_re = re.compile(r'end\s+([a-z_]\w*)', re.I)
+_q_quote_close = {'[': ']', '{': '}', '(': ')', '<': '>'}
+
+
+def _skip_quoted(text, i, dialect):
+    """Returns the index after the string literal / quoted identifier starting at text[i]"""
+    if text[i] in 'qQ':
+        # oracle q'[...]'
+        close = _q_quote_close.get(text[i + 2], text[i + 2]) + "'"
+        end = text.find(close, i + 3)
+        return len(text) if end < 0 else end + 2
+    quote = text[i]
+    i += 1
+    while i < len(text):
+        c = text[i]
+        if c == '\\' and dialect == 'mysql' and quote != '`':
+            i += 2
+            continue
+        if c == quote:
+            if text.startswith(quote, i + 1):
+                i += 2
+                continue
+            return i + 1
+        i += 1
+    return i
+
+
+def split_statements(text, dialect=None):
+    """
+    Splits a sql script into a list of Statement(sql, line, plsql, parallel, name)
+    :param dialect: sqlalchemy dialect name (oracle: PL/SQL blocks end at /, mysql: backslash escapes)
+    """
+    statements = list()
+    delimiter = ';'
+    directives = dict()
+    start = None
+    plsql = block = False
+    depth = 0
+    i, n = 0, len(text)
+    line, counted = 1, 0  # line number of text[counted], statements start in increasing order
+
+    def finish(end):
+        nonlocal line, counted
+        sql = text[start:end].strip()
+        if sql:
+            line += text.count('\n', counted, start)
+            counted = start
+            statements.append(Statement(sql, line, plsql, 'parallel' in directives, directives.get('name') or None))
+
+    while i < n:
+        c = text[i]
+        if i == 0 or text[i - 1] == '\n':
+            m = _slash_re.match(text, i)
+            if m:
+                if start is not None:
+                    finish(i)
+                    start, directives = None, dict()
+                i = m.end()
+                continue
+            m = _delimiter_re.match(text, i) if start is None else None
+            if m:
+                delimiter = m.group(1)
+                i = m.end()
+                continue
+
+        if text.startswith('--', i):
+            end = text.find('\n', i)
+            end = n if end < 0 else end
+            m = _directive_re.match(text, i, end)
+            if m and start is None:
+                directives[m.group(1).lower()] = m.group(2)
+                if m.group(1).lower() == 'parallel':
+                    directives['name'] = m.group(2) or directives.get('name')
+            i = end
+            continue
+        if text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            continue
+
+        if start is None:
+            if c.isspace():
+                i += 1
+                continue
+            start = i
+            plsql = dialect == 'oracle' and bool(_plsql_re.match(text, i))
+            block = dialect != 'oracle' and delimiter == ';' and bool(_block_re.match(text, i))
+            depth = 0
+
+        if c in '\'"`' or (c in 'qQ' and text.startswith("'", i + 1) and i + 2 < n and
+                           (i == 0 or not (text[i - 1].isalnum() or text[i - 1] == '_'))):
+            i = _skip_quoted(text, i, dialect)
+            continue
+
+        if block and (c.isalpha() or c == '_') and (i == 0 or not (text[i - 1].isalnum() or text[i - 1] == '_')):
+            # begin/case ... end nesting of trigger bodies (end if / end loop close no counted block)
+            word = _word_re.match(text, i).group().lower()
+            if word in ('begin', 'case'):
+                depth += 1
+            elif word == 'end':
+                after = _end_re.match(text, i)
+                if not (after and after.group(1).lower() in ('if', 'loop', 'while', 'repeat')):
+                    depth -= 1
+            i += len(word)
+            continue
+
+        if not plsql and depth <= 0 and text.startswith(delimiter, i):
+            finish(i)
+            start, directives = None, dict()
+            i += len(delimiter)
+            continue
+        i += 1
+
+    if start is not None:
+        finish(n)
+    return statements
+
+
+def _statement_params(statement, engine, params):
+    compiled, binds = compile_statement(statement.sql, engine)
+    missing = [b for b in binds if b not in params]
+    if missing:
+        raise Exception(f"bind variable(s) {', '.join(':' + b for b in missing)} not defined (line {statement.line})")
+    return compiled, {b: params[b] for b in binds}
+
+
+def _execute(conn, statement, engine, params):
+    if statement.plsql:
+        # PL/SQL is sent as is (:new / :old in triggers are not bind variables)
+        return conn.exec_driver_sql(statement.sql)
+    compiled, values = _statement_params(statement, engine, params)
+    return conn.execute(compiled, values)
+
+
+def _run_parallel(statement, engine, params):
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        df = fetch_frame(_execute(conn, statement, engine, params))
+    return df, time.perf_counter() - start
+
+
+def run_script(script, engine, params=None, commit=False, single_transaction=False, parallel=4,
+               stop_on_error=True):
+    """
+    Runs a sql script (text or list of Statement) over one connection.
+    :param commit: Commit every statement (at the end with single_transaction), else roll back at the end
+    :param single_transaction: Run the whole script in one transaction, rolled back at the first error
+        (the following statements are skipped whatever stop_on_error)
+    :param parallel: Maximum number of concurrent @parallel statements
+    :param stop_on_error: Stop at the first failing statement, the following ones are reported as skipped
+    :return: ({name: DataFrame} of the statements returning rows, report DataFrame of per statement timings)
+    """
+    params = params or dict()
+    statements = split_statements(script, engine.dialect.name) if isinstance(script, str) else script
+    for st in statements:
+        if st.parallel and not is_read_only(st.sql):
+            raise Exception(f'@parallel statements must be SELECTs (line {st.line})')
+
+    results, report = dict(), list()
+
+    def add(n, st, rows, seconds, status):
+        report.append((n + 1, st.line, st.name or '', ' '.join(st.sql.split())[:60], rows, round(seconds, 4), status))
+
+    def result_name(n, st):
+        name = st.name or f'stmt_{n + 1}'
+        return name if name not in results else f'{name}_{n + 1}'
+
+    conn = engine.connect()
+    trans = conn.begin()
+    uncommitted = failed = False
+    try:
+        n = 0
+        while n < len(statements):
+            st = statements[n]
+            if failed:
+                add(n, st, None, 0, 'skipped')
+                n += 1
+                continue
+
+            if st.parallel:
+                group = list()
+                while n + len(group) < len(statements) and statements[n + len(group)].parallel:
+                    group.append(statements[n + len(group)])
+                if uncommitted:
+                    print(f'Warning: @parallel statements at line {st.line} run on other connections '
+                          f'and do not see the uncommitted changes of the script')
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(parallel, len(group)))) as pool:
+                    futures = [pool.submit(_run_parallel, s, engine, params) for s in group]
+                    for k, (s, future) in enumerate(zip(group, futures)):
+                        try:
+                            df, seconds = future.result()
+                            results[result_name(n + k, s)] = df
+                            add(n + k, s, len(df), seconds, 'ok (parallel)')
+                        except Exception as e:
+                            add(n + k, s, None, 0, (str(e).splitlines() or [repr(e)])[0])
+                            failed = failed or stop_on_error or single_transaction
+                n += len(group)
+                continue
+
+            start = time.perf_counter()
+            try:
+                res = _execute(conn, st, engine, params)
+                if res.returns_rows:
+                    df = fetch_frame(res)
+                    results[result_name(n, st)] = df
+                    rows = len(df)
+                else:
+                    rows = res.rowcount if res.rowcount is not None and res.rowcount >= 0 else None
+                if not st.plsql and is_read_only(st.sql):
+                    pass
+                elif commit and not single_transaction:
+                    trans.commit()
+                    trans = conn.begin()
+                else:
+                    uncommitted = True
+                add(n, st, rows, time.perf_counter() - start, 'ok')
+            except Exception as e:
+                add(n, st, None, time.perf_counter() - start, (str(e).splitlines() or [repr(e)])[0])
+                if single_transaction:
+                    trans.rollback()
+                    print('Rolled back')
+                failed = stop_on_error or single_transaction
+            n += 1
+
+        if trans.is_active:
+            if commit and not failed:
+                trans.commit()
+            else:
+                if uncommitted:
+                    print('Rolled back' + (' (use --commit to commit)' if not commit else ''))
+                trans.rollback()
+    finally:
+        conn.close()
+
+    report = pd.DataFrame(report, columns=['n', 'line', 'name', 'statement', 'rows', 'seconds', 'status'])
+    return results, report
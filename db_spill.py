@@ -0,0 +1,175 @@
+"""
+Source: db_spill.py
+
+Purpose: Disk spill of query results that exceed the fetch memory budget (see db_fetch.fetch_frame).
+
+The DataFrame chunks are appended as record batches to uncompressed Arrow IPC files
+which are read back memory-mapped, so head(), column selection and chunk iteration
+only touch the pages they need. The files are removed when the result is garbage
+collected.
+"""
+
+import os
+import uuid
+import weakref
+import pathlib
+import tempfile
+from db_lazy import LazyModule
+from db_fetch import format_size
+
+pa = LazyModule('pyarrow')
+pd = LazyModule('pandas')
+
+# directory of the spill files (None: the system temp directory)
+spill_dir = None
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _to_arrow(df):
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        # mixed type object columns: stored as strings
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].map(lambda v: v if v is None else str(v))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+class SpillWriter:
+    """
+    Appends DataFrames to Arrow IPC spill files. A chunk whose types can not be cast to the
+    schema of the current file (ex: a column that was all null so far) starts a new file.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = pathlib.Path(directory or spill_dir or tempfile.gettempdir())
+        self.prefix = f'sql-spill-{uuid.uuid4().hex[:12]}'
+        self.paths = list()
+        self.rows = 0
+        self._writer = None
+        self._schema = None
+
+    def write(self, df):
+        table = _to_arrow(df)
+        if self._writer is not None and not table.schema.equals(self._schema):
+            try:
+                table = table.cast(self._schema)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+                self._close_file()
+        if self._writer is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / f'{self.prefix}-{len(self.paths)}.arrow'
+            self.paths.append(str(path))
+            self._schema = table.schema
+            self._writer = pa.ipc.new_file(str(path), self._schema)
+        self._writer.write_table(table)
+        self.rows += len(df)
+
+    def _close_file(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def close(self, columns):
+        """Closes the spill files and returns the SpilledResult reading them"""
+        self._close_file()
+        return SpilledResult(self.paths, columns, self.rows)
+
+
+class SpilledResult:
+    """
+    Lazy, file backed query result.
+
+    Usage:
+        res.head(10)                     # first rows as a DataFrame
+        res[['col_a', 'col_b']]          # column selection (lazy)
+        for df in res.iter_chunks(100000): ...
+        df = res.to_pandas()             # loads everything
+    """
+
+    def __init__(self, paths, columns, rows, _owner=None):
+        self.paths = list(paths)
+        self.columns = list(columns)
+        self.rows = rows
+        # column selections share the files of the result they were taken from
+        self._owner = _owner
+        if _owner is None:
+            self._finalizer = weakref.finalize(self, _remove_files, self.paths)
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def shape(self):
+        return self.rows, len(self.columns)
+
+    @property
+    def nbytes(self):
+        """Size of the spill files"""
+        return sum(os.path.getsize(p) for p in self.paths if os.path.exists(p))
+
+    def __repr__(self):
+        return (f'<SpilledResult {self.rows} rows x {len(self.columns)} columns, '
+                f'{format_size(self.nbytes, 1)} in {len(self.paths)} file(s)>')
+
+    def __getitem__(self, columns):
+        if isinstance(columns, str):
+            columns = [columns]
+        missing = [c for c in columns if c not in self.columns]
+        if missing:
+            raise KeyError(f'{missing} not in the result columns')
+        return SpilledResult(self.paths, columns, self.rows, _owner=self._owner or self)
+
+    def _batches(self):
+        for path in self.paths:
+            with pa.memory_map(path) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    yield reader.get_batch(i).select(self.columns)
+
+    def iter_chunks(self, chunksize=None):
+        """Yields DataFrames of the spilled record batches, or of chunksize rows"""
+        if chunksize is None:
+            for batch in self._batches():
+                yield batch.to_pandas()
+            return
+        pending = None
+        for batch in self._batches():
+            df = batch.to_pandas()
+            pending = df if pending is None else pd.concat([pending, df], ignore_index=True)
+            while len(pending) >= chunksize:
+                yield pending.iloc[:chunksize].reset_index(drop=True)
+                pending = pending.iloc[chunksize:]
+        if pending is not None and len(pending):
+            yield pending.reset_index(drop=True)
+
+    def head(self, n=5):
+        frames, rows = list(), 0
+        for batch in self._batches():
+            frames.append(batch.slice(0, n - rows).to_pandas())
+            rows += len(frames[-1])
+            if rows >= n:
+                break
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=self.columns)
+
+    def to_pandas(self):
+        """Loads the whole result into a DataFrame"""
+        frames = list()
+        for path in self.paths:
+            with pa.memory_map(path) as source:
+                frames.append(pa.ipc.open_file(source).read_all().select(self.columns).to_pandas())
+        if not frames:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(frames, ignore_index=True, copy=False)
+
+    def remove(self):
+        """Removes the spill files"""
+        (self._owner or self)._finalizer()
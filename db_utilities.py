@@ -9,13 +9,7 @@ Purpose:
 
 import os
 import sys
-import re
 import datetime
-import tables
-import pandas as pd
-import sqlalchemy as sa
-import cx_Oracle
-import mysql.connector
 from functools import wraps
 from time import time, gmtime, strftime
 from textwrap import dedent, indent
@@ -23,6 +17,20 @@ from textwrap import dedent, indent
 sys.path.append(os.path.join(os.environ['HOME'], 'python_lib'))
 
 import logger
+from db_config import ConfigLoader, parse_pipe_config
+from db_lazy import LazyModule
+import db_fetch
+import db_catalog
+from db_fetch import format_size, df_size
+from db_render import render_rows
+
+# drivers and heavy dependencies are imported on first use
+pd = LazyModule('pandas')
+sa = LazyModule('sqlalchemy')
+cx_Oracle = LazyModule('cx_Oracle')
+mysql_connector = LazyModule('mysql.connector')
+
+config_loader = ConfigLoader(os.path.join(os.environ['HOME'], 'config', '.dbaccess'), parse_pipe_config)
 
 
 class DupColsRenamer():
@@ -38,6 +46,16 @@ class DupColsRenamer():
             return "{}_{}".format(x, self.d[x])
 
 
+def dbErrors():
+    """Returns the DatabaseError classes of sqlalchemy and of the db drivers loaded so far (for except clauses)"""
+    errors = [sa.exc.DatabaseError]
+    if 'cx_Oracle' in sys.modules:
+        errors.append(sys.modules['cx_Oracle'].DatabaseError)
+    if 'mysql.connector' in sys.modules:
+        errors.append(sys.modules['mysql.connector'].DatabaseError)
+    return tuple(errors)
+
+
 def isSql(sql):
     if sql.lstrip().lower().startswith('select') and 'from' in sql.lower():
         return True
@@ -49,27 +67,14 @@ def getDbCredentials(dbalias, asEngineStr=False):
     """Function to get database credentials from a config file ~/config/.dbaccess for a database alias
     If asEngineStr is true returns sqlalchemy engine connection string"""
     dbalias = dbalias.upper()
-    config_file = os.environ['HOME'] + "/config/.dbaccess"
-    file = open(config_file)
-    lines = file.readlines()
-    data = []
-    mysqlConfig = dict()
-    for line in lines:
-        if line.startswith('#'): continue
-        m = re.match("^{0}\|".format(dbalias), line)
-        if m is None:
-            continue
-        data = line.strip().split('|')
-        schema = data[1].upper()
-        port = data[2]
-        user = data[3]
-        passwd = data[4]
-        # for mysql only
-        mysqlConfig['user'] = user
-        mysqlConfig['password'] = passwd
-        mysqlConfig['host'] = schema
-        mysqlConfig['port'] = port
+    data = config_loader.get(dbalias)
     if data:
+        schema = data['host'].upper()
+        port = data['port']
+        user = data['user']
+        passwd = data['password']
+        # for mysql only
+        mysqlConfig = {'user': user, 'password': passwd, 'host': schema, 'port': port}
         if dbalias.startswith('ORA'):
             if asEngineStr:
                 return 'oracle://{0}:{1}@{2}'.format(user, passwd, schema)
@@ -119,48 +124,31 @@ def getDbConnection(dbAlias, schema=None, asEngine=False, echo=False):
                     connStr = 'mysql+mysqlconnector://{user}:{password}@{host}:{port}'.format(**dbCredentials)
                 conn = sa.create_engine(connStr, echo=engineEcho)
             else:
-                conn = mysql.connector.connect(database=schema, **dbCredentials)
+                conn = mysql_connector.connect(database=schema, **dbCredentials)
     else:
         # print('Error: dbAlias {} not valid!'.format(dbAlias))
         raise Exception('Error: dbAlias {} not valid!'.format(dbAlias))
     return conn
 
 
-def format_size(size, decimal_places):
-    for unit in ['bytes', 'KB', 'MB', 'GB', 'TB']:
-        if size < 1024.0:
-            break
-        size /= 1024.0
-    return "{size:.{decimal_places}f} {unit}".format(size=size, decimal_places=decimal_places, unit=unit)
-
-
-def df_size(df):
-    """Returns the size of a DataFrame (Index included) in human readable format"""
-    total = 0.0
-    for col in df:
-        total += df[col].nbytes
-    total += df.index.nbytes
-    return format_size(total, 1)
-
-
 def logging_decorator(fn):
     @wraps(fn)  # using wraps to be able to preserve the docstring of the method
     def logging(*args, **kwargs):
         if 'logger' in kwargs and kwargs['logger'] is not None:
-            logger = kwargs['logger']
+            log = kwargs['logger']
         else:
-            logger = logger
+            log = logger
 
         if 'logger' in kwargs:
             del(kwargs['logger'])
 
         if fn.__name__ == 'readSql':
-            logger.info('Read sql:\n{}'.format(kwargs['sql'] if 'sql' in kwargs else args[0]))
+            log.info('Read sql:\n{}'.format(kwargs['sql'] if 'sql' in kwargs else args[0]))
         elif fn.__name__ == 'readCsv':
-            logger.info('Read file: {}'.format(kwargs['filepath_or_buffer'] if 'filepath_or_buffer' in kwargs else args[0]))
+            log.info('Read file: {}'.format(kwargs['filepath_or_buffer'] if 'filepath_or_buffer' in kwargs else args[0]))
 
         if 'params' in kwargs:
-            logger.info('params: {}'.format(kwargs['params']))
+            log.info('params: {}'.format(kwargs['params']))
         start = time()
         df = fn(*args, **kwargs)
         end = time() - start
@@ -168,7 +156,7 @@ def logging_decorator(fn):
 
         if type(df) == pd.DataFrame:
             df = df.rename(columns=DupColsRenamer())
-            logger.info(indent(dedent('''
+            log.info(indent(dedent('''
             Rows fetched: {}
             Memory usage: {}
             Elapsed time: {}'''.format(len(df), df_size(df), elapsed)), '    '))
@@ -220,15 +208,14 @@ def getPackages(package_name, alias='oradb'):
     where object_type = 'PACKAGE' and owner not like '%SYS' and owner not like 'XDB' 
     and object_name like '%{}%'
     '''.format(package_name)
-    config = tables.Config(border=True)
     r = cur.execute(sql)
-    columns = [tables.Column(c[0]) for c in r.description]
-    table = tables.Table(config, columns)
+    headers = [c[0] for c in r.description]
+    table_rows = list()
 
     for row in r:
-        table.addRow((row[0], row[1].lower()))
+        table_rows.append((row[0], row[1].lower()))
 
-    print(table.asString())
+    render_rows(table_rows, headers)
     conn.close()
 
 
@@ -257,7 +244,6 @@ def findFunction(function_name, alias='oradb'):
         order by 3
         '''.format(function_name)
 
-    config = tables.Config(border=True)
     df = pd.read_sql(sql, conn)
     if len(df) == 0:
         return
@@ -268,13 +254,13 @@ def findFunction(function_name, alias='oradb'):
     df = df.reset_index()
     df[0] = '(' + df[0] + ')'
     df.rename(columns={0: 'arguments', 'object_name': 'package_name'}, inplace=True)
-    columns = [tables.Column(c) for c in df.columns]
-    table = tables.Table(config, columns)
+    headers = list(df.columns)
+    table_rows = list()
 
     for row in df.to_records(index=False):
-        table.addRow([r.lower() for r in row])
+        table_rows.append([r.lower() for r in row])
 
-    print(table.asString())
+    render_rows(table_rows, headers)
     conn.close()
 
 
@@ -303,7 +289,6 @@ def getPackageFunctions(package_name, alias='oradb'):
     order by 3
     '''.format(package_name)
 
-    config = tables.Config(border=True)
     df = pd.read_sql(sql, conn)
     if len(df) == 0:
         return
@@ -314,13 +299,13 @@ def getPackageFunctions(package_name, alias='oradb'):
     df = df.reset_index()
     df[0] = '(' + df[0] + ')'
     df.rename(columns={0: 'arguments', 'object_name': 'package_name'}, inplace=True)
-    columns = [tables.Column(c) for c in df.columns]
-    table = tables.Table(config, columns)
+    headers = list(df.columns)
+    table_rows = list()
 
     for row in df.to_records(index=False):
-        table.addRow([r.lower() for r in row])
+        table_rows.append([r.lower() for r in row])
 
-    print(table.asString())
+    render_rows(table_rows, headers)
     conn.close()
 
 
@@ -339,13 +324,8 @@ def explainSQL(sql, alias='oradb'):
         for l in r.fetchall():
             print(l[0])
     elif alias.upper().startswith('MYSQL'):
-        config = tables.Config(border=True)
         cur.execute('explain extended {}'.format(sql))
-        columns = [tables.Column(c) for c in cur.column_names]
-        table = tables.Table(config, columns)
-        for row in cur:
-            table.addRow(row)
-        print(table.asString())
+        render_rows(cur.fetchall(), list(cur.column_names))
     conn.close()
 
 
@@ -398,12 +378,7 @@ def getTableStats(table_name, alias='oradb'):
             return
         num_rows = df.num_rows[0]
         df.columns = df.columns.str.replace('_', ' ').str.title()
-        config = tables.Config(border=True)
-        columns = [tables.Column('Property'), tables.Column('Value')]
-        table = tables.Table(config, columns)
-        for rec in df.T.to_records(convert_datetime64=True):
-            table.addRow(rec)
-        print(table.asString())
+        render_rows(df.T.reset_index().itertuples(index=False, name=None), ['Property', 'Value'])
 
         tableColsStatsSql = '''
         select c.column_id, s.COLUMN_NAME, s.NUM_DISTINCT, s.NUM_NULLS, s.AVG_COL_LEN 
@@ -419,18 +394,23 @@ def getTableStats(table_name, alias='oradb'):
         df.insert(3, 'not_nulls', df.num_rows - df.num_nulls)
         df.columns = df.columns.str.replace('_', ' ').str.title()
         df.sort_index(ascending=True, inplace=True)
-        columns = [tables.Column(c) for c in df.columns]
-        table = tables.Table(config, columns)
-        for rec in df.to_records(index=False):
-            table.addRow(rec)
-        print(table.asString())
+        render_rows(df.to_records(index=False), list(df.columns))
 
     conn.close()
 
 
 @logging_decorator
 def readSql(*args, **kwargs):
-    """Wrapper around pandas.read_sql function with added logging decorator"""
+    """Wrapper around pandas.read_sql function with added logging decorator
+    Plain readSql(sql, con[, params]) calls on sqlalchemy engines/connections are fetched column-wise (see db_fetch)"""
+    call = dict(zip(('sql', 'con'), args), **kwargs)
+    if len(args) <= 2 and set(call) <= {'sql', 'con', 'params'} and \
+            isinstance(call.get('con'), (sa.engine.Engine, sa.engine.Connection)):
+        # no params argument without params: pyformat drivers would interpolate a literal % in the sql
+        con = call['con']
+        res = con.execute(call['sql'], call['params']) if call.get('params') else con.execute(call['sql'])
+        # Decimals as float64 like the coerce_float=True default of pd.read_sql
+        return db_fetch.fetch_frame(res, coerce_float=True)
     df = pd.read_sql(*args, **kwargs)
     return df
 
@@ -442,34 +422,49 @@ def readCsv(*args, **kwargs):
     return df
 
 
-def findColumns(col_name, alias='oradb'):
+_catalog_engines = dict()
 
+
+def getCatalog(alias):
+    """Returns the local catalog index (see db_catalog) of a db alias"""
     alias = alias.upper()
-    conn = getDbConnection(alias)
+    engine = _catalog_engines.get(alias)
+    if engine is None:
+        engine = _catalog_engines[alias] = getDbConnection(alias, asEngine=True)
+    return db_catalog.get_catalog(engine)
 
-    if alias.startswith('ORA'):
-        sql = '''select owner, table_name, column_name, NULLABLE, data_type, DATA_LENGTH 
-                 from all_tab_columns where column_name like upper('%'||:col||'%') 
-                 order by owner, table_name, column_id'''
-        cur = conn.cursor()
-        cur.execute(sql, {'col': col_name})
-    elif alias.startswith('MYSQL'):
-        sql = '''select table_schema owner, table_name, column_name, is_nullable, column_type, null data_length 
-                  from information_schema.columns where column_name like upper(concat('%', %s, '%'))'''
-        cur = conn.cursor()
-        cur.execute(sql, (col_name,))
-
-    config = tables.Config(border=True)
-    columns = list()
-    columns.append(tables.Column('Schema'))
-    columns.append(tables.Column('Table Name'))
-    columns.append(tables.Column('Column Name'))
-    columns.append(tables.Column('Null?'))
-    columns.append(tables.Column('Data Type'))
-
-    table = tables.Table(config, columns)
-
-    for row in cur.fetchall():
+
+def catalogRows(df):
+    """Catalog lookup result as a list of row tuples"""
+    return list(df.itertuples(index=False, name=None))
+
+
+def findColumns(col_name, alias='oradb', live=False):
+
+    alias = alias.upper()
+
+    if not live and db_catalog.catalog_enabled:
+        rows = catalogRows(getCatalog(alias).columns('%{}%'.format(col_name)))
+    else:
+        conn = getDbConnection(alias)
+        if alias.startswith('ORA'):
+            sql = '''select owner, table_name, column_name, NULLABLE, data_type, DATA_LENGTH 
+                     from all_tab_columns where column_name like upper('%'||:col||'%') 
+                     order by owner, table_name, column_id'''
+            cur = conn.cursor()
+            cur.execute(sql, {'col': col_name})
+        elif alias.startswith('MYSQL'):
+            sql = '''select table_schema owner, table_name, column_name, is_nullable, column_type, null data_length 
+                      from information_schema.columns where column_name like upper(concat('%', %s, '%'))'''
+            cur = conn.cursor()
+            cur.execute(sql, (col_name,))
+        rows = cur.fetchall()
+        conn.close()
+
+    headers = ['Schema', 'Table Name', 'Column Name', 'Null?', 'Data Type']
+    table_rows = list()
+
+    for row in rows:
         schemaName, tableName, columnName, notNull, columnType, columnSize = row
         if alias.startswith('ORA'):
             columnTypeSize = '{}({})'.format(columnType, columnSize)
@@ -483,39 +478,37 @@ def findColumns(col_name, alias='oradb'):
                 notNull = 'NOT NULL'
             else:
                 notNull = ''
-        table.addRow((schemaName, tableName, columnName, notNull, columnTypeSize))
+        table_rows.append((schemaName, tableName, columnName, notNull, columnTypeSize))
 
-    print(table.asString())
-    conn.close()
+    render_rows(table_rows, headers)
 
 
-def getTableColumns(table_name, alias='oradb'):
+def getTableColumns(table_name, alias='oradb', live=False):
 
     alias = alias.upper()
-    conn = getDbConnection(alias)
 
-    if alias.startswith('ORA'):
-        sql = '''select table_name, column_name, NULLABLE, data_type, DATA_LENGTH, LAST_ANALYZED
-        from all_tab_columns where table_name like upper(:tab) order by table_name, column_id'''
-        cur = conn.cursor()
-        cur.execute(sql, {'tab': table_name})
-    elif alias.startswith('MYSQL'):
-        sql = '''select table_name, column_name, is_nullable, column_type, null data_length, null last_analyzed 
-        from information_schema.columns where table_name like upper(%s)'''
-        cur = conn.cursor()
-        cur.execute(sql, (table_name,))
-
-    config = tables.Config(border=True)
-    columns = list()
-    columns.append(tables.Column('Table Name'))
-    columns.append(tables.Column('Column Name'))
-    columns.append(tables.Column('Null?'))
-    columns.append(tables.Column('Data Type'))
-    columns.append(tables.Column('Last Analyzed'))
-
-    table = tables.Table(config, columns)
-
-    for row in cur.fetchall():
+    if not live and db_catalog.catalog_enabled:
+        df = getCatalog(alias).table_columns(table_name)
+        rows = catalogRows(df[['table_name', 'column_name', 'nullable', 'data_type', 'data_length', 'last_analyzed']])
+    else:
+        conn = getDbConnection(alias)
+        if alias.startswith('ORA'):
+            sql = '''select table_name, column_name, NULLABLE, data_type, DATA_LENGTH, LAST_ANALYZED
+            from all_tab_columns where table_name like upper(:tab) order by table_name, column_id'''
+            cur = conn.cursor()
+            cur.execute(sql, {'tab': table_name})
+        elif alias.startswith('MYSQL'):
+            sql = '''select table_name, column_name, is_nullable, column_type, null data_length, null last_analyzed 
+            from information_schema.columns where table_name like upper(%s)'''
+            cur = conn.cursor()
+            cur.execute(sql, (table_name,))
+        rows = cur.fetchall()
+        conn.close()
+
+    headers = ['Table Name', 'Column Name', 'Null?', 'Data Type', 'Last Analyzed']
+    table_rows = list()
+
+    for row in rows:
         tableName, columnName, notNull, columnType, columnSize, lastAnalayzed = row
         if alias.startswith('ORA'):
             columnTypeSize = '{}({})'.format(columnType, columnSize)
@@ -529,83 +522,72 @@ def getTableColumns(table_name, alias='oradb'):
                 notNull = 'NOT NULL'
             else:
                 notNull = ''
-        table.addRow((tableName, columnName, notNull, columnTypeSize, lastAnalayzed))
+        table_rows.append((tableName, columnName, notNull, columnTypeSize, lastAnalayzed))
 
-    print(table.asString())
-    conn.close()
+    render_rows(table_rows, headers)
 
 
-def getTableIndex(table_name, alias='oradb'):
+def getTableIndex(table_name, alias='oradb', live=False):
     alias = alias.upper()
-    conn = getDbConnection(alias)
 
-    if alias.startswith('ORA'):
-        sql = '''
-        select a.table_name, a.index_name, a.column_name, a.column_position, b.index_type, b.status, b.last_analyzed
-        from all_ind_columns a, all_indexes b
-        where a.table_name = upper(:tab)
-        and a.index_name = b.index_name
-        order by a.table_owner,a.index_name,a.column_position
-        '''
-        cur = conn.cursor()
-        cur.execute(sql, {'tab': table_name})
-    elif alias.startswith('MYSQL'):
-        sql = '''select table_name, index_name, column_name, null column_position, index_type, null status, null last_analyzed 
-        from information_schema.statistics where table_name like upper(%s)'''
-        cur = conn.cursor()
-        cur.execute(sql, (table_name,))
-
-    config = tables.Config(border=True)
-    columns = []
-    columns.append(tables.Column('Table Name'))
-    columns.append(tables.Column('Index Name'))
-    columns.append(tables.Column('Column Name'))
-    columns.append(tables.Column('Column Position'))
-    columns.append(tables.Column('Index Type'))
-    columns.append(tables.Column('Status'))
-    columns.append(tables.Column('Last Analyzed'))
-
-    table = tables.Table(config, columns)
-
-    for row in cur.fetchall():
-        table.addRow(row)
-
-    print(table.asString())
-    conn.close()
+    if not live and db_catalog.catalog_enabled:
+        rows = catalogRows(getCatalog(alias).indexes(table_name))
+    else:
+        conn = getDbConnection(alias)
+        if alias.startswith('ORA'):
+            sql = '''
+            select a.table_name, a.index_name, a.column_name, a.column_position, b.index_type, b.status, b.last_analyzed
+            from all_ind_columns a, all_indexes b
+            where a.table_name = upper(:tab)
+            and a.index_name = b.index_name
+            order by a.table_owner,a.index_name,a.column_position
+            '''
+            cur = conn.cursor()
+            cur.execute(sql, {'tab': table_name})
+        elif alias.startswith('MYSQL'):
+            sql = '''select table_name, index_name, column_name, null column_position, index_type, null status, null last_analyzed 
+            from information_schema.statistics where table_name like upper(%s)'''
+            cur = conn.cursor()
+            cur.execute(sql, (table_name,))
+        rows = cur.fetchall()
+        conn.close()
+
+    headers = ['Table Name', 'Index Name', 'Column Name', 'Column Position', 'Index Type', 'Status', 'Last Analyzed']
+    render_rows(rows, headers)
 
 
-def getTables(table_name, alias='oradb'):
+def getTables(table_name, alias='oradb', live=False):
     tableName = '%{}%'.format(table_name)
     alias = alias.upper()
-    conn = getDbConnection(alias)
 
-    if alias.startswith('ORA'):
-        sql = '''select table_name, owner, last_analyzed from all_tables where table_name like upper(:tab) order by 1'''
-        cur = conn.cursor()
-        cur.execute(sql, {'tab': tableName})
-    elif alias.startswith('MYSQL'):
-        sql = '''select table_name, table_schema, update_time from information_schema.tables where table_name like upper(%s) order by 1'''
-        cur = conn.cursor()
-        cur.execute(sql, (tableName,))
-
-    config = tables.Config(border=True)
-    columns = list()
-    columns.append(tables.Column('Table Name'))
-    columns.append(tables.Column('Owner'))
-    columns.append(tables.Column('Last Analyzed'))
-
-    table = tables.Table(config, columns)
-
-    for row in cur.fetchall():
-        table.addRow(row)
-
-    print(table.asString())
-    conn.close()
+    if not live and db_catalog.catalog_enabled:
+        rows = catalogRows(getCatalog(alias).tables(tableName))
+    else:
+        conn = getDbConnection(alias)
+        if alias.startswith('ORA'):
+            sql = '''select table_name, owner, last_analyzed from all_tables where table_name like upper(:tab) order by 1'''
+            cur = conn.cursor()
+            cur.execute(sql, {'tab': tableName})
+        elif alias.startswith('MYSQL'):
+            sql = '''select table_name, table_schema, update_time from information_schema.tables where table_name like upper(%s) order by 1'''
+            cur = conn.cursor()
+            cur.execute(sql, (tableName,))
+        rows = cur.fetchall()
+        conn.close()
+
+    headers = ['Table Name', 'Owner', 'Last Analyzed']
+    render_rows(rows, headers)
+
+
+def isDbAlias(dbalias):
+    """Checks if dbalias is defined in ~/config/.dbaccess"""
+    # header-line aliases are resolvable but not listed (as in getDbAliases)
+    return bool(config_loader.aliases().get(dbalias.upper(), {}).get('listed'))
 
 
 def getDbAliases(filter_=None, asDataFrame=False):
-    file = os.environ['HOME'] + '/config/.dbaccess'
-    df = pd.read_csv(file, sep='|', skiprows=5, usecols=[0, 1, 2, 3], header=None, comment='#')
+    df = pd.DataFrame([[a['alias'], a['host'], a['port'], a['user']]
+                       for a in config_loader.aliases().values() if a['listed']], columns=[0, 1, 2, 3])
 
     if filter_:
         filter_ = str(filter_)
@@ -614,9 +596,8 @@ def getDbAliases(filter_=None, asDataFrame=False):
     if asDataFrame:
         return df
     else:
-        config = tables.Config(border=True)
-        columns = [tables.Column('Alias'), tables.Column('Details')]
-        table = tables.Table(config, columns)
+        headers = ['Alias', 'Details']
+        table_rows = list()
 
         for row in df.to_records(index=False):
             alias = row[0]
@@ -625,5 +606,5 @@ def getDbAliases(filter_=None, asDataFrame=False):
                 details = details[:-1]
             if details.endswith('.0'):
                 details = details[:-2]
-            table.addRow([alias, details])
-        print(table.asString())
+            table_rows.append([alias, details])
+        render_rows(table_rows, headers)
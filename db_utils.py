@@ -1,12 +1,73 @@
+import os
 import sys
-import configparser
-import sqlalchemy as sa
-import pandas as pd
+import json
+import time
+import functools
+import bisect
+import fnmatch
+import hashlib
+import concurrent.futures
+import threading
 import pathlib
 import base64
-from tabulate import tabulate
+import tempfile
+import weakref
+from db_config import ConfigLoader, parse_ini_config
+from db_lazy import LazyModule
+import db_fetch
+import db_catalog
+from db_fetch import fetch_frame, fetch_chunks, compact_frame, QueryProfile
+from db_render import render_frame
+from db_cache import is_read_only
+
+# heavy dependencies are imported on first use to keep loading the extension cheap
+sa = LazyModule('sqlalchemy')
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
 
 db_config = pathlib.Path().home() / 'config' / '.dbaccess.cfg'
+config_loader = ConfigLoader(db_config, parse_ini_config)
+
+# snapshots written by load_table(..., cache=True)
+table_cache_dir = pathlib.Path().home() / '.cache' / 'ipython-sql-ext' / 'tables'
+
+# engines idle for longer than engine_idle_timeout seconds are disposed (None: never)
+engine_idle_timeout = 30 * 60
+
+_engines = dict()
+_engines_lock = threading.RLock()
+# pinned session connections (see open_session) keyed like _engines
+_sessions = dict()
+
+
+# dialects of the statements compiled by compile_statement, by _dialect_key
+_statement_dialects = dict()
+
+
+def _dialect_key(dialect):
+    """Dialects compiling the same text alike: same db, driver, paramstyle and server version"""
+    return dialect.name, dialect.driver, dialect.paramstyle, dialect.server_version_info
+
+
+@functools.lru_cache(maxsize=512)
+def _compile_statement(sql, dialect_key):
+    compiled = sa.text(sql).compile(dialect=_statement_dialects.get(dialect_key))
+    return compiled, tuple(compiled.binds)
+
+
+def compile_statement(sql, engine=None):
+    """
+    Returns (compiled statement, bind names) of the sql text compiled for the dialect of engine
+    (Engine or Connection, default dialect if None). Statements are cached in an LRU keyed by
+    (sql text, dialect name, driver, paramstyle, server version), so repeated %sql calls skip parsing
+    the text for its bind parameters and the execution skips the sqlalchemy cache key generation.
+    """
+    dialect = getattr(engine, 'dialect', None)
+    key = None
+    if dialect is not None:
+        key = _dialect_key(dialect)
+        _statement_dialects.setdefault(key, dialect)
+    return _compile_statement(sql, key)
 
 
 def fetch_data(sql, engine, params={}):
@@ -17,15 +78,27 @@ def fetch_data(sql, engine, params={}):
     return res
 
 
-def print_tabular_data(df):
-    df.columns = df.columns.str.replace('_', ' ').str.title()
-    print(tabulate(df.to_dict('records'), headers='keys', tablefmt='psql'))
+def parse_size(size):
+    """Parses a human readable size (ex: 512MB, 2G, 1024) into bytes"""
+    units = {'': 1, 'B': 1, 'K': 2 ** 10, 'KB': 2 ** 10, 'M': 2 ** 20, 'MB': 2 ** 20,
+             'G': 2 ** 30, 'GB': 2 ** 30, 'T': 2 ** 40, 'TB': 2 ** 40}
+    size = str(size).strip().upper()
+    number = size.rstrip('BKMGT')
+    unit = size[len(number):]
+    if unit not in units:
+        raise ValueError(f'Invalid size: {size}')
+    return int(float(number) * units[unit])
+
+
+def print_tabular_data(df, max_rows=None):
+    """Prints df as a table, only the head/tail window of long results (see db_render.render_frame)"""
+    render_frame(df, max_rows=max_rows, title_headers=True)
 
 
 def sql2df(sql, engine, params={}, print_result=False):
     res = fetch_data(sql, engine, params)
     if res.returns_rows:
-        df = pd.DataFrame(res.fetchall(), columns=res.keys())
+        df = fetch_frame(res)
         if print_result:
             print_tabular_data(df.fillna('-'))
         else:
@@ -35,18 +108,9 @@ def sql2df(sql, engine, params={}, print_result=False):
 
 
 def get_db_aliases(filter_=None, as_dataframe=False):
-    config = configparser.ConfigParser()
-    config.read(db_config)
     print(db_config)
-    dfs = list()
-    for k in config.keys():
-        if k == 'DEFAULT': continue
-        db = config[k]['db'] if 'db' in config[k] else None
-        host = config[k]['host'] if 'host' in config[k] else None
-        username = config[k]['username'] if 'username' in config[k] else None
-        dfs.append(pd.DataFrame([[k, db, host, username]], columns=['alias', 'db', 'host', 'username']))
-
-    df = pd.concat(dfs)
+    df = pd.DataFrame([[k, v.get('db'), v.get('host'), v.get('username')] for k, v in config_loader.aliases().items()],
+                      columns=['alias', 'db', 'host', 'username'])
 
     if filter_ is not None:
         df = df[df.alias.str.contains(filter_.upper())]
@@ -57,6 +121,16 @@ def get_db_aliases(filter_=None, as_dataframe=False):
         print_tabular_data(df.fillna('-'))
 
 
+def match_db_aliases(pattern):
+    """Returns the sorted config aliases matching the (case insensitive) shell style pattern. Ex: MYSQL_SHARD_*"""
+    return sorted(fnmatch.filter(config_loader.aliases(), pattern.upper()))
+
+
+def is_db_alias(db_alias):
+    """Checks if db_alias is defined in the db config file"""
+    return db_alias.upper() in config_loader
+
+
 def add_db_alias(alias, db, host, username, password):
     """TODO:"""
 
@@ -64,14 +138,11 @@ def add_db_alias(alias, db, host, username, password):
 
 def get_dbcredentials(db_alias, with_schema=True, as_engine_str=False):
     db_alias = db_alias.upper()
-    config = configparser.ConfigParser()
-    config.read(db_config)
+    db_config_ = config_loader.get(db_alias)
 
-    if db_alias not in config:
+    if db_config_ is None:
         raise Exception(f'{db_alias} not in db config file.')
 
-    db_config_ = config[db_alias]
-
     if db_config_['db'] == 'sqlite':
         if as_engine_str:
             return f"sqlite:///{db_config_['host']}"
@@ -93,43 +164,524 @@ def get_dbcredentials(db_alias, with_schema=True, as_engine_str=False):
 def get_dbconnection(db_alias, mysql_schema=None, as_engine=True, echo=False):
     db_alias = db_alias.upper()
 
-    creds = get_dbcredentials(db_alias, as_engine_str=as_engine)
+    creds = get_dbcredentials(db_alias, with_schema=mysql_schema is None, as_engine_str=as_engine)
 
     if as_engine:
+        if mysql_schema and creds.startswith('mysql'):
+            creds = f'{creds}/{mysql_schema}'
         return sa.create_engine(creds, pool_recycle=280, echo=echo)
     else:
         raise Exception('Raw db connection not implemented.')
 
 
-def exec_sql(sql, engine, params={}, commit=False):
-    if isinstance(engine, sa.engine.base.Engine):
-        conn = engine.connect()
+def get_engine(db_alias, mysql_schema=None):
+    """
+    Returns the engine registered for (db_alias, mysql_schema), creating it on first use.
+    Engines (and their connection pools) are shared process wide.
+    """
+    key = (db_alias.upper(), mysql_schema)
+    now = time.time()
+    with _engines_lock:
+        evict_idle_engines(now)
+        entry = _engines.get(key)
+        if entry is None:
+            entry = {'engine': get_dbconnection(key[0], mysql_schema=mysql_schema), 'created': now, 'uses': 0}
+            _engines[key] = entry
+        entry['last_used'] = now
+        entry['uses'] += 1
+        return entry['engine']
+
+
+def evict_idle_engines(now=None):
+    """Disposes registered engines not used for more than engine_idle_timeout seconds"""
+    if engine_idle_timeout is None:
+        return
+    now = now or time.time()
+    with _engines_lock:
+        for key, entry in list(_engines.items()):
+            if now - entry['last_used'] > engine_idle_timeout and key not in _sessions:
+                dispose_engines(*key)
+
+
+def dispose_engines(db_alias=None, mysql_schema=None):
+    """Disposes and unregisters the engines for db_alias (all engines if db_alias is None)"""
+    disposed = list()
+    with _engines_lock:
+        for key in list(_engines):
+            if db_alias is not None and key != (db_alias.upper(), mysql_schema):
+                continue
+            if key in _sessions:
+                _sessions.pop(key).close()
+            _engines.pop(key)['engine'].dispose()
+            disposed.append(key)
+    return disposed
+
+
+def list_engines(print_result=True):
+    """Lists the registered engines with their pool status"""
+    now = time.time()
+    with _engines_lock:
+        df = pd.DataFrame([[alias, schema, repr(e['engine'].url), e['engine'].pool.status(), e['uses'],
+                            pd.Timestamp(e['created'], unit='s').round('s'), round(now - e['last_used'], 1)]
+                           for (alias, schema), e in _engines.items()],
+                          columns=['alias', 'schema', 'url', 'pool', 'uses', 'created', 'idle_sec'])
+    if print_result:
+        print_tabular_data(df.fillna('-'))
+    else:
+        return df
+
+
+class Session:
+    """
+    Connection pinned to one engine for the kernel lifetime, so the session state (temp tables,
+    ALTER SESSION settings, USE schema) is kept between statements and there is no pool checkout,
+    begin and rollback per statement.
+    Read only statements (see db_cache.is_read_only) run directly on the connection, other statements
+    in a transaction that is committed if commit is True and rolled back otherwise.
+    The mysql connection is in autocommit mode, so reads do not keep a transaction (snapshot,
+    metadata locks) open, and writes start one explicitly.
+    The connection is pinged when it was idle for more than ping_interval seconds and replaced if
+    it was dropped; reads failing on a dropped connection are retried once on a new connection.
+    The session state is lost on reconnect.
+    """
+
+    ping_interval = 30
+
+    def __init__(self, engine, name):
+        self.engine = engine
+        self.name = name
+        self.conn = None
+        self.lock = threading.RLock()
+        self.connected = None
+        self.last_used = time.time()
+        self.statements = 0
+        self.reconnects = 0
+
+    @property
+    def is_mysql(self):
+        return self.engine.url.drivername.startswith('mysql')
+
+    def _alive(self):
+        try:
+            return self.engine.dialect.do_ping(self.conn.connection.connection)
+        except Exception:
+            return False
+
+    def _discard(self, reason):
+        if self.conn is not None:
+            try:
+                self.conn.invalidate()
+                self.conn.close()
+            except sa.exc.SQLAlchemyError:
+                pass
+            self.conn = None
+            self.reconnects += 1
+            print(f'Session {self.name}: {reason}, reconnecting (session state is reset)')
+
+    def connection(self):
+        """Returns the pinned connection, (re)connecting if it is missing, invalidated or fails the ping"""
+        if self.conn is not None:
+            if self.conn.closed or self.conn.invalidated:
+                self._discard('connection invalidated')
+            elif time.time() - self.last_used > self.ping_interval and not self._alive():
+                self._discard('connection lost')
+        if self.conn is None:
+            self.conn = self.engine.connect()
+            if self.is_mysql:
+                self.conn.connection.connection.autocommit(True)
+            self.connected = time.time()
+        return self.conn
+
+    def execute(self, sql, params, commit=False, profile=None, max_bytes=None):
+        """Executes sql on the pinned connection, returns a DataFrame (or SpilledResult) or the result proxy"""
+        profile = profile or QueryProfile(enabled=False)
+        read_only = is_read_only(str(sql))
+        with self.lock:
+            try:
+                return self._execute(sql, params, read_only, commit, profile, max_bytes)
+            except sa.exc.DBAPIError as e:
+                if not (e.connection_invalidated and read_only):
+                    raise
+                self._discard('connection lost')
+                return self._execute(sql, params, read_only, commit, profile, max_bytes)
+            finally:
+                self.last_used = time.time()
+
+    def _execute(self, sql, params, read_only, commit, profile, max_bytes):
+        conn = self.connection()
+        self.statements += 1
+        if read_only:
+            with profile.phase('execute'):
+                res = conn.execute(sql, params)
+            return fetch_frame(res, profile=profile, max_bytes=max_bytes) if res.returns_rows else res
+
         trans = conn.begin()
         try:
-            res = conn.execute(sql, params)
+            if self.is_mysql:
+                conn.exec_driver_sql('start transaction')
+            with profile.phase('execute'):
+                res = conn.execute(sql, params)
+            df = fetch_frame(res, profile=profile, max_bytes=max_bytes) if res.returns_rows else res
             if commit:
                 trans.commit()
             else:
                 trans.rollback()
-            if res.returns_rows:
-                return pd.DataFrame(res.fetchall(), columns=res.keys())
+            return df
+        except:
+            if trans.is_active:
+                trans.rollback()
+            raise
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                # invalidated, not returned to the pool: it still holds the session state
+                # (mysql autocommit, temp tables, alter session / use settings)
+                try:
+                    self.conn.invalidate()
+                    self.conn.close()
+                except sa.exc.SQLAlchemyError:
+                    pass
+                self.conn = None
+
+
+def open_session(db_alias, mysql_schema=None):
+    """Pins a session connection (see Session) for db_alias, used by exec_sql on its engine. Returns the Session"""
+    key = (db_alias.upper(), mysql_schema)
+    with _engines_lock:
+        if key not in _sessions:
+            name = f'{key[0]}.{mysql_schema}' if mysql_schema else key[0]
+            _sessions[key] = Session(get_engine(db_alias, mysql_schema), name)
+        session = _sessions[key]
+    session.connection()
+    return session
+
+
+def close_session(db_alias=None, mysql_schema=None):
+    """Closes the session of db_alias (all sessions if db_alias is None), returns the closed keys"""
+    closed = list()
+    with _engines_lock:
+        for key in list(_sessions):
+            if db_alias is not None and key != (db_alias.upper(), mysql_schema):
+                continue
+            _sessions.pop(key).close()
+            closed.append(key)
+    return closed
+
+
+def engine_session(engine):
+    """Returns the open Session on engine or None"""
+    for session in list(_sessions.values()):
+        if session.engine is engine:
+            return session
+    return None
+
+
+def list_sessions(print_result=True):
+    """Lists the pinned session connections"""
+    now = time.time()
+    df = pd.DataFrame([[s.name, s.conn is not None, pd.Timestamp(s.connected, unit='s').round('s') if s.connected else None,
+                        s.statements, s.reconnects, round(now - s.last_used, 1)]
+                       for s in list(_sessions.values())],
+                      columns=['alias', 'connected', 'since', 'statements', 'reconnects', 'idle_sec'])
+    if print_result:
+        print_tabular_data(df.fillna('-'))
+    else:
+        return df
+
+
+def _close_stream(res, conn, trans):
+    res.close()
+    if trans is not None and trans.is_active:
+        trans.rollback()
+    if conn is not None:
+        conn.close()
+
+
+class ChunkStream:
+    """
+    Iterator of the DataFrame chunks of a streamed result (exec_sql with chunksize).
+    It holds its connection (and transaction, committed at the end with commit) until it is consumed:
+    iterate it to the end, use it as a context manager or call close(). A stream dropped unconsumed
+    is closed (rolled back) when garbage collected.
+
+    Usage:
+        with exec_sql(sql, engine, chunksize=10000) as chunks:
+            for df in chunks:
+                ...
+    """
+
+    def __init__(self, res, chunksize, conn=None, trans=None, commit=False):
+        self._chunks = fetch_chunks(res, chunksize)
+        self._trans = trans
+        self._commit = commit
+        self._finalizer = weakref.finalize(self, _close_stream, res, conn, trans)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._finalizer.alive:
+            raise StopIteration
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            if self._trans is not None and self._commit:
+                self._trans.commit()
+            self.close()
+            raise
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """Closes the result and rolls back / returns the connection (no-op once closed)"""
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def exec_sql(sql, engine, params={}, commit=False, chunksize=None, callback=None, compact=None, profile=None,
+             max_bytes=None):
+    """
+    Execute sql and return the result as a pd.DataFrame.
+    If chunksize is given the result is fetched with a server side cursor and
+    a ChunkStream (iterator of DataFrames of at most chunksize rows) is returned instead,
+    it holds its connection until it is consumed or closed.
+    If callback is given as well every chunk is passed to it and None is returned.
+    If compact is True (default: db_fetch.compact_results) the DataFrame dtypes are compacted (see compact_frame).
+    If profile (db_fetch.QueryProfile) is given the per phase timings are recorded in it.
+    If a session is open on engine (see open_session) the statement runs on its pinned connection.
+    Results larger than max_bytes (default: db_fetch.max_result_bytes, 0: no limit) are spilled to disk
+    and returned as a lazy db_spill.SpilledResult.
+    """
+    if callback is not None and not chunksize:
+        raise Exception('callback requires chunksize.')
+
+    profile = profile or QueryProfile(enabled=False)
+    max_bytes = db_fetch.max_result_bytes if max_bytes is None else max_bytes
+    df = _exec_sql(sql, engine, params, commit, chunksize, callback, profile, max_bytes)
+    if (compact if compact is not None else db_fetch.compact_results) and isinstance(df, pd.DataFrame):
+        with profile.phase('convert'):
+            df = compact_frame(df, report=True)
+    if profile.enabled and isinstance(df, pd.DataFrame):
+        profile.bytes = db_fetch.df_size(df, as_bytes=True)
+    return df
+
+
+def _exec_sql(sql, engine, params, commit, chunksize, callback, profile, max_bytes=None):
+    if isinstance(engine, sa.engine.base.Engine) and not chunksize:
+        session = engine_session(engine)
+        if session is not None:
+            return session.execute(sql, params, commit, profile, max_bytes)
+
+    if isinstance(engine, sa.engine.base.Engine):
+        with profile.phase('checkout'):
+            conn = engine.connect()
+        if chunksize:
+            conn = conn.execution_options(stream_results=True)
+        trans = conn.begin()
+        try:
+            with profile.phase('execute'):
+                res = conn.execute(sql, params)
+            if chunksize and res.returns_rows:
+                chunks = ChunkStream(res, chunksize, conn, trans, commit)
+                return consume_chunks(chunks, callback) if callback else chunks
+            df = fetch_frame(res, profile=profile, max_bytes=max_bytes) if res.returns_rows else res
+            if commit:
+                trans.commit()
             else:
-                return res
+                trans.rollback()
+            return df
         except:
-            trans.rollback()
+            if trans.is_active:  # a failing ChunkStream callback has already closed the stream
+                trans.rollback()
+            conn.close()
             raise
     else:
         try:
-            res = engine.execute(sql, params)
+            if chunksize:
+                engine = engine.execution_options(stream_results=True)
+            with profile.phase('execute'):
+                res = engine.execute(sql, params)
+            if chunksize and res.returns_rows:
+                chunks = ChunkStream(res, chunksize)
+                return consume_chunks(chunks, callback) if callback else chunks
             if res.returns_rows:
-                return pd.DataFrame(res.fetchall(), columns=res.keys())
+                return fetch_frame(res, profile=profile, max_bytes=max_bytes)
             else:
                 return res
         except:
             raise
 
 
-def get_tables(table_name, engine, print_result=True, exact_match=False):
+def exec_sql_aliases(sql, aliases, params={}, parallel=8, commit=False, compact=None):
+    """
+    Runs sql on every alias of aliases concurrently, at most parallel at a time, on the registered engines.
+    Returns (DataFrame of the results concatenated with an alias column, status DataFrame of
+    alias, seconds, rows, error). Failing aliases are reported in the status and do not discard
+    the results of the others. Results are not spilled to disk (see exec_sql max_bytes).
+    A result with a column named alias is reported as an error of its alias.
+    """
+    if isinstance(sql, str):
+        sql = sa.text(sql)
+
+    def run(alias):
+        start = time.perf_counter()
+        try:
+            res = exec_sql(sql, get_engine(alias), params, commit=commit, compact=compact, max_bytes=0)
+        except Exception as e:
+            return None, (alias, time.perf_counter() - start, None, (str(e).splitlines() or [repr(e)])[0])
+        seconds = time.perf_counter() - start
+        if isinstance(res, pd.DataFrame):
+            if 'alias' in res.columns:
+                return None, (alias, seconds, None, 'the result has an alias column, rename it')
+            return res, (alias, seconds, len(res), None)
+        return None, (alias, seconds, res.rowcount if res.rowcount is not None and res.rowcount >= 0 else None, None)
+
+    frames, status = list(), list()
+    if aliases:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(parallel, len(aliases))),
+                                                   thread_name_prefix='sql-alias') as pool:
+            for df, row in pool.map(run, aliases):
+                status.append(row)
+                if df is not None:
+                    frames.append(df.assign(alias=row[0])[['alias'] + list(df.columns)])
+
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['alias'])
+    status = pd.DataFrame(status, columns=['alias', 'seconds', 'rows', 'error']).astype({'rows': 'Int64'})
+    return df, status
+
+
+def consume_chunks(chunks, callback):
+    """Passes every DataFrame chunk of a ChunkStream to callback, closing the stream if callback fails"""
+    with chunks:
+        for chunk in chunks:
+            callback(chunk)
+
+
+class JobCancelled(Exception):
+    def __init__(self, message='cancelled'):
+        super().__init__(message)
+
+
+class QueryJob:
+    """
+    Runs a query in a worker thread on its own connection, fetching the result in chunks.
+    on_done is called with the result once the job finished successfully,
+    on_error with the exception once it failed or was cancelled.
+
+    Usage:
+        job = QueryJob('q1', sql, engine, params).start()
+        job.status, job.elapsed, job.rows
+        df = job.result()
+    """
+
+    def __init__(self, name, sql, engine, params=None, commit=False, chunksize=10000, on_done=None, on_error=None):
+        self.name = name
+        self.sql = sql
+        self.engine = engine
+        self.params = params or dict()
+        self.commit = commit
+        self.chunksize = chunksize
+        self.on_done = on_done
+        self.on_error = on_error
+        self.status = 'pending'
+        self.rows = 0
+        self.error = None
+        self.started = self.finished = None
+        self._df = None
+        self._conn = None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'sql-job-{name}', daemon=True)
+
+    def start(self):
+        self.started = time.time()
+        self.status = 'running'
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            with self.engine.connect() as conn:
+                self._conn = conn
+                trans = conn.begin()
+                try:
+                    res = conn.execution_options(stream_results=True).execute(self.sql, self.params)
+                    chunks = list()
+                    if res.returns_rows:
+                        for chunk in fetch_chunks(res, self.chunksize):
+                            if self._cancel.is_set():
+                                raise JobCancelled()
+                            chunks.append(chunk)
+                            self.rows += len(chunk)
+                        self._df = pd.concat(chunks, ignore_index=True) if chunks else \
+                            pd.DataFrame(columns=list(res.keys()))
+                    else:
+                        self._df = res
+                    if self.commit:
+                        trans.commit()
+                finally:
+                    if trans.is_active:
+                        trans.rollback()
+                    self._conn = None
+            self.status = 'done'
+        except Exception as e:
+            self.status = 'cancelled' if self._cancel.is_set() else 'error'
+            self.error = e
+        finally:
+            self.finished = time.time()
+        if self.status == 'done' and self.on_done is not None:
+            self.on_done(self._df)
+        elif self.error is not None and self.on_error is not None:
+            self.on_error(self.error)
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def done(self):
+        return self.status in ('done', 'error', 'cancelled')
+
+    def result(self, timeout=None):
+        """Waits for the job and returns its DataFrame (raises the job error if it failed)"""
+        self._thread.join(timeout)
+        if not self.done():
+            raise TimeoutError(f'Job {self.name} still running')
+        if self.error is not None:
+            raise self.error
+        return self._df
+
+    def cancel(self):
+        """Cancels the job: stops fetching and interrupts the running statement where the driver supports it"""
+        self._cancel.set()
+        conn = self._conn
+        if conn is not None:
+            raw = conn.connection.connection
+            if hasattr(raw, 'cancel'):  # cx_Oracle
+                raw.cancel()
+            elif hasattr(raw, 'interrupt'):  # sqlite3
+                raw.interrupt()
+
+    def __repr__(self):
+        return f'<QueryJob {self.name}: {self.status}, rows: {self.rows}, elapsed: {self.elapsed:.1f}s>'
+
+
+def _catalog_result(df, print_result):
+    if print_result:
+        print_tabular_data(df.fillna('-'))
+    else:
+        return df
+
+
+def get_tables(table_name, engine, print_result=True, exact_match=False, live=False):
+    """Finds tables by name, from the local catalog index (see db_catalog) unless live is True"""
 
     if engine.url.drivername.startswith('oracle'):
         sql = '''select table_name, owner, last_analyzed from all_tables where table_name like upper(:tab) order by 1'''
@@ -144,11 +696,14 @@ def get_tables(table_name, engine, print_result=True, exact_match=False):
 
     if not exact_match:
         table_name = f'%{table_name}%'
+    if not live and db_catalog.catalog_enabled:
+        return _catalog_result(db_catalog.get_catalog(engine).tables(table_name), print_result)
     print(sql, table_name)
     return sql2df(sql, engine, {'tab': table_name}, print_result=print_result)
 
 
-def get_views(view_name, engine, print_result=True, exact_match=False):
+def get_views(view_name, engine, print_result=True, exact_match=False, live=False):
+    """Finds views by name, from the local catalog index (see db_catalog) unless live is True"""
 
     if engine.url.drivername.startswith('oracle'):
         sql = '''select table_name, owner, view_type, read_only from all_views where view_name like upper(:view) order by 1'''
@@ -163,18 +718,23 @@ def get_views(view_name, engine, print_result=True, exact_match=False):
 
     if not exact_match:
         view_name = f'%{view_name}%'
+    if not live and db_catalog.catalog_enabled:
+        return _catalog_result(db_catalog.get_catalog(engine).tables(view_name, 'VIEW'), print_result)
     print(sql, view_name)
     return sql2df(sql, engine, {'view': view_name}, print_result=print_result)
 
 
-def desc_table(table_name, engine, print_result=True):
+def desc_table(table_name, engine, print_result=True, live=False):
     """
-    Function to find columns for given table
+    Function to find columns for given table, from the local catalog index (see db_catalog) unless live is True
     """
 
+    if not live and db_catalog.catalog_enabled:
+        return _catalog_result(db_catalog.get_catalog(engine).table_columns(table_name), print_result)
+
     if engine.url.drivername.startswith('oracle'):
         sql = '''select owner, table_name, column_name, nullable, data_type, data_length, char_used, last_analyzed
-        from all_tab_columns where table name like upper(:tab) order by table_name, column_id'''
+        from all_tab_columns where table_name like upper(:tab) order by table_name, column_id'''
     elif engine.url.drivername.startswith('mysql'):
         sql = '''select table_schema, table_name, column_name, is_nullable, column_type, null data_length, null char_used, null last_analyzed
         from information_schema.columns where table_name like upper(:tab)'''
@@ -201,31 +761,491 @@ def get_db_version(engine, print_result=True):
     return sql2df(sql, engine, print_result=print_result)
 
 
-def load_table(table_name, engine, schema=None, sample_size=None):
-    """Function to load entire table into a pd.DataFrame"""
-    if sample_size:
-        if schema:
-            schema += '.'
-        else:
-            schema = ''
-
-        if engine.url.drivername.startswith('oracle'):
-            sql = f'''select * from {schema}{table_name} sample({sample_size})'''
-        elif engine.url.drivername.startswith('mysql'):
-            sql = f'''select * from {schema}{table_name} where rand() < {sample_size}/100'''
-        elif engine.url.drivername.startswith('sqlite'):
-            sql = f'''select * from {schema}{table_name} where random() < {sample_size}/100'''
+def table_version(table_name, engine, schema=None):
+    """
+    Returns a freshness token for a table from cheap catalog metadata, None if not available:
+    update_time on mysql, last_analyzed on oracle and the mtime/size of the db file and of its
+    write-ahead log (-wal, where WAL mode commits go until a checkpoint) on sqlite
+    """
+    if engine.url.drivername.startswith('oracle'):
+        sql = '''select to_char(last_analyzed, 'yyyy-mm-dd hh24:mi:ss') from all_tables
+        where table_name = upper(:tab) and owner = nvl(upper(:owner), user)'''
+    elif engine.url.drivername.startswith('mysql'):
+        sql = '''select cast(update_time as char) from information_schema.tables
+        where table_name = :tab and table_schema = coalesce(:owner, database())'''
+    elif engine.url.drivername.startswith('sqlite'):
+        if not engine.url.database or engine.url.database == ':memory:':
+            return None
+        # PRAGMA data_version only detects changes within one connection, so the files are compared
+        version = list()
+        for path in (engine.url.database, engine.url.database + '-wal'):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            version.append(f'{st.st_mtime_ns}-{st.st_size}')
+        return '|'.join(version) or None
+    else:
+        raise Exception(f'{engine.url.drivername} not supported!')
+
+    row = fetch_data(sql, engine, params={'tab': table_name, 'owner': schema}).fetchone()
+    return row[0] if row is not None else None
+
+
+def _table_snapshot_path(table_name, engine, schema=None):
+    key = f'{engine.url!r}|{schema}|{table_name}'.lower()
+    return table_cache_dir / f'{table_name}-{hashlib.sha1(key.encode()).hexdigest()[:16]}.parquet'
+
+
+def _load_table_snapshot(path, version):
+    meta = path.with_suffix('.json')
+    if version is None or not path.exists() or not meta.exists():
+        return None
+    if json.loads(meta.read_text()).get('version') != version:
+        return None
+    return pd.read_parquet(path)
+
+
+def _write_table_snapshot(df, path, version, table_name):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    df.to_parquet(tmp, compression='zstd', index=False)
+    os.replace(tmp, path)
+    path.with_suffix('.json').write_text(json.dumps({'table': table_name, 'version': version,
+                                                     'rows': len(df), 'created': time.time()}))
+
+
+def load_table(table_name, engine, schema=None, sample_size=None, cache=False, refresh=False, compact=None,
+               parallel=None, sample_rows=None):
+    """
+    Function to load entire table into a pd.DataFrame
+    If cache is True the table is stored as a compressed parquet snapshot under table_cache_dir
+    and reloaded from it as long as the table version (see table_version) is unchanged.
+    refresh forces reloading from the db.
+    If compact is True (default: db_fetch.compact_results) the DataFrame dtypes are compacted (see compact_frame).
+    If parallel is > 1 the table is loaded in that many ranges over parallel connections (see load_table_parallel).
+    sample_size loads a ~sample_size % sample of the table (see sample_table), sample_rows a uniform
+    sample of exactly sample_rows rows (of the sample_size % sample if both are given, see reservoir_sample).
+    """
+    if sample_size or sample_rows:
+        df = sample_table(table_name, engine, schema, sample_size, sample_rows)
+        print(f"Sample: {df.attrs['sample']['method']}, {len(df)} rows, "
+              f"estimated scan fraction {df.attrs['sample']['scan_fraction']:.2%}")
+    else:
+        df = _load_table(table_name, engine, schema, cache, refresh, parallel)
+    if compact if compact is not None else db_fetch.compact_results:
+        df = compact_frame(df, report=True)
+    return df
+
+
+def _load_table(table_name, engine, schema, cache=False, refresh=False, parallel=None):
+    if cache:
+        version = table_version(table_name, engine, schema)
+        if version is None:
+            print(f'No version info for {table_name}, snapshot cache not used.')
         else:
-            raise Exception(f'{engine.url.drivername} not supported!')
+            path = _table_snapshot_path(table_name, engine, schema)
+            df = None if refresh else _load_table_snapshot(path, version)
+            if df is not None:
+                print(f'Loaded from snapshot {path} (version {version})')
+                return df
+            df = _load_table(table_name, engine, schema, parallel=parallel)
+            _write_table_snapshot(df, path, version, table_name)
+            return df
 
-        df = pd.read_sql(sql, engine)
+    if parallel and parallel > 1:
+        df = load_table_parallel(table_name, engine, schema, parallel)
     else:
         df = pd.read_sql_table(table_name, engine, schema=schema)
 
     return df
 
 
-def get_table_counts(table_name, column_names, engine, agg=list(), filter_=list(), sort=None, asc=False, print_result=True):
+def _split_int_range(lo, hi, n):
+    """Splits [lo, hi] into at most n disjoint [start, end) ranges"""
+    n = max(1, min(n, hi - lo + 1))
+    bounds = [lo + (hi - lo + 1) * i // n for i in range(n)] + [hi + 1]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def table_partitions(table_name, engine, schema=None, n=4):
+    """
+    Splits a table into n disjoint ranges for parallel loading:
+    ROWID ranges of the table extents on oracle (see _oracle_partitions), rowid on sqlite
+    and an integer primary key on mysql.
+    Returns a list of (where clause, params) or None if the table can't be partitioned
+    """
+    if engine.url.drivername.startswith('oracle'):
+        return _oracle_partitions(table_name, engine, schema, n)
+
+    key = _integer_key(table_name, engine, schema)
+    if key is None:
+        return None
+    column, lo, hi = key
+    return [(f'{column} >= :lo and {column} < :hi', {'lo': start, 'hi': end})
+            for start, end in _split_int_range(lo, hi, n)]
+
+
+def _oracle_partitions(table_name, engine, schema, n):
+    """
+    DBMS_PARALLEL_EXECUTE style ROWID ranges: the table extents (dba_extents) sorted by file and block
+    are split into n groups of about the same number of blocks, each read by its own range scan of rowids.
+    Without access to dba_extents or for partitioned tables: ora_hash(rowid) buckets (one scan per bucket)
+    """
+    try:
+        extents = fetch_data('''select o.data_object_id, e.relative_fno, e.block_id, e.blocks
+        from dba_extents e join dba_objects o on o.owner = e.owner and o.object_name = e.segment_name
+        and o.object_type = 'TABLE'
+        where e.owner = nvl(:owner, sys_context('userenv', 'current_schema')) and e.segment_name = :name
+        and e.segment_type = 'TABLE' order by e.relative_fno, e.block_id''', engine,
+                             params={'owner': schema.upper() if schema else None, 'name': table_name.upper()}).fetchall()
+    except sa.exc.DatabaseError:
+        extents = list()
+    if len({e[0] for e in extents}) != 1:
+        return [('ora_hash(rowid, :buckets) = :bucket', {'buckets': n - 1, 'bucket': i}) for i in range(n)]
+
+    total = sum(e[3] for e in extents)
+    groups, blocks = [[]], 0
+    for extent in extents:
+        if blocks >= total * len(groups) / n:
+            groups.append([])
+        groups[-1].append(extent)
+        blocks += extent[3]
+    where = ('rowid between dbms_rowid.rowid_create(1, :obj, :lo_file, :lo_block, 0) '
+             'and dbms_rowid.rowid_create(1, :obj, :hi_file, :hi_block, 32767)')
+    return [(where, {'obj': g[0][0], 'lo_file': g[0][1], 'lo_block': g[0][2],
+                     'hi_file': g[-1][1], 'hi_block': g[-1][2] + g[-1][3] - 1}) for g in groups]
+
+
+def _integer_key(table_name, engine, schema=None):
+    """
+    Returns (column, min, max) of the integer key used for range access: rowid on sqlite
+    and a single column integer primary key on mysql. None if the table has no such key or is empty
+    (or on the other dbs)
+    """
+    table = _table_ref(schema, table_name)
+    if engine.url.drivername.startswith('sqlite'):
+        column = 'rowid'
+    elif engine.url.drivername.startswith('mysql'):
+        pk = sa.inspect(engine).get_pk_constraint(table_name, schema=schema)['constrained_columns']
+        columns = {c['name']: c['type'] for c in sa.inspect(engine).get_columns(table_name, schema=schema)}
+        if len(pk) != 1 or not isinstance(columns[pk[0]], sa.types.Integer):
+            return None
+        column = pk[0]
+    else:
+        return None
+
+    try:
+        lo, hi = fetch_data(f'select min({column}), max({column}) from {table}', engine).fetchone()
+    except sa.exc.OperationalError:
+        # sqlite WITHOUT ROWID tables
+        return None
+    if lo is None:
+        return None
+    return column, lo, hi
+
+
+# keys per block of the rowid/primary key block sampling and blocks per query
+sample_block_keys = 1000
+sample_blocks_per_query = 50
+
+
+def _block_sample(table, engine, column, lo, hi, fraction, rng):
+    """
+    Reads random disjoint blocks of sample_block_keys consecutive keys covering ~fraction of [lo, hi]
+    with index range scans. Returns (DataFrame, fraction of the key range read)
+    """
+    span = hi - lo + 1
+    width = max(1, min(sample_block_keys, round(span * fraction)))
+    slots = span // width
+    blocks = min(slots, max(1, round(span * fraction / width)))
+    starts = np.sort(rng.choice(slots, size=blocks, replace=False)) * width + lo
+    frames = list()
+    with engine.connect() as conn:
+        for i in range(0, len(starts), sample_blocks_per_query):
+            batch = starts[i:i + sample_blocks_per_query].tolist()
+            where = ' or '.join(f'{column} between :lo{j} and :hi{j}' for j in range(len(batch)))
+            params = {f'lo{j}': start for j, start in enumerate(batch)}
+            params.update({f'hi{j}': start + width - 1 for j, start in enumerate(batch)})
+            frames.append(fetch_frame(conn.execute(sa.text(f'select * from {table} where {where}'), params)))
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    return df, blocks * width / span
+
+
+def reservoir_sample(chunks, n, rng=None, columns=None):
+    """
+    Uniform sample of n rows of a stream of DataFrames (ex: fetch_chunks) with reservoir sampling.
+    Holds at most the sample and one chunk in memory. The sample rows are not in the table order.
+    :param columns: Columns of the empty DataFrame returned when the stream has no rows
+    """
+    rng = rng or np.random.default_rng()
+    sample, seen = None, 0
+    for chunk in chunks:
+        if sample is None or len(sample) < n:
+            take = chunk.iloc[:n - (0 if sample is None else len(sample))]
+            sample = take if sample is None else pd.concat([sample, take], ignore_index=True)
+            seen += len(take)
+            chunk = chunk.iloc[len(take):]
+            if not len(chunk):
+                continue
+        # row t (1 based position in the stream) replaces a random sample row with probability n / t
+        positions = rng.integers(0, np.arange(seen + 1, seen + len(chunk) + 1))
+        seen += len(chunk)
+        hits = np.flatnonzero(positions < n)
+        if not len(hits):
+            continue
+        # a sample slot hit more than once keeps the last (latest) row
+        slots, last = np.unique(positions[hits][::-1], return_index=True)
+        rows = hits[::-1][last]
+        keep = np.ones(len(sample), dtype=bool)
+        keep[slots] = False
+        sample = pd.concat([sample[keep], chunk.iloc[rows]], ignore_index=True)
+    return pd.DataFrame(columns=columns) if sample is None else sample
+
+
+def sample_table(table_name, engine, schema=None, sample_pct=None, sample_rows=None, seed=None, chunksize=10000):
+    """
+    Random sample of a table, df.attrs['sample'] holds the method and the estimated fraction of the table read.
+    sample_pct: ~sample_pct % of the rows, read without a full scan where possible:
+        oracle: SAMPLE BLOCK
+        sqlite / mysql: random blocks of rowid / integer primary key ranges (see _block_sample),
+        other mysql tables: where rand() < p (full scan)
+    sample_rows: exactly sample_rows rows (fewer if the table or the sample_pct sample is smaller)
+        with a reservoir over the streamed rows (see reservoir_sample)
+    Block samples are clustered: rows stored next to each other are sampled together.
+    """
+    table = _table_ref(schema, table_name)
+    rng = np.random.default_rng(seed)
+    fraction = sample_pct / 100 if sample_pct else None
+    if fraction is not None and not 0 < fraction < 1:
+        raise ValueError(f'sample percentage must be between 0 and 100, got {sample_pct}')
+
+    if fraction is not None and not engine.url.drivername.startswith('oracle'):
+        key = _integer_key(table_name, engine, schema)
+        if key is not None and sample_rows is None:
+            column, lo, hi = key
+            df, scan = _block_sample(table, engine, column, lo, hi, fraction, rng)
+            df.attrs['sample'] = {'method': f'{column} block sample ({sample_block_keys} keys per block)',
+                                  'scan_fraction': scan}
+            return df
+
+    where = ''
+    if fraction is None:
+        source, method, scan = table, 'full scan', 1.0
+    else:
+        source, where, method = _sample_source(table, engine, fraction)
+        scan = fraction if engine.url.drivername.startswith('oracle') else 1.0
+        where = f'where {where}' if where else ''
+
+    sql = f'select * from {source} {where}'
+    if sample_rows is None:
+        df = sql2df(sql, engine)
+    else:
+        with engine.connect() as conn:
+            res = conn.execution_options(stream_results=True).execute(sa.text(sql))
+            df = reservoir_sample(fetch_chunks(res, chunksize), sample_rows, rng, columns=list(res.keys()))
+            res.close()
+        method = f'reservoir of {sample_rows} rows over {method}'
+    df.attrs['sample'] = {'method': method, 'scan_fraction': scan}
+    return df
+
+
+def _load_partition(table, where, params, engine):
+    with engine.connect() as conn:
+        return fetch_frame(conn.execute(sa.text(f'select * from {table} where {where}'), params))
+
+
+def load_table_parallel(table_name, engine, schema=None, parallel=4):
+    """
+    Function to load a table into a pd.DataFrame over parallel connections,
+    each fetching one of the ranges returned by table_partitions
+    """
+    partitions = table_partitions(table_name, engine, schema, parallel)
+    if not partitions:
+        print(f'{table_name} can not be partitioned, loading serially.')
+        return _load_table(table_name, engine, schema)
+
+    table = _table_ref(schema, table_name)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(partitions)) as pool:
+        frames = list(pool.map(lambda p: _load_partition(table, p[0], p[1], engine), partitions))
+    # partitions are in range order; concat copies every column once into its final block
+    df = pd.concat(frames, ignore_index=True, copy=False)
+    return _table_dtypes(df, sa.Table(table_name, sa.MetaData(), schema=schema, autoload_with=engine))
+
+
+def _table_dtypes(df, table):
+    """
+    Converts the columns of df to the dtypes pd.read_sql_table gives for the reflected table:
+    date/datetime types to datetime64 (utc if timezone aware), booleans without nulls to bool, decimals to float
+    """
+    for column in table.columns:
+        if column.name not in df.columns:
+            continue
+        s, col_type = df[column.name], column.type
+        if isinstance(col_type, (sa.types.Date, sa.types.DateTime)):
+            df[column.name] = pd.to_datetime(s, errors='coerce', utc=getattr(col_type, 'timezone', False))
+        elif isinstance(col_type, sa.types.Boolean) and not s.hasnans:
+            df[column.name] = s.astype(bool)
+        elif isinstance(col_type, sa.types.Numeric) and s.dtype == object:
+            df[column.name] = s.astype(float)
+    return df
+
+
+def _write_columns(df, dates_as_text=False):
+    """
+    DataFrame columns as lists of db driver friendly python values (NaN/NaT -> None)
+    :param dates_as_text: datetimes as 'yyyy-mm-dd hh:mm:ss.ffffff' strings (sqlite, the sqlite3 datetime adapter is slow)
+    """
+    columns = list()
+    for i in range(len(df.columns)):
+        s = df.iloc[:, i]
+        if dates_as_text and pd.api.types.is_datetime64_dtype(s.dtype):
+            values = [v.replace('T', ' ') for v in np.datetime_as_string(s.values, unit='us').tolist()]
+        elif pd.api.types.is_datetime64_any_dtype(s.dtype):
+            values = list(s.dt.to_pydatetime())
+        else:
+            values = s.tolist()  # numpy scalars -> python int/float/bool
+        if s.hasnans:
+            values = [None if isna else v for v, isna in zip(values, s.isna().tolist())]
+        columns.append(values)
+    return columns
+
+
+def _write_batches(df, batch_size, dates_as_text=False):
+    """Yields lists of row tuples of at most batch_size rows"""
+    for start in range(0, len(df), batch_size):
+        yield list(zip(*_write_columns(df.iloc[start:start + batch_size], dates_as_text)))
+
+
+def _executemany_write(raw, df, table, columns, paramstyle, batch_size, dates_as_text=False):
+    if paramstyle == 'named':  # cx_Oracle: positional :1, :2 .. binds
+        binds = ', '.join(f':{i + 1}' for i in range(len(columns)))
+    elif paramstyle in ('format', 'pyformat'):
+        binds = ', '.join(['%s'] * len(columns))
+    else:
+        binds = ', '.join(['?'] * len(columns))
+    sql = f'insert into {table} ({", ".join(columns)}) values ({binds})'
+    cur = raw.cursor()
+    if hasattr(cur, 'bindarraysize'):  # cx_Oracle array binding of the whole batch
+        cur.bindarraysize = batch_size
+    for rows in _write_batches(df, batch_size, dates_as_text):
+        cur.executemany(sql, rows)
+    cur.close()
+
+
+_load_data_escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+
+def _load_data_text(df):
+    """
+    df as the tab separated text read by LOAD DATA ... escaped by '\\':
+    backslash, tab, newline, carriage return and NUL escaped, NULL as the unescaped marker \\N
+    """
+    fields = list()
+    for i in range(len(df.columns)):
+        s = df.iloc[:, i].reset_index(drop=True)
+        if pd.api.types.is_bool_dtype(s.dtype):
+            text = s.map({True: '1', False: '0'})
+        elif pd.api.types.is_datetime64_any_dtype(s.dtype):
+            text = s.dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+        elif pd.api.types.is_numeric_dtype(s.dtype):
+            text = s.astype(str)
+        else:
+            text = s.astype(str).str.translate(_load_data_escapes)
+        fields.append(text.where(s.notna(), '\\N'))
+    if not fields or not len(df):
+        return ''
+    lines = fields[0].str.cat(fields[1:], sep='\t') if len(fields) > 1 else fields[0]
+    return '\n'.join(lines.tolist()) + '\n'
+
+
+def _write_connection(engine, local_infile=False):
+    """
+    DBAPI connection of write_table: a pooled one, or with local_infile a dedicated mysql
+    connection with LOAD DATA LOCAL INFILE enabled (the pooled connections keep it disabled)
+    """
+    if not local_infile:
+        return engine.raw_connection()
+    cargs, cparams = engine.dialect.create_connect_args(engine.url)
+    cparams['allow_local_infile' if engine.dialect.driver == 'mysqlconnector' else 'local_infile'] = True
+    return engine.dialect.connect(*cargs, **cparams)
+
+
+def _load_data_write(raw, df, table, columns):
+    """mysql LOAD DATA LOCAL INFILE of df written as a tab separated temporary file"""
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False, encoding='utf-8', newline='') as f:
+        f.write(_load_data_text(df))
+    try:
+        cur = raw.cursor()
+        cur.execute(f"""load data local infile '{f.name}' into table {table}
+        character set utf8mb4 fields terminated by '\\t' escaped by '\\\\' lines terminated by '\\n'
+        ({", ".join(columns)})""")
+        cur.close()
+    finally:
+        os.remove(f.name)
+
+
+def write_table(df, table_name, engine, schema=None, if_exists='fail', batch_size=10000, bulk=True):
+    """
+    Function to write a DataFrame into a db table (the index is not written).
+    Rows are inserted with executemany in batches of batch_size rows (array binding on oracle),
+    with LOAD DATA LOCAL INFILE on mysql when bulk is True, in a single transaction.
+    The rows are loaded in one transaction, but not the table (re)creation of replace (and a new table)
+    nor truncate on mysql/oracle (DDL, implicitly committed): if the load fails the table is left
+    empty, the previous rows are lost.
+    :param if_exists: fail|append|replace|truncate what to do when the table exists
+    :return: number of rows written
+    """
+    if if_exists not in ('fail', 'append', 'replace', 'truncate'):
+        raise ValueError(f'Invalid if_exists: {if_exists}')
+
+    drivername = engine.url.drivername
+    exists = sa.inspect(engine).has_table(table_name, schema=schema)
+    if exists and if_exists == 'fail':
+        raise ValueError(f'Table {_table_ref(schema, table_name)} already exists.')
+    if not exists or if_exists == 'replace':
+        # pandas maps the dtypes to the dialect column types
+        df.head(0).to_sql(table_name, engine, schema=schema, if_exists='replace', index=False)
+
+    quote = engine.dialect.identifier_preparer.quote
+    table = f'{quote(schema)}.{quote(table_name)}' if schema else quote(table_name)
+    columns = [quote(str(c)) for c in df.columns]
+
+    start = time.perf_counter()
+    load_data = bulk and drivername.startswith('mysql') and len(df) > 0
+    raw = _write_connection(engine, local_infile=load_data)
+    try:
+        cur = raw.cursor()
+        if exists and if_exists == 'truncate':
+            cur.execute(f'delete from {table}' if drivername.startswith('sqlite') else f'truncate table {table}')
+        cur.close()
+        method = 'executemany'
+        if load_data:
+            try:
+                _load_data_write(raw, df, table, columns)
+                method = 'load data local infile'
+            except Exception as e:
+                print(f'LOAD DATA LOCAL INFILE failed ({e}), using executemany.')
+                raw.rollback()
+                _executemany_write(raw, df, table, columns, engine.dialect.paramstyle, batch_size)
+        else:
+            _executemany_write(raw, df, table, columns, engine.dialect.paramstyle, batch_size,
+                               dates_as_text=drivername.startswith('sqlite'))
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+    elapsed = time.perf_counter() - start
+    print(f'{len(df)} rows written to {table} ({method}) in {elapsed:.2f}s, '
+          f'{len(df) / elapsed if elapsed else 0:,.0f} rows/s')
+    return len(df)
+
+
+def get_table_counts(table_name, column_names, engine, agg=list(), filter_=list(), sort=None, asc=False, print_result=True,
+                     approx=False, sample_pct=None):
     """
     Function wrapper around select count(1) cnt from table_name
     and select column_name, count(1) cnt from table_name group by column_name order by 2 desc
@@ -233,19 +1253,28 @@ def get_table_counts(table_name, column_names, engine, agg=list(), filter_=list(
     :param column_name:
     :param engine:
     :param print_result:
+    :param approx: Estimate the counts from optimizer statistics or a sample (see approx_table_counts)
+    :param sample_pct: Sample percentage of the approx estimates (default: approx_sample_pct)
     :return:
     """
-    default_agg = ['count(1) cnt']
-    agg_ = ['{0}({1}) {0}_{1}'.format(*i.popitem()) for i in agg if 'cnt_distinct' not in i]
-    if len(agg_) == 0:
-        agg_ = default_agg
+    distinct = [list(i.values())[0] for i in agg if 'cnt_distinct' in i or 'distinct_cnt' in i]
+    agg = [list(i.items())[0] for i in agg if 'cnt_distinct' not in i and 'distinct_cnt' not in i]
 
-    if 'cnt_distinct' in agg:
-        agg = agg_ + ['count(distinct {0}) distinct_{0}'.format(agg['cnt_distinct'])]
-    elif 'distinct_cnt' in agg:
-        agg = agg_ + ['count(distinct {0}) distinct_{0}'.format(agg['distinct_cnt'])]
-    else:
-        agg = agg_
+    if approx:
+        if agg:
+            raise Exception(f"{', '.join(a for a, _ in agg)} not supported with approx, only counts and distinct counts")
+        df = approx_table_counts(table_name, column_names, engine, distinct, filter_, sample_pct)
+        if sort or asc:
+            df = df.sort_values(df.columns[(sort or max(len(column_names), 1)) - 1], ascending=asc, ignore_index=True)
+        if print_result:
+            print(f"Approximate: {df.attrs['approx']}")
+            print_tabular_data(df.fillna('-'))
+        else:
+            return df
+        return
+
+    agg = ['{0}({1}) {0}_{1}'.format(*i) for i in agg] or ['count(1) cnt']
+    agg += ['count(distinct {0}) distinct_{0}'.format(c) for c in distinct]
 
     where_clause = ''
 
@@ -266,15 +1295,165 @@ def get_table_counts(table_name, column_names, engine, agg=list(), filter_=list(
     return sql2df(sql, engine, print_result=print_result)
 
 
-def find_columns(col_name, engine, print_result=True, exact_match=False):
+def table_stats(table_name, engine):
+    """
+    Returns the optimizer statistics of a table ([owner.]table_name), None if it has none:
+    {'num_rows', 'num_distinct': {column: n}, 'analyzed', 'stale', 'source'}
+    all_tab_statistics / all_tab_col_statistics on oracle, information_schema.tables.table_rows and
+    the index cardinality on mysql, sqlite_stat1 (written by ANALYZE) on sqlite.
+    stale is None when the db does not track it.
+    """
+    owner, _, table = table_name.rpartition('.')
+    params = {'tab': table, 'owner': owner or None}
+    drivername = engine.url.drivername
+
+    if drivername.startswith('oracle'):
+        row = fetch_data('''select num_rows, to_char(last_analyzed, 'yyyy-mm-dd hh24:mi:ss'), stale_stats
+        from all_tab_statistics where table_name = upper(:tab) and owner = nvl(upper(:owner), user)
+        and object_type = 'TABLE' ''', engine, params).fetchone()
+        if row is None or row[0] is None:
+            return None
+        distinct = fetch_data('''select lower(column_name), num_distinct from all_tab_col_statistics
+        where table_name = upper(:tab) and owner = nvl(upper(:owner), user) and num_distinct is not null''',
+                              engine, params).fetchall()
+        return {'num_rows': row[0], 'num_distinct': dict(distinct), 'analyzed': row[1],
+                'stale': row[2] == 'YES', 'source': 'all_tab_statistics'}
+
+    if drivername.startswith('mysql'):
+        row = fetch_data('''select table_rows, cast(coalesce(update_time, create_time) as char)
+        from information_schema.tables where table_name = :tab and table_schema = coalesce(:owner, database())''',
+                         engine, params).fetchone()
+        if row is None or row[0] is None:
+            return None
+        # cardinality is only kept for indexed columns, the leading column of an index estimates num_distinct
+        distinct = fetch_data('''select lower(column_name), max(cardinality) from information_schema.statistics
+        where table_name = :tab and table_schema = coalesce(:owner, database()) and seq_in_index = 1
+        and cardinality is not null group by column_name''', engine, params).fetchall()
+        return {'num_rows': row[0], 'num_distinct': dict(distinct), 'analyzed': row[1],
+                'stale': None, 'source': 'information_schema.tables'}
+
+    if drivername.startswith('sqlite'):
+        prefix = f'{owner}.' if owner else ''
+        if not fetch_data(f"select 1 from {prefix}sqlite_master where name = 'sqlite_stat1'", engine).fetchone():
+            return None
+        stats = fetch_data(f'select idx, stat from {prefix}sqlite_stat1 where lower(tbl) = lower(:tab)',
+                           engine, params).fetchall()
+        if not stats:
+            return None
+        # stat: rows of the table [avg rows per distinct value of the first index column ...]
+        num_rows = int(stats[0][1].split()[0])
+        distinct = dict()
+        for idx, stat in stats:
+            stat = stat.split()
+            if idx is None or len(stat) < 2:
+                continue
+            first = fetch_data(f"select name from {prefix}pragma_index_info(:idx) where seqno = 0",
+                               engine, {'idx': idx}).fetchone()
+            if first and first[0]:
+                distinct[first[0].lower()] = round(num_rows / max(int(stat[1]), 1))
+        return {'num_rows': num_rows, 'num_distinct': distinct, 'analyzed': None,
+                'stale': None, 'source': 'sqlite_stat1'}
+
+    raise Exception(f'{drivername} not supported!')
+
+
+# sample percentage of the approx_table_counts estimates without (fresh) statistics
+approx_sample_pct = 1.0
+
+
+def _sample_source(table_name, engine, fraction):
+    """Returns (from clause, where condition or None, method) of a ~fraction row sample of table_name"""
+    drivername = engine.url.drivername
+    if drivername.startswith('oracle'):
+        return f'{table_name} sample block ({fraction * 100:.6f})', None, 'SAMPLE BLOCK'
+    if drivername.startswith('mysql'):
+        return table_name, f'rand() < {fraction}', 'rand()'
+    if drivername.startswith('sqlite'):
+        # random() is a signed 64 bit integer, its low 20 bits are uniform over [0, 2^20)
+        return table_name, f'(random() & 1048575) < {round(fraction * 2 ** 20)}', 'random()'
+    raise Exception(f'{drivername} not supported!')
+
+
+def approx_table_counts(table_name, column_names, engine, distinct=(), filter_=(), sample_pct=None):
+    """
+    Estimated counts of get_table_counts(..., approx=True), df.attrs['approx'] describes the method:
+    - unfiltered table and distinct counts come from the optimizer statistics (see table_stats)
+      unless they are missing or stale
+    - otherwise the rows are counted in a sample_pct % sample and scaled, cnt_error is the
+      95% bound 1.96 * sqrt(k * (1 - p)) / p of a count of k sampled rows at sampling fraction p.
+      With no sampled row cnt is 0 and cnt_error the 95% upper bound 3 / p (rule of three).
+      Distinct counts use the bias corrected Chao1 estimator d + f1 * (f1 - 1) / (2 * (f2 + 1)), with d the
+      distinct values in the sample and f1 / f2 the values seen once / twice. On high cardinality columns
+      (almost every sampled value seen once) it overshoots towards f1^2 / 2, so it is clamped to d / p
+      (every value occurring once) and to the estimated count. It is not computed per group.
+    Block sampling (oracle) reads rows in clusters, so the bounds are optimistic for clustered data.
+    """
+    reason = 'filtered' if filter_ else 'grouped' if column_names else None
+    if reason is None:
+        stats = table_stats(table_name, engine)
+        missing = [c for c in distinct if c not in (stats or {}).get('num_distinct', {})]
+        if stats is None:
+            reason = 'no statistics'
+        elif stats['stale']:
+            reason = f"stale statistics (analyzed {stats['analyzed']})"
+        elif missing:
+            reason = f"no column statistics for {', '.join(missing)}"
+        else:
+            df = pd.DataFrame([[stats['num_rows']] + [stats['num_distinct'][c] for c in distinct]],
+                              columns=['cnt'] + [f'distinct_{c}' for c in distinct])
+            analyzed = f", analyzed {stats['analyzed']}" if stats['analyzed'] else ''
+            df.attrs['approx'] = f"{stats['source']} statistics{analyzed}"
+            return df
+
+    if distinct and column_names:
+        raise Exception('approx distinct counts are not supported with group by columns')
+
+    p = (sample_pct or approx_sample_pct) / 100
+    if not 0 < p < 1:
+        raise Exception(f'sample percentage must be between 0 and 100, got {p * 100}')
+    source, sample_where, method = _sample_source(table_name, engine, p)
+    where = ' and '.join(filter(None, [sample_where] + list(filter_)))
+    where = f'where {where}' if where else ''
+
+    if column_names:
+        columns = ', '.join(column_names)
+        df = sql2df(f'select {columns}, count(1) k from {source} {where} group by {columns} order by k desc', engine)
+    else:
+        df = sql2df(f'select count(1) k from {source} {where}', engine)
+
+    k = df.pop('k').astype('float64')
+    df['cnt'] = (k / p).round().astype('int64')
+    df['cnt_error'] = np.where(k > 0, 1.96 * np.sqrt(k * (1 - p)) / p, 3 / p).round().astype('int64')
+
+    for col in distinct:
+        cond = f'{where} and {col} is not null' if where else f'where {col} is not null'
+        freq = fetch_data(f'''select k, count(1) f from (
+        select {col}, count(1) k from {source} {cond} group by {col}
+        ) x group by k''', engine).fetchall()
+        freq = dict(freq)
+        f1, f2 = freq.get(1, 0), freq.get(2, 0)
+        d = sum(freq.values())
+        estimate = min(d + f1 * (f1 - 1) / (2 * (f2 + 1)), d / p)
+        df[f'distinct_{col}'] = min(round(estimate), int(df['cnt'].iloc[0]))
+
+    df.attrs['approx'] = f'{reason}, sampled {p * 100:g}% of the rows ({method}), cnt_error: 95% bound'
+    return df
+
+
+def find_columns(col_name, engine, print_result=True, exact_match=False, live=False):
     """
     Function to find columns by name for a fiben db engine
     :param col_name:
     :param engine:
     :param print_result: Print instead of return a DataFrame
     :param exact_match: Exact match on column name
+    :param live: Query the db dictionary instead of the local catalog index (see db_catalog)
     :return: None or pd.DataFrame
     """
+    if not live and db_catalog.catalog_enabled:
+        pattern = col_name if exact_match else f'%{col_name}%'
+        return _catalog_result(db_catalog.get_catalog(engine).columns(pattern), print_result)
+
     if engine.url.drivername.startswith('oracle'):
         if exact_match:
             col = ':col'
@@ -289,34 +1468,114 @@ def find_columns(col_name, engine, print_result=True, exact_match=False):
         else:
             col = """concat('%', :col ,'%')"""
 
-        sql = f'''select table_schema owner, table_name, column_name, is_nullable, column_type
+        sql = f'''select table_schema owner, table_name, column_name, is_nullable, column_type,
         null data_length from information_schema.columns where column_name like ({col})'''
+    elif engine.url.drivername.startswith('sqlite'):
+        if exact_match:
+            col = ':col'
+        else:
+            col = """'%'||:col||'%'"""
+
+        sql = f'''select null owner, m.name table_name, p.name column_name, not p."notnull" nullable,
+        p.type data_type, null data_length
+        from sqlite_master m join pragma_table_info(m.name) p
+        where m.type = 'table' and upper(p.name) like upper({col})'''
     else:
         raise Exception(f'{engine.url.drivername} not supported!')
 
     return sql2df(sql, engine, params={'col': col_name}, print_result=print_result)
 
 
-def find_table_by_column_value(col_name, col_value, engine, print_result=True):
+def set_statement_timeout(conn, timeout):
     """
-    Function to find tables by given column value
+    Limits the run time of the statements executed on conn (sqlalchemy Connection) to timeout seconds:
+    call_timeout on cx_Oracle, max_execution_time (selects only) on mysql and a progress handler on sqlite.
+    timeout=None removes the limit.
     """
-    df = find_columns(col_name, engine, print_result=False, exact_match=True)
-    print(f'Found {len(df)} rables containing column {col_name}')
-    df['cnt'] = 0
-    df['order'] = df.owner.str.len() + df.table_name.str.len()
-    for rec in df[['owner', 'table_name', 'order']].sort_values('order', ascending=True).to_records(index=False):
-        res = fetch_data(f'''select count(1) c from {rec[0]}.{rec[1]} where {col_name} = :val''',
-                        engine, params={'val': col_name})
-        cnt = res.fetchone()[0]
-        sys.stdout.write("\r" + f'Scanning {rec[0]}.{rec[1]} ...')
-        sys.stdout.flush()
-        if cnt == 0:
-            df = df[df.table_name != rec[1]]
+    raw = conn.connection.connection
+    drivername = conn.engine.url.drivername
+    if drivername.startswith('oracle'):
+        raw.call_timeout = int(timeout * 1000) if timeout else 0
+    elif drivername.startswith('mysql'):
+        conn.execute(sa.text('set session max_execution_time = :ms'), {'ms': int(timeout * 1000) if timeout else 0})
+    elif drivername.startswith('sqlite'):
+        if timeout:
+            deadline = time.monotonic() + timeout
+            raw.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
         else:
-            df.loc[df.table_name == rec[1], 'cnt'] = cnt
-        print('')
-        if print_result:
-            print_tabular_data(df[['owner', 'table_name', 'column_name', 'cnt']])
-        else:
-            return df[['owner', 'table_name', 'column_name', 'cnt']]
+            raw.set_progress_handler(None, 0)
+
+
+def _table_ref(owner, table_name):
+    return f'{owner}.{table_name}' if owner else table_name
+
+
+def _probe_table(owner, table_name, col_name, col_value, engine, exists_only, timeout):
+    """Counts the rows of owner.table_name where col_name = col_value. Returns (status, cnt)"""
+    table = _table_ref(owner, table_name)
+    if not exists_only:
+        sql = f'''select count(1) c from {table} where {col_name} = :val'''
+    elif engine.url.drivername.startswith('oracle'):
+        sql = f'''select count(1) c from {table} where {col_name} = :val and rownum = 1'''
+    else:
+        sql = f'''select count(1) c from (select 1 from {table} where {col_name} = :val limit 1) x'''
+
+    start = time.monotonic()
+    try:
+        with engine.connect() as conn:
+            if timeout:
+                set_statement_timeout(conn, timeout)
+            try:
+                return 'ok', conn.execute(sa.text(sql), {'val': col_value}).scalar()
+            finally:
+                if timeout:
+                    set_statement_timeout(conn, None)
+    except sa.exc.DBAPIError as e:
+        if timeout and time.monotonic() - start >= timeout:
+            return 'timeout', None
+        return f'error: {e.orig}', None
+
+
+def find_table_by_column_value(col_name, col_value, engine, print_result=True, exists_only=False,
+                               max_workers=8, timeout=None, live=False):
+    """
+    Function to find tables by given column value
+    The tables containing col_name are probed concurrently on a pool of max_workers threads.
+    :param exists_only: Stop each probe at the first matching row (cnt is 0 or 1)
+    :param timeout: Per probe timeout in seconds
+    :param live: Find the tables in the db dictionary instead of the local catalog index (see find_columns)
+    :return: None or pd.DataFrame (owner, table_name, column_name, cnt) sorted by cnt desc
+    """
+    df = find_columns(col_name, engine, print_result=False, exact_match=True, live=live)
+    total = len(df)
+    print(f'Found {total} tables containing column {col_name}')
+
+    found, failed = list(), list()
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(_probe_table, rec.owner, rec.table_name, rec.column_name, col_value,
+                               engine, exists_only, timeout): rec
+                   for rec in df[['owner', 'table_name', 'column_name']].itertuples(index=False)}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            rec = futures[future]
+            status, cnt = future.result()
+            if status != 'ok':
+                failed.append((_table_ref(rec.owner, rec.table_name), status))
+            elif cnt:
+                # matches are kept sorted as they arrive: cnt desc, owner, table_name
+                bisect.insort(found, (-cnt, rec.owner or '', rec.table_name, rec.column_name))
+            rate = done / max(time.monotonic() - start, 1e-9)
+            top = f', top: {_table_ref(found[0][1], found[0][2])} ({-found[0][0]})' if found else ''
+            sys.stdout.write(f'\rScanned {done}/{total} tables ({rate:.1f} tables/s), {len(found)} matching{top} ')
+            sys.stdout.flush()
+    print('')
+
+    for table, status in failed:
+        print(f'{table}: {status}')
+
+    df = pd.DataFrame([(owner or None, table_name, column_name, -cnt) for cnt, owner, table_name, column_name in found],
+                      columns=['owner', 'table_name', 'column_name', 'cnt'])
+    if print_result:
+        print_tabular_data(df.fillna('-'))
+    else:
+        return df
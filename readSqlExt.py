@@ -17,16 +17,41 @@ Doc: %helpsql
 
 import os
 import sys
-from cx_Oracle import DatabaseError
-from sqlalchemy import exc
+import time
 import pydoc
 
+_import_start = time.perf_counter()
+
 sys.path.append(os.path.join(os.environ['HOME'], 'python_lib'))
 import db_utilities as dbu
+import db_history
+
+# loading the extension must not connect to a database or import pandas/sqlalchemy/drivers
+IMPORT_TIME_BUDGET = 0.05  # seconds
 
 default_db_alias = 'oradb'
 mysql_schema = None
-engine = dbu.getDbConnection(default_db_alias, schema=mysql_schema, asEngine=True)
+engine = None
+
+
+def get_engine():
+    """
+    Returns the engine for the default db alias, created on first use
+    :return: sqlalchemy engine
+    """
+    global engine
+    if engine is None:
+        engine = dbu.getDbConnection(default_db_alias, schema=mysql_schema, asEngine=True)
+    return engine
+
+
+def pop_flag(line, flag):
+    """
+    Removes flag from the line parameter of a magic function
+    :return: (flag present, line without the flag)
+    """
+    args = line.split(' ')
+    return flag in args, ' '.join(a for a in args if a != flag)
 
 
 def parse_line(line, usage_fn):
@@ -87,9 +112,7 @@ def setDefaultDbAlias(line):
     #     print('MYSQL alias requires setting db schema.\nPlease set db schema ex: %setDefaultDbAlias MYSQLDEV clams')
     #     return
 
-    aliases = dbu.getDbAliases(asDataFrame=True)
-
-    if default_db_alias not in aliases[0].tolist():
+    if not dbu.isDbAlias(default_db_alias):
         print('DB Alias {} not in config.'.format(default_db_alias))
         default_db_alias = 'oradb'
         return
@@ -98,7 +121,7 @@ def setDefaultDbAlias(line):
     if default_db_alias is not None:
         print('Mysql Schema: {}'.format(mysql_schema))
 
-    engine = dbu.getDbConnection(default_db_alias, schema=mysql_schema, asEngine=True)
+    engine = None
 
 
 def helpsql(line):
@@ -148,7 +171,7 @@ def getDbObjectSource(line):
     try:
         source = dbu.getDbObjectSource(object_name, object_type, alias)
         return source
-    except DatabaseError as e:
+    except dbu.dbErrors() as e:
         print('{}'.format(e))
 
 
@@ -170,7 +193,7 @@ def findFunction(line):
     if status:
         try:
             dbu.findFunction(function_name, alias)
-        except DatabaseError as e:
+        except dbu.dbErrors() as e:
             print('{}'.format(e))
 
 
@@ -191,7 +214,7 @@ def getPackageFunctions(line):
     if status:
         try:
             dbu.getPackageFunctions(package_name, alias)
-        except DatabaseError as e:
+        except dbu.dbErrors() as e:
             print('{}'.format(e))
 
 
@@ -212,7 +235,7 @@ def getPackages(line):
     if status:
         try:
             dbu.getPackages(package_name, alias)
-        except DatabaseError as e:
+        except dbu.dbErrors() as e:
             print('{}'.format(e))
 
 
@@ -254,7 +277,7 @@ def gatherTableStats(line):
 
     try:
         dbu.gatherTableStats(table_name, owner, alias)
-    except DatabaseError as e:
+    except dbu.dbErrors() as e:
         print('{}'.format(e))
 
 
@@ -275,70 +298,73 @@ def getTableStats(line):
     if status:
         try:
             dbu.getTableStats(table_name, alias)
-        except DatabaseError as e:
+        except dbu.dbErrors() as e:
             print('{}'.format(e))
 
 
 def getTables(line):
     """
     Ipython extenstion function for finding tables
-    Usage: %getTables table_name [db_alias (default: oradb)]
+    Usage: %getTables table_name [db_alias (default: oradb)] [--live]
     :param table_name:
     :param db_alias:
     :return: None
     """
 
     def usage():
-        print('Usage: %getTables table_name [db_alias (default: {})]'.format(default_db_alias))
+        print('Usage: %getTables table_name [db_alias (default: {})] [--live]'.format(default_db_alias))
 
+    live, line = pop_flag(line, '--live')
     status, table_name, alias = parse_line(line, usage)
 
     if status:
         try:
-            dbu.getTables(table_name, alias)
-        except DatabaseError as e:
+            dbu.getTables(table_name, alias, live=live)
+        except dbu.dbErrors() as e:
             print('{}'.format(e))
 
 
 def getTabColumns(line):
     """
     Ipython extenstion function for getting table columns
-    Usage: %getTabColumns table_name [db_alias (default: oradb)]
+    Usage: %getTabColumns table_name [db_alias (default: oradb)] [--live]
     :param table_name: Name of table
     :param db_alias:
     :return:
     """
 
     def usage():
-        print('Usage: %getTabColumns table_name [db_alias (default: {})]'.format(default_db_alias))
+        print('Usage: %getTabColumns table_name [db_alias (default: {})] [--live]'.format(default_db_alias))
 
+    live, line = pop_flag(line, '--live')
     status, table_name, alias = parse_line(line, usage)
 
     if status:
         try:
-            dbu.getTableColumns(table_name, alias)
-        except DatabaseError as e:
+            dbu.getTableColumns(table_name, alias, live=live)
+        except dbu.dbErrors() as e:
             print('{}'.format(e))
 
 
 def findColumn(line):
     """
     Ipython extenstion function for searching for columns by name
-    Usage: %findColumns column_name [db_alias (default: oradb)]
+    Usage: %findColumns column_name [db_alias (default: oradb)] [--live]
     :param column_name: Name of column
     :param db_alias:
     :return:
     """
 
     def usage():
-        print('Usage: %findColumns column_name [db_alias (default: {})]'.format(default_db_alias))
+        print('Usage: %findColumns column_name [db_alias (default: {})] [--live]'.format(default_db_alias))
 
+    live, line = pop_flag(line, '--live')
     status, col_name, alias = parse_line(line, usage)
 
     if status:
         try:
-            dbu.findColumns(col_name, alias)
-        except DatabaseError as e:
+            dbu.findColumns(col_name, alias, live=live)
+        except dbu.dbErrors() as e:
             print('{}'.format(e))
 
 
@@ -351,14 +377,15 @@ def getTabIndex(line):
     """
 
     def usage():
-        print('Usage: %getTabIndex table_name [db_alias (default: {})]'.format(default_db_alias))
+        print('Usage: %getTabIndex table_name [db_alias (default: {})] [--live]'.format(default_db_alias))
 
+    live, line = pop_flag(line, '--live')
     status, table_name, alias = parse_line(line, usage)
 
     if status:
         try:
-            dbu.getTableIndex(table_name, alias)
-        except DatabaseError as e:
+            dbu.getTableIndex(table_name, alias, live=live)
+        except dbu.dbErrors() as e:
             print('{}'.format(e))
 
 
@@ -405,10 +432,14 @@ def read_sql(line, cell=None):
         print('DB Alias: {}'.format(alias))
         if mysql_schema is not None:
             print('Mysql Schema: {}'.format(mysql_schema))
+        start = time.perf_counter()
         try:
-            df = dbu.readSql(sql, con=engine)
+            df = dbu.readSql(sql, con=get_engine())
+            db_history.record(sql, alias.upper(), None, time.perf_counter() - start, *db_history.result_stats(df),
+                              source='read_sql')
             return df
-        except exc.DatabaseError as e:
+        except dbu.dbErrors() as e:
+            db_history.record(sql, alias.upper(), None, time.perf_counter() - start, error=e, source='read_sql')
             print('{}'.format(e))
 
     else:
@@ -420,10 +451,14 @@ def read_sql(line, cell=None):
         print('DB Alias: {}'.format(alias))
 
         if cell is not None:
+            start = time.perf_counter()
             try:
-                df = dbu.readSql(cell, con=engine)
+                df = dbu.readSql(cell, con=get_engine())
+                db_history.record(cell, alias.upper(), None, time.perf_counter() - start, *db_history.result_stats(df),
+                                  source='read_sql')
                 return df
-            except exc.DatabaseError as e:
+            except dbu.dbErrors() as e:
+                db_history.record(cell, alias.upper(), None, time.perf_counter() - start, error=e, source='read_sql')
                 print('{}'.format(e))
         return
 
@@ -470,7 +505,7 @@ def explain_sql(line, cell=None):
         if cell is not None:
             try:
                 dbu.explainSQL(cell, alias)
-            except DatabaseError as e:
+            except dbu.dbErrors() as e:
                 print('{}'.format(e))
             return
         else:
@@ -505,6 +540,13 @@ def load_ipython_extension(ipython, *args):
     ipython.register_magic_function(helpsql, 'line', magic_name='helpsql')
     ipython.register_magic_function(getDbAliases, 'line', magic_name='getDbAliases')
 
+    if import_time > IMPORT_TIME_BUDGET:
+        print('Warning: readSqlExt import took {:.0f} ms (budget {:.0f} ms)'.format(import_time * 1000,
+                                                                               IMPORT_TIME_BUDGET * 1000))
+
+
+import_time = time.perf_counter() - _import_start
+
 # # Uncomment if ever need to unload the extension
 # def unload_ipython_extension(ipython):
 #     pass
@@ -1,16 +1,40 @@
+import re
 import sys
+import argparse
+import time
 import pathlib
-import sqlalchemy as sa
+import functools
+
+_import_start = time.perf_counter()
 
 
 from IPython.core.magic import Magics, magics_class, line_magic, line_cell_magic, needs_local_scope
 from IPython.core.magic_arguments import argument, magic_arguments, parse_argstring
 from IPython.terminal.prompts import Prompts, Token
+try:
+    from IPython.core.completer import context_matcher, SimpleCompletion
+except ImportError:  # IPython < 8.6 has no context aware matchers: no name completion
+    context_matcher = None
 
 utils_path = pathlib.Path().home() / 'utils'
 sys.path.append(utils_path.as_posix())
 
 import db_utils as dbu
+from db_cache import result_cache, is_read_only
+import db_history
+import db_catalog
+import db_script
+from db_lazy import LazyModule
+
+sa = LazyModule('sqlalchemy')
+
+# loading the extension must not connect to a database or import pandas/sqlalchemy/drivers
+IMPORT_TIME_BUDGET = 0.05  # seconds
+
+# magics whose arguments/cells are completed with schema, table and column names
+_completion_magic_re = re.compile(r'^\s*%%?(sql|desc|desc_table|get_table_counts|get_tables|get_views|find_columns|'
+                                  r'load_table|find_table_by_column_value)\b')
+_completion_alias_re = re.compile(r'(?:-d|--db-alias)[ =](\S+)')
 
 class SqlPrompt(Prompts):
     def __init__(self, shell, name, is_trans=False):
@@ -33,11 +57,19 @@ class SqlMagic(Magics):
     default_db_alias = 'sqlite_tesla'
     mysql_schema = None
 
-    engine = dbu.get_dbconnection(default_db_alias)
-
     conn, trans = None, None
 
-    def get_engine(self, args):
+    def __init__(self, shell=None, **kwargs):
+        super().__init__(shell=shell, **kwargs)
+        self.jobs = dict()
+
+    @property
+    def engine(self):
+        """Engine of the default connection, created on first use"""
+        return dbu.get_engine(self.default_db_alias, mysql_schema=self.mysql_schema)
+
+    def get_alias(self, args):
+        """Returns (alias, mysql_schema) from the --db-alias argument or the default connection, alias upper case"""
         mysql_schema = None
         if 'db_alias' in args and args.db_alias:
             alias = args.db_alias
@@ -46,13 +78,45 @@ class SqlMagic(Magics):
                 mysql_schema = schema.lower()
         else:
             alias = self.default_db_alias
+            mysql_schema = self.mysql_schema
+        # upper case like the config aliases (engine registry, sessions, history)
+        return alias.upper() if alias else alias, mysql_schema
 
-        if alias != self.default_db_alias:
-            engine = dbu.get_dbconnection(alias, mysql_schema=mysql_schema, as_engine=True)
-        else:
-            engine = self.engine
-        return engine
+    def get_engine(self, args):
+        alias, mysql_schema = self.get_alias(args)
+        # engines are cached per (alias, schema) so the default one is looked up the same way
+        return dbu.get_engine(alias, mysql_schema=mysql_schema)
+
+
+    def complete_names(self, context):
+        """
+        Completes schema, table and column names in the sql magics from the local catalog (see db_catalog)
+        of the alias of the magic (-d) or the default connection.
+        The catalog name index is loaded in the background: no completions until it is ready.
+        """
+        no_completions = {'completions': [], 'suppress': False}
+        header = context.full_text.lstrip().split('\n', 1)[0]
+        if not header.startswith('%%sql'):
+            header = context.line_with_cursor
+            if not _completion_magic_re.match(header):
+                return no_completions
+        token = context.token
+        if not token or token.startswith(('-', '%')):
+            return no_completions
+
+        match = _completion_alias_re.search(header)
+        alias, mysql_schema = self.get_alias(argparse.Namespace(db_alias=match.group(1).upper() if match else None))
+        try:
+            index = db_catalog.get_catalog(dbu.get_engine(alias, mysql_schema=mysql_schema)).name_index()
+        except Exception:
+            return no_completions
+        if index is None:
+            return no_completions
 
+        names = index.complete(token, context.limit or 200)
+        if token.islower():
+            names = [n.lower() for n in names]
+        return {'completions': [SimpleCompletion(n, type='sql') for n in names], 'suppress': bool(names)}
 
     @magic_arguments()
     @argument('filter', nargs='?', help='Filter by db alias')
@@ -93,31 +157,98 @@ class SqlMagic(Magics):
             db_alias = args.db_alias
             mysql_schema = None
 
-        aliases = dbu.get_db_aliases(as_dataframe=True)
-
-        if db_alias not in aliases.alias.tolist():
+        if not dbu.is_db_alias(db_alias):
             print(f'Db alias {db_alias} not in config')
             return
 
         self.default_db_alias = db_alias
         self.mysql_schema = mysql_schema
 
-        self.engine = dbu.get_dbconnection(self.default_db_alias, mysql_schema=self.mysql_schema, as_engine=True)
         self.get_default_connection(line)
 
         self.conn = None
         self.trans = None
 
 
+    @magic_arguments()
+    @argument('-d', '--db-alias', type=str.upper, help='Db Alias: db_alias|db_alias.schema (mysql)')
+    @argument('--dispose', action='store_true', help='Dispose the engine for --db-alias (all engines if not given)')
+    @argument('--idle-timeout', type=float, help='Dispose engines idle for more than N seconds (<= 0 disables eviction)')
+    @line_magic('sql_engines')
+    def sql_engines(self, line):
+        """Lists/disposes the cached per alias engines"""
+        args = parse_argstring(self.sql_engines, line)
+
+        if args.idle_timeout is not None:
+            dbu.engine_idle_timeout = args.idle_timeout if args.idle_timeout > 0 else None
+            print(f'Engine idle timeout: {dbu.engine_idle_timeout}')
+
+        if args.dispose:
+            alias, mysql_schema = args.db_alias, None
+            if alias and '.' in alias:
+                alias, mysql_schema = alias.split('.')
+                mysql_schema = mysql_schema.lower()
+            for key in dbu.dispose_engines(alias, mysql_schema):
+                print(f'Disposed engine: {key[0]}{"." + key[1] if key[1] else ""}')
+            return
+
+        dbu.list_engines()
+
+    @magic_arguments()
+    @argument('action', nargs='?', choices=['on', 'off', 'status'], default='status')
+    @argument('-d', '--db-alias', type=str.upper, help='Db Alias: db_alias|db_alias.schema (mysql)')
+    @line_magic('sql_session')
+    def sql_session(self, line):
+        """
+        Pins a connection per alias for the %%sql statements: session state (temp tables, ALTER SESSION,
+        USE) is kept and reads run without checkout/begin/rollback.
+        Usage: %sql_session on|off|status [-d ALIAS]
+        """
+        args = parse_argstring(self.sql_session, line)
+        alias, mysql_schema = self.get_alias(args)
+
+        if args.action == 'on':
+            try:
+                session = dbu.open_session(alias, mysql_schema)
+            except sa.exc.DBAPIError as e:
+                print(f'{e}')
+                return
+            print(f'Session on: {session.name}')
+        elif args.action == 'off':
+            # without -d all sessions are closed
+            closed = dbu.close_session(alias, mysql_schema) if args.db_alias else dbu.close_session()
+            for key in closed:
+                print(f'Session off: {key[0]}{"." + key[1] if key[1] else ""}')
+            if not closed:
+                print('No open session')
+        else:
+            dbu.list_sessions()
+
     @magic_arguments()
     @argument('-d', '--db-alias', type=str.upper, help='Db Alias: db_alias|db_alias.schema (mysql)')
     @argument('--commit', action='store_true', help='Commit sql. Default: False')
+    @argument('--chunksize', type=int, help='Stream the result with a server side cursor in chunks of N rows. Returns an iterator of DataFrames')
+    @argument('--callback', type=str, help='Name of a function in the user namespace called with every chunk (requires --chunksize)')
+    @argument('--background', type=str, metavar='NAME',
+              help='Run in a worker thread and store the result in the variable NAME when done (see %%sql_jobs)')
+    @argument('--no-cache', action='store_true', help='Bypass the result cache (see %%sql_cache)')
+    @argument('--profile', action='store_true', help='Report per phase timings (also stored in df.attrs["profile"])')
+    @argument('--compact', action='store_true', help='Downcast numeric columns and convert low cardinality strings to category')
+    @argument('--max-bytes', type=str,
+              help='Memory budget of the result, larger results are spilled to disk and returned as a lazy '
+                   'SpilledResult. Ex: 2GB, 0: no limit. Default: half of the physical memory')
+    @argument('--aliases', type=str, metavar='PATTERN',
+              help="Run on every alias matching the pattern concurrently and concatenate the results "
+                   "with an alias column (not cached, not with --background, --chunksize, --profile, --max-bytes "
+                   "or within a transaction). Ex: 'MYSQL_SHARD_*'")
+    @argument('--parallel', type=int, default=8, help='Maximum number of aliases queried at a time (--aliases). Default: 8')
     @argument('sql', type=str, nargs='*')
     @line_cell_magic('sql')
     def exec_sql(self, line, cell=None):
         user_ns = self.shell.user_ns
 
-        args = parse_argstring(self.exec_sql, line)
+        # copy, the cached Namespace is shared by the calls with the same line
+        args = argparse.Namespace(**vars(self._parse_sql_line(line)))
 
         sql = ' '.join(args.sql)
 
@@ -134,41 +265,234 @@ class SqlMagic(Magics):
             print(f'File: {sql}')
             sql = pathlib.Path(sql).read_text()
 
-        # handle bind variables with sa.text (makes sql variable style agnostic)
-        params = dict()
-        sql = sa.text(sql)
-        sql = sql.compile()
+        profile = dbu.QueryProfile(enabled=args.profile)
 
-        for param in sql.binds:
-            if param in user_ns:
-                params[param] = user_ns[param]
-            else:
-                raw_data = input(f'Please enter value for {param}:')
-                params[param] = raw_data
+        with profile.phase('bind'):
+            # handle bind variables with sa.text (makes sql variable style agnostic)
+            params = dict()
+            sql, binds = dbu.compile_statement(sql, self.get_engine(args) if self.trans is None else self.conn)
 
+            for param in binds:
+                if param in user_ns:
+                    params[param] = user_ns[param]
+                else:
+                    raw_data = input(f'Please enter value for {param}:')
+                    params[param] = raw_data
+
+        callback = None
+        if args.callback:
+            if not args.chunksize:
+                print('Error: --callback requires --chunksize')
+                return
+            if args.callback not in user_ns:
+                print(f'Error: {args.callback} not found')
+                return
+            callback = user_ns[args.callback]
+
+        if args.aliases:
+            options = (('--background', args.background), ('--chunksize', args.chunksize), ('--callback', args.callback),
+                       ('--profile', args.profile), ('--max-bytes', args.max_bytes))
+            unsupported = [option for option, value in options if value]
+            if unsupported:
+                print(f"Error: --aliases can not be used with {', '.join(unsupported)}")
+                return
+            if self.trans is not None:
+                print('Error: --aliases can not be used within a transaction')
+                return
+            return self._exec_aliases(args, sql, params)
+
+        alias = '.'.join(filter(None, self.get_alias(args)))
+        if args.background:
+            if self.trans is not None:
+                print('Error: --background can not be used within a transaction')
+                return
+            return self._start_job(args.background, sql, self.get_engine(args), alias, params, args.commit)
+
+        cache_key = None
+        if (result_cache.enabled and not args.no_cache and not args.commit and not args.chunksize and not args.profile
+                and self.trans is None and is_read_only(sql.string)):
+            compact = args.compact or dbu.db_fetch.compact_results
+            cache_key = result_cache.make_key(sql.string, params, *self.get_alias(args)) + (compact,)
+            start = time.perf_counter()
+            df = result_cache.get(cache_key)
+            if df is not None:
+                db_history.record(sql.string, alias, params, time.perf_counter() - start,
+                                  *db_history.result_stats(df), source='cache')
+                return self._format_result(df)
+
+        max_bytes = dbu.parse_size(args.max_bytes) if args.max_bytes is not None else None
+        start = time.perf_counter()
         try:
             if self.trans is None:
                 engine = self.get_engine(args)
-                df = dbu.exec_sql(sql, engine=engine, params=params, commit=args.commit)
+                df = dbu.exec_sql(sql, engine=engine, params=params, commit=args.commit,
+                                  chunksize=args.chunksize, callback=callback, compact=args.compact or None,
+                                  profile=profile, max_bytes=max_bytes)
             else:
                 if self.trans.is_active:
-                    df = dbu.exec_sql(sql, engine=self.conn, params=params)
+                    df = dbu.exec_sql(sql, engine=self.conn, params=params,
+                                      chunksize=args.chunksize, callback=callback, compact=args.compact or None,
+                                      profile=profile, max_bytes=max_bytes)
                 else:
                     print('Error: Transaction is not active')
                     return
 
-            if df is not None and len(df) == 1 and len(df.columns) > 3:
-                return df.T
-            else:
+            duration = time.perf_counter() - start
+            if args.chunksize:
+                db_history.record(sql.string, alias, params, duration)
                 return df
+            rows, nbytes = db_history.result_stats(df)
+            db_history.record(sql.string, alias, params, duration, rows, profile.bytes or nbytes)
+            if cache_key is not None and isinstance(df, dbu.pd.DataFrame):
+                result_cache.put(cache_key, df)
+            df = self._format_result(df)
+            if args.profile:
+                profile.report()
+                if isinstance(df, dbu.pd.DataFrame):
+                    df.attrs['profile'] = profile.as_dict()
+            return df
         except sa.exc.DatabaseError as e:
+            db_history.record(sql.string, alias, params, time.perf_counter() - start, error=e)
             print(f'{e}')
 
+    def _exec_aliases(self, args, sql, params):
+        """%sql --aliases: fans sql out to the aliases matching the pattern, prints the per alias status"""
+        # magic_arguments keeps the quotes of '--aliases 'PATTERN''
+        aliases = dbu.match_db_aliases(args.aliases.strip('\'"'))
+        if not aliases:
+            print(f'No alias matches {args.aliases}')
+            return
+        print(f"Running on {len(aliases)} aliases: {', '.join(aliases)}")
+        start = time.perf_counter()
+        df, status = dbu.exec_sql_aliases(sql.statement, aliases, params, parallel=args.parallel,
+                                          commit=args.commit, compact=args.compact or None)
+        for r in status.itertuples(index=False):
+            db_history.record(sql.string, r.alias, params, r.seconds, None if dbu.pd.isna(r.rows) else int(r.rows),
+                              error=r.error)
+        dbu.print_tabular_data(status.assign(seconds=status.seconds.round(3),
+                                             status=status.error.fillna('ok')).drop(columns='error').astype(object).fillna('-'))
+        failed = status.error.notna().sum()
+        print(f'Total: {time.perf_counter() - start:.3f} s, {len(status) - failed} ok, {failed} failed')
+        df.attrs['aliases'] = status.to_dict('records')
+        return df
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _parse_sql_line(line):
+        """Parsed %sql arguments, cached as loops call the magic with the same line"""
+        return parse_argstring(SqlMagic.exec_sql, line)
+
+    def _start_job(self, name, sql, engine, alias, params, commit):
+        """Submits sql as a background job whose result is stored as name in the user namespace"""
+        job = self.jobs.get(name)
+        if job is not None and not job.done():
+            print(f'Error: job {name} is still running')
+            return
+
+        def on_done(df):
+            self.shell.user_ns[name] = df
+            db_history.record(sql.string, alias, params, job.elapsed, *db_history.result_stats(df))
+
+        def on_error(e):
+            db_history.record(sql.string, alias, params, job.elapsed, error=e)
+
+        job = dbu.QueryJob(name, sql.statement, engine, params, commit=commit, on_done=on_done, on_error=on_error)
+        self.jobs[name] = job.start()
+        print(f'Started background job {name}')
+        return job
+
+    @magic_arguments()
+    @argument('--slow', action='store_true', help='Per sql fingerprint latency (p50/p95) ordered by p95')
+    @argument('--top', type=int, default=20, help='Number of rows to show. Default: 20')
+    @argument('--fingerprint', type=str, help='Show the executions of one sql fingerprint')
+    @argument('--clear', action='store_true', help='Delete the history')
+    @argument('-f', '--as-frame', action='store_true', help='Return a DataFrame instead of printing')
+    @line_magic('sql_history')
+    def sql_history(self, line):
+        """Shows the %sql/%read_sql query history"""
+        args = parse_argstring(self.sql_history, line)
+
+        if args.clear:
+            db_history.clear_history()
+            return
+
+        if args.slow:
+            df = db_history.slow_queries(args.top)
+        else:
+            df = db_history.read_history(args.top, args.fingerprint)
+            if not df.empty:
+                df = df[['ts', 'source', 'fingerprint', 'alias', 'duration', 'rows', 'bytes', 'error', 'sql']]
+                df = df.assign(sql=df.sql.map(lambda s: ' '.join(s.split())[:80]))
+
+        if args.as_frame:
+            return df
+        dbu.print_tabular_data(df.fillna('-'))
+
+    @magic_arguments()
+    @argument('--cancel', type=str, metavar='NAME', help='Cancel a running job')
+    @argument('--clear', action='store_true', help='Forget finished jobs')
+    @line_magic('sql_jobs')
+    def sql_jobs(self, line):
+        """Lists/cancels the background %sql jobs"""
+        args = parse_argstring(self.sql_jobs, line)
+
+        if args.cancel:
+            if args.cancel not in self.jobs:
+                print(f'Error: job {args.cancel} not found')
+                return
+            self.jobs[args.cancel].cancel()
+            print(f'Cancelled job {args.cancel}')
+            return
+
+        if args.clear:
+            self.jobs = {name: job for name, job in self.jobs.items() if not job.done()}
+
+        df = dbu.pd.DataFrame([[job.name, job.status, job.rows, round(job.elapsed, 1),
+                                (str(job.error).splitlines() or [repr(job.error)])[0] if job.error else None]
+                               for job in self.jobs.values()],
+                              columns=['name', 'status', 'rows', 'elapsed_sec', 'error'])
+        dbu.print_tabular_data(df.fillna('-'))
+
+    @staticmethod
+    def _format_result(df):
+        """Single row results with many columns are transposed for readability"""
+        if isinstance(df, dbu.pd.DataFrame) and len(df) == 1 and len(df.columns) > 3:
+            return df.T
+        else:
+            return df
+
+    @magic_arguments()
+    @argument('action', nargs='?', choices=['on', 'off', 'clear', 'stats'], default='stats',
+              help='Enable/disable/clear the result cache or show its stats')
+    @argument('--max-bytes', type=str, help='Memory budget of the cache. Ex: 512MB, 2GB')
+    @argument('--ttl', type=float, help='Seconds after which cached results expire (<= 0: never)')
+    @line_magic('sql_cache')
+    def sql_cache(self, line):
+        """Controls the in-memory LRU cache of read only %sql results"""
+        args = parse_argstring(self.sql_cache, line)
+
+        if args.max_bytes:
+            result_cache.max_bytes = dbu.parse_size(args.max_bytes)
+        if args.ttl is not None:
+            result_cache.ttl = args.ttl if args.ttl > 0 else None
+
+        if args.action == 'on':
+            result_cache.enabled = True
+        elif args.action == 'off':
+            result_cache.enabled = False
+            result_cache.clear()
+        elif args.action == 'clear':
+            result_cache.clear()
+
+        stats = result_cache.stats()
+        print(', '.join(f'{k}: {v}' for k, v in stats.items()))
+
     @magic_arguments()
     @argument('table_name', type=str, help='Table name')
     @argument('-d', '--db-alias', type=str.upper, help='Db Alias: db_alias|db_alias.schema (mysql)')
     @argument('-f', '--as-frame', action='store_true', help='Return a DataFrame instaed of printing')
     @argument('-e', '--exact-match', action='store_true', help='Exact table name match')
+    @argument('--live', action='store_true', help='Query the db dictionary instead of the local catalog')
     @line_magic('get_tables')
     def get_tables(self, line):
         """Ipython extension function for finding tables
@@ -178,7 +502,50 @@ class SqlMagic(Magics):
         engine = self.get_engine(args)
 
         try:
-            df = dbu.get_tables(args.table_name, engine, print_result=not args.as_frame, exact_match=args.exact_match)
+            df = dbu.get_tables(args.table_name, engine, print_result=not args.as_frame, exact_match=args.exact_match,
+                                live=args.live)
+            if args.as_frame:
+                return df
+        except sa.exc.DatabaseError as e:
+            print(f'{e}')
+
+    @magic_arguments()
+    @argument('view_name', type=str, help='View name')
+    @argument('-d', '--db-alias', type=str.upper, help='Db Alias: db_alias|db_alias.schema (mysql)')
+    @argument('-f', '--as-frame', action='store_true', help='Return a DataFrame instaed of printing')
+    @argument('-e', '--exact-match', action='store_true', help='Exact view name match')
+    @argument('--live', action='store_true', help='Query the db dictionary instead of the local catalog')
+    @line_magic('get_views')
+    def get_views(self, line):
+        """Ipython extension function for finding views"""
+        args = parse_argstring(self.get_views, line)
+
+        engine = self.get_engine(args)
+
+        try:
+            df = dbu.get_views(args.view_name, engine, print_result=not args.as_frame, exact_match=args.exact_match,
+                               live=args.live)
+            if args.as_frame:
+                return df
+        except sa.exc.DatabaseError as e:
+            print(f'{e}')
+
+    @magic_arguments()
+    @argument('column_name', type=str, help='Column name')
+    @argument('-d', '--db-alias', type=str.upper, help='Db Alias: db_alias|db_alias.schema (mysql)')
+    @argument('-f', '--as-frame', action='store_true', help='Return a DataFrame instaed of printing')
+    @argument('-e', '--exact-match', action='store_true', help='Exact column name match')
+    @argument('--live', action='store_true', help='Query the db dictionary instead of the local catalog')
+    @line_magic('find_columns')
+    def find_columns(self, line):
+        """Ipython extension function for finding columns by name"""
+        args = parse_argstring(self.find_columns, line)
+
+        engine = self.get_engine(args)
+
+        try:
+            df = dbu.find_columns(args.column_name, engine, print_result=not args.as_frame,
+                                  exact_match=args.exact_match, live=args.live)
             if args.as_frame:
                 return df
         except sa.exc.DatabaseError as e:
@@ -188,20 +555,47 @@ class SqlMagic(Magics):
     @argument('table_name', type=str, help='Table name')
     @argument('-d', '--db-alias', type=str.upper, help='Db Alias: db_alias|db_alias.schema (mysql)')
     @argument('-f', '--as-frame', action='store_true', help='Return a DataFrame instead of printing')
+    @argument('--live', action='store_true', help='Query the db dictionary instead of the local catalog')
     @line_magic('desc_table')
     @line_magic('desc')
     def describe_table(self, line):
         """IPython extension to describe a table"""
-        args = parse_argstring(self.get_tables, line)
+        args = parse_argstring(self.describe_table, line)
 
         engine = self.get_engine(args)
 
         try:
-            df = dbu.desc_table(args.table_name, engine, print_result=not args.as_frame)
+            df = dbu.desc_table(args.table_name, engine, print_result=not args.as_frame, live=args.live)
             return df
         except sa.exc.DatabaseError as e:
             print(f'{e}')
 
+    @magic_arguments()
+    @argument('action', nargs='?', choices=['build', 'refresh', 'status', 'drop'], default='status',
+              help='Full crawl, incremental refresh, status or removal of the local catalog of the db')
+    @argument('-d', '--db-alias', type=str.upper, help='Db Alias: db_alias|db_alias.schema (mysql)')
+    @argument('--max-age', type=float, help='Seconds after which the catalogs are refreshed on lookup (<= 0: never)')
+    @line_magic('sql_catalog')
+    def sql_catalog(self, line):
+        """Manages the local catalog index used by %get_tables, %get_views, %find_columns and %desc"""
+        args = parse_argstring(self.sql_catalog, line)
+
+        if args.max_age is not None:
+            db_catalog.max_age = args.max_age if args.max_age > 0 else None
+
+        catalog = db_catalog.get_catalog(self.get_engine(args))
+        try:
+            if args.action == 'build':
+                catalog.refresh(full=True)
+            elif args.action == 'refresh':
+                catalog.refresh()
+            elif args.action == 'drop':
+                catalog.drop()
+        except sa.exc.DatabaseError as e:
+            print(f'{e}')
+
+        print(', '.join(f'{k}: {v}' for k, v in catalog.status().items()))
+
     @magic_arguments()
     @argument('-d', '--db-alias', type=str.upper, help='Db Alias: db_alias|db_alias.schema (mysql)')
     @argument('-f', '--as-frame', action='store_true', help='Return a DataFrame instead of printing')
@@ -215,6 +609,9 @@ class SqlMagic(Magics):
     @argument('--sort', type=int, help='Sort by column number')
     @argument('--asc', action='store_true', help='Ascending')
     @argument('--filter', action='append', nargs='+', help="Where condition. Ex: 'col_name >= 0'")
+    @argument('--approx', action='store_true',
+              help='Estimate from the optimizer statistics, or from a sample when they are missing or stale')
+    @argument('--sample-pct', type=float, help='Sample percentage of --approx estimates. Default: 1')
     @argument('table_name', type=str.lower, help='Table name')
     @argument('column_names', type=str.lower, nargs='*', help='Column names used to group by')
     @line_magic('get_table_counts')
@@ -243,17 +640,26 @@ class SqlMagic(Magics):
         try:
             df = dbu.get_table_counts(args['table_name'], args['column_names'], engine,
                                         agg, filters, args['sort'], args['asc'],
-                                        print_result=not args['as_frame'])
+                                        print_result=not args['as_frame'],
+                                        approx=args['approx'], sample_pct=args['sample_pct'])
             return df
         except sa.exc.DatabaseError as e:
             print(f'{e}')
+        except Exception as e:
+            print(f'Error: {e}')
 
 
     @magic_arguments()
     @argument('table_name', type=str.lower, help='Table name')
     @argument('-s', '--schema', type=str.lower, help='Schema')
     @argument('-d', '--db-alias', type=str.upper, help='Db Alias: db_alias|db_alias.schema (mysql)')
-    @argument('-r', '--random-sample-size', type=float, help='Fetch only percentage sample of the table')
+    @argument('-r', '--random-sample-size', type=float,
+              help='Fetch only percentage sample of the table (block sample on the rowid / primary key where possible)')
+    @argument('--rows', type=int, help='Fetch a uniform random sample of exactly N rows (reservoir sampling)')
+    @argument('-p', '--parallel', type=int, help='Load the table in N ranges over N parallel connections')
+    @argument('--cache', action='store_true', help='Reload from a local parquet snapshot while the table is unchanged')
+    @argument('--refresh', action='store_true', help='Refresh the local snapshot (with --cache)')
+    @argument('--compact', action='store_true', help='Downcast numeric columns and convert low cardinality strings to category')
     @line_magic('load_table')
     def load_table(self, line):
         """
@@ -264,17 +670,117 @@ class SqlMagic(Magics):
         engine = self.get_engine(args)
         print(args)
         try:
-            df = dbu.load_table(args.table_name, engine, schema=args.schema, sample_size=args.random_sample_size)
+            df = dbu.load_table(args.table_name, engine, schema=args.schema, sample_size=args.random_sample_size,
+                                cache=args.cache, refresh=args.refresh, compact=args.compact or None,
+                                parallel=args.parallel, sample_rows=args.rows)
             return df
-        except ValueError as e:
+        except (sa.exc.DatabaseError, ValueError) as e:
+            print(f'{e}')
+
+    @magic_arguments()
+    @argument('df', type=str, help='Name of the DataFrame variable')
+    @argument('table_name', type=str.lower, help='Table name: table|schema.table')
+    @argument('-d', '--db-alias', type=str.upper, help='Db Alias: db_alias|db_alias.schema (mysql)')
+    @argument('--if-exists', choices=['fail', 'append', 'replace', 'truncate'], default='fail',
+              help='What to do if the table exists. Default: fail')
+    @argument('--batch-size', type=int, default=10000, help='Rows per executemany batch. Default: 10000')
+    @argument('--no-bulk', action='store_true', help='Use executemany instead of LOAD DATA LOCAL INFILE (mysql)')
+    @line_magic('sql_write')
+    def sql_write(self, line):
+        """
+        Ipython extension function to write a DataFrame into a db table
+        Usage: %sql_write df table_name -d ALIAS --if-exists append
+        """
+        args = parse_argstring(self.sql_write, line)
+        if args.df not in self.shell.user_ns:
+            print(f'{args.df} not defined.')
+            return
+        schema, _, table_name = args.table_name.rpartition('.')
+        engine = self.get_engine(args)
+
+        try:
+            dbu.write_table(self.shell.user_ns[args.df], table_name, engine, schema=schema or None,
+                            if_exists=args.if_exists, batch_size=args.batch_size, bulk=not args.no_bulk)
+        except (sa.exc.DatabaseError, ValueError) as e:
+            print(f'{e}')
+
+    @magic_arguments()
+    @argument('path', nargs='?', help='Sql script file (line magic), the cell is the script otherwise')
+    @argument('-d', '--db-alias', type=str.upper, help='Db Alias: db_alias|db_alias.schema (mysql)')
+    @argument('--commit', action='store_true', help='Commit the statements. Default: roll back at the end')
+    @argument('--single-transaction', action='store_true',
+              help='Run the script in one transaction, rolled back on error (committed at the end with --commit)')
+    @argument('--parallel', type=int, default=4, help='Maximum number of concurrent -- @parallel SELECTs. Default: 4')
+    @argument('--continue-on-error', action='store_true',
+              help='Run the remaining statements after an error (not with --single-transaction, rolled back at the first error)')
+    @argument('--list', action='store_true', help='Only list the statements of the script')
+    @line_cell_magic('sql_script')
+    def sql_script(self, line, cell=None):
+        """
+        Runs a multi statement sql script (see db_script) and returns {name: DataFrame} of its queries.
+        Bind variables are taken from the user namespace.
+        Usage: %sql_script path.sql -d ALIAS [--commit] or %%sql_script -d ALIAS with the script in the cell
+        """
+        args = parse_argstring(self.sql_script, line)
+        if cell is not None:
+            script = cell
+        elif args.path and pathlib.Path(args.path).is_file():
+            script = pathlib.Path(args.path).read_text()
+        else:
+            print(f'File not found: {args.path}')
+            return
+
+        engine = self.get_engine(args)
+        statements = db_script.split_statements(script, engine.dialect.name)
+        if args.list:
+            dbu.print_tabular_data(dbu.pd.DataFrame(
+                [(n + 1, st.line, st.name or '-', 'yes' if st.parallel else '-', 'yes' if st.plsql else '-', st.sql)
+                 for n, st in enumerate(statements)], columns=['n', 'line', 'name', 'parallel', 'plsql', 'statement']))
+            return
+
+        user_ns = self.shell.user_ns
+        binds = {b for st in statements if not st.plsql for b in dbu.compile_statement(st.sql, engine)[1]}
+        params = {b: user_ns[b] for b in binds if b in user_ns}
+
+        alias = '.'.join(filter(None, self.get_alias(args)))
+        start = time.perf_counter()
+        try:
+            results, report = db_script.run_script(statements, engine, params, commit=args.commit,
+                                                   single_transaction=args.single_transaction,
+                                                   parallel=args.parallel, stop_on_error=not args.continue_on_error)
+        except sa.exc.DatabaseError as e:
             print(f'{e}')
+            return
+        except Exception as e:
+            print(f'Error: {e}')
+            return
+
+        for st, (_, r) in zip(statements, report.iterrows()):
+            if r.status != 'skipped':
+                db_history.record(st.sql, alias, params, r.seconds, None if dbu.pd.isna(r.rows) else int(r.rows),
+                                  error=None if r.status.startswith('ok') else r.status, source='script')
+        dbu.print_tabular_data(report.fillna('-'))
+        print(f'Total: {time.perf_counter() - start:.3f} s')
+        return results
 
 
 def load_ipython_extension(ipython):
     global _loaded
     if not _loaded:
-        ipython.register_magics(SqlMagic)
+        magics = SqlMagic(ipython)
+        ipython.register_magics(magics)
         _loaded = True
 
+        if context_matcher is not None:
+            @context_matcher()
+            def sql_name_matcher(context):
+                return magics.complete_names(context)
+
+            ipython.Completer.custom_matchers.append(sql_name_matcher)
+        if import_time > IMPORT_TIME_BUDGET:
+            print(f'Warning: sql_ext import took {import_time * 1000:.0f} ms '
+                  f'(budget {IMPORT_TIME_BUDGET * 1000:.0f} ms)')
+
 
 _loaded = False
+import_time = time.perf_counter() - _import_start
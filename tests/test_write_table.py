@@ -0,0 +1,97 @@
+"""
+Source: test_write_table.py
+
+Purpose: Round trip of write_table, NULLs included, through the LOAD DATA LOCAL INFILE text
+(and a mysql table when IPYTHON_SQL_EXT_TEST_MYSQL holds a sqlalchemy url) and through sqlite.
+"""
+
+import os
+import sys
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+os.environ.setdefault('SQLALCHEMY_SILENCE_UBER_WARNING', '1')
+
+import pytest
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+import db_utils as dbu
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'id': [1, 2, 3],
+        'qty': pd.array([10, None, 30], dtype='Int64'),
+        'price': [1234567.89, np.nan, 0.5],
+        'name': ['plain', None, 'tab\there\\N back\\slash\nnewline'],
+        'flag': [True, False, True],
+        'ts': pd.to_datetime(['2024-01-02 03:04:05', None, '2024-12-31 00:00:00']),
+    })
+
+
+def _parse_load_data(text):
+    """Reads LOAD DATA ... escaped by '\\' text back the way mysql does (None for \\N)"""
+    unescape = {'t': '\t', 'n': '\n', 'r': '\r', '0': '\0', '\\': '\\'}
+    rows = list()
+    for line in text.split('\n')[:-1]:
+        row = list()
+        for field in line.split('\t'):
+            if field == '\\N':
+                row.append(None)
+                continue
+            out, i = list(), 0
+            while i < len(field):
+                if field[i] == '\\':
+                    out.append(unescape.get(field[i + 1], field[i + 1]))
+                    i += 2
+                else:
+                    out.append(field[i])
+                    i += 1
+            row.append(''.join(out))
+        rows.append(row)
+    return rows
+
+
+def test_load_data_text_nulls(df):
+    text = dbu._load_data_text(df)
+    rows = _parse_load_data(text)
+    assert len(rows) == 3
+    assert rows[1] == ['2', None, None, None, '0', None]
+    assert rows[2][3] == 'tab\there\\N back\\slash\nnewline'
+    assert rows[0][2] == '1234567.89'
+    assert rows[0][5] == '2024-01-02 03:04:05.000000'
+
+
+def test_load_data_text_empty(df):
+    assert dbu._load_data_text(df.head(0)) == ''
+
+
+def _check_round_trip(df, back):
+    assert back['qty'].isna().tolist() == [False, True, False]
+    assert back['price'].isna().tolist() == [False, True, False]
+    assert back['name'].isna().tolist() == [False, True, False]
+    assert back['ts'].isna().tolist() == [False, True, False]
+    assert back['name'].iloc[2] == df['name'].iloc[2]
+    assert back['price'].iloc[0] == pytest.approx(1234567.89)
+
+
+def test_write_table_sqlite(df, tmp_path):
+    engine = sa.create_engine(f'sqlite:///{tmp_path / "t.db"}')
+    assert dbu.write_table(df, 't', engine) == 3
+    back = pd.read_sql('select * from t order by id', engine)
+    _check_round_trip(df, back)
+
+
+@pytest.mark.skipif(not os.environ.get('IPYTHON_SQL_EXT_TEST_MYSQL'), reason='IPYTHON_SQL_EXT_TEST_MYSQL not set')
+def test_write_table_mysql_load_data(df):
+    engine = sa.create_engine(os.environ['IPYTHON_SQL_EXT_TEST_MYSQL'])
+    try:
+        dbu.write_table(df, 'ipython_sql_ext_write_test', engine, if_exists='replace', bulk=True)
+        back = pd.read_sql('select * from ipython_sql_ext_write_test order by id', engine)
+        _check_round_trip(df, back)
+    finally:
+        with engine.begin() as conn:
+            conn.exec_driver_sql('drop table if exists ipython_sql_ext_write_test')
+        engine.dispose()